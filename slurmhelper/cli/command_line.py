@@ -9,7 +9,12 @@ import pandas as pd
 from argparse import ArgumentError
 
 from .parser import valid_specs
-from ..jobs.cli_helpers import prep_job, prep_job_array, generate_run_scripts
+from ..jobs.cli_helpers import (
+    prep_job,
+    prep_job_array,
+    plan_job_array,
+    generate_run_scripts,
+)
 from ..utils.io import (
     calculate_directories,
     calculate_directories_midwayscratch,
@@ -21,8 +26,16 @@ from ..utils.reporting import (
     list_slurm,
     check_runtimes,
     check_completed,
+    watch_completed,
     check_queue,
+    check_usage,
+    check_status,
+    check_runs,
+    check_checksums,
+    check_crosswalk,
+    check_events,
     check_log,
+    update_output_index,
 )
 
 
@@ -77,9 +90,9 @@ class SlurmhelperCLI:
         # Compile job list, if required
         # below are the exceptions where one wouldn't need a job list:
         if not (
-            (args.operation in {"list", "init", "submit"})
+            (args.operation in {"list", "init", "submit", "submit-many"})
             or (
-                args.operation == "gen-scripts"
+                args.operation in {"gen-scripts", "retry"}
                 and args.ids is None
                 and args.range is None
             )
@@ -185,6 +198,7 @@ class SlurmhelperCLI:
     def init(self):
         initialize_directories(self.paths)
         self.__validate_and_copy_db(self.args.db[0])
+        self.__initialize_state_db()
         print("Directory initialization concluded.")
         if self.args.full:
             print("The --full flag was used, so scripts will now be generated.")
@@ -194,7 +208,31 @@ class SlurmhelperCLI:
         from ..jobs.submit import submit_sbatch
 
         sb_id = self.args.sbatch_id[0]
-        submit_sbatch(sb_id, self.paths)
+        submit_sbatch(sb_id, self.paths, self.config)
+
+    def submit_many(self):
+        from ..jobs.submit import submit_many
+
+        if self.args.sbatch_ids is not None:
+            sb_ids = self.args.sbatch_ids
+        else:
+            sb_ids = list(
+                range(self.args.sbatch_range[0], self.args.sbatch_range[1] + 1)
+            )
+        submit_many(
+            sb_ids,
+            self.paths,
+            self.config,
+            n_workers=self.args.workers,
+            max_retries=self.args.max_retries,
+            backoff=self.args.backoff,
+        )
+
+    def retry(self):
+        from ..jobs.retry import retry_jobs
+
+        jl = self.job_list if hasattr(self, "job_list") else None
+        retry_jobs(self.config, self.paths, self.args, jl)
 
     def list(self):
         list_slurm(self.paths)
@@ -207,17 +245,17 @@ class SlurmhelperCLI:
         print("Script generation operation concluded.")
 
     def copy(self):
-        copy_or_clean(self.job_list, "copy", self.paths["job_scripts"])
+        copy_or_clean(self.job_list, "copy", self.paths["job_scripts"], self.paths)
 
     def clean(self):
-        copy_or_clean(self.job_list, "clean", self.paths["job_scripts"])
+        copy_or_clean(self.job_list, "clean", self.paths["job_scripts"], self.paths)
 
     def reset(self):
         self.logger.info("Will clean first, and copy next!")
 
         try:
-            copy_or_clean(self.job_list, "clean", self.paths["job_scripts"])
-            copy_or_clean(self.job_list, "copy", self.paths["job_scripts"])
+            copy_or_clean(self.job_list, "clean", self.paths["job_scripts"], self.paths)
+            copy_or_clean(self.job_list, "copy", self.paths["job_scripts"], self.paths)
         except Exception as e:
             raise e
 
@@ -265,6 +303,9 @@ class SlurmhelperCLI:
 
         prep_job_array(self.config, self.job_list, self.paths, self.args)
 
+    def plan(self):
+        plan_job_array(self.config, self.job_list, self.paths, self.args)
+
     def check(self):
         if hasattr(self, "job_list"):
             jl = self.job_list
@@ -274,9 +315,52 @@ class SlurmhelperCLI:
         self.logger.debug(jl)
 
         if self.args.check_operation == "queue":
-            check_queue()
+            check_queue(
+                self.paths, ttl=self.args.max_age, show_jobs=self.args.show_jobs
+            )
         elif self.args.check_operation == "runtime":
-            check_runtimes(self.paths, self.config, jl)
+            check_runtimes(
+                self.paths,
+                self.config,
+                jl,
+                rescan=self.args.rescan,
+                group_by=self.args.group_by,
+                near_limit=self.args.near_limit,
+                export=self.args.export,
+            )
+        elif self.args.check_operation == "status":
+            check_status(
+                self.paths,
+                self.config,
+                jl,
+                rescan=self.args.rescan,
+                export=self.args.export,
+            )
+        elif self.args.check_operation == "index":
+            update_output_index(
+                self.paths, self.config, jl, rebuild=self.args.rebuild
+            )
+        elif self.args.check_operation == "checksums":
+            check_checksums(
+                self.paths,
+                self.config,
+                jl,
+                algorithm=self.args.algorithm,
+                verify=self.args.verify,
+                n_workers=self.args.workers,
+            )
+        elif self.args.check_operation == "runs":
+            check_runs(jl, self.paths, self.args, self.config)
+        elif self.args.check_operation == "completion" and self.args.watch:
+            watch_completed(
+                self.paths,
+                self.config,
+                job_list=jl,
+                interval=self.args.interval,
+                failed_report=self.args.show_failed_logs,
+                rescan=self.args.rescan,
+                triage=self.args.triage,
+            )
         elif self.args.check_operation == "completion":
             check_completed(
                 self.paths,
@@ -284,6 +368,22 @@ class SlurmhelperCLI:
                 job_list=jl,
                 return_completed_list=False,
                 failed_report=self.args.show_failed_logs,
+                rescan=self.args.rescan,
+                triage=self.args.triage,
+            )
+        elif self.args.check_operation == "usage":
+            check_usage(
+                self.paths,
+                sbatch_ids=self.args.sbatch_ids,
+                slurm_ids=self.args.slurm_ids,
+                since_days=self.args.since,
+                refresh=self.args.refresh,
+            )
+        elif self.args.check_operation == "crosswalk":
+            check_crosswalk(self.paths, jl, slurm_id=self.args.slurm_id)
+        elif self.args.check_operation == "events":
+            check_events(
+                self.paths, jl, freq=self.args.freq, export=self.args.export
             )
         elif self.args.check_operation == "log":
             if self.args.job_id is not None:
@@ -309,6 +409,17 @@ class SlurmhelperCLI:
     def __load_database(self):
         self.db = pd.read_csv(os.path.join(self.paths["base"], "db.csv"))
 
+    def __initialize_state_db(self):
+        from ..db import SlurmhelperDB
+
+        self.__load_database()
+        state_db = SlurmhelperDB(self.paths)
+        if state_db.is_initialized:
+            self.logger.info("Updating job records in the existing state DB")
+            state_db.add_user_jobs(self.db)
+        else:
+            state_db.initialize(self.paths, self.db, self.config)
+
     def __validate_and_copy_db(self, db_file):
         self.logger.info(f"validating file {db_file}")
         if not is_valid_db(db_file):
@@ -4,6 +4,10 @@ import os
 
 from slurmhelper.specs import get_builtin_specs
 
+# resources requested by sbatch scripts, unless specified
+DEFAULT_N_TASKS = 8
+DEFAULT_MEMORY = 16000  # MB
+
 valid_specs = get_builtin_specs()
 valid_spec_names = valid_specs.keys()
 
@@ -118,7 +122,7 @@ def add_sbatch_args(parser):
         type=int,
         nargs=1,
         action="store",
-        default=[8],
+        default=[DEFAULT_N_TASKS],
         help="Number of threads to request",
     )
     parser.add_argument(
@@ -127,7 +131,7 @@ def add_sbatch_args(parser):
         type=int,
         nargs=1,
         action="store",
-        default=[16000],
+        default=[DEFAULT_MEMORY],
         help="Memory (in mb) to request",
     )
     parser.add_argument(
@@ -273,6 +277,28 @@ def add_dry_option(parser):
     return parser
 
 
+def add_rescan_option(parser, help=None):
+    """
+    Helper function. Adds option to bypass the job status cache to parser object.
+    :param parser: subcommand parser object
+    :param help: help text, for subcommands that cache more than job statuses; None
+        for the default
+    :return: parser (enhanced with new arguments!)
+    """
+    if help is None:
+        help = (
+            "Re-parse all job logs, rather than only those that changed since "
+            "they were last checked."
+        )
+    parser.add_argument(
+        "--rescan",
+        action="store_true",
+        required=False,
+        help=help,
+    )
+    return parser
+
+
 def add_clean_and_copy_flag(parser):
     """
     Helper function. Adds clean and copy (for prep commands) flags to parser object.
@@ -419,6 +445,136 @@ def build_parser():
     submit = subparsers.add_parser("submit", help="submit an sbatch job nicely")
     submit = add_parser_options(submit, "wd", "spec", "sbatch-id")
 
+    # create the parser for the "SUBMIT-MANY" command
+    # -----------------------------------------------------------------------
+    submit_many = subparsers.add_parser(
+        "submit-many",
+        help="submit several sbatch jobs, a few at a time, retrying when the "
+        "scheduler is busy or the queue limit is hit",
+    )
+    submit_many = add_parser_options(submit_many, "wd", "spec")
+    submit_many_ids = submit_many.add_mutually_exclusive_group(required=True)
+    submit_many_ids.add_argument(
+        "--sbatch-ids",
+        "--sbatch_ids",
+        type=int,
+        nargs="+",
+        help="sbatch ids of the jobs to submit",
+    )
+    submit_many_ids.add_argument(
+        "--sbatch-range",
+        "--sbatch_range",
+        type=int,
+        nargs=2,
+        help="range of sbatch ids of the jobs to submit (inclusive)",
+    )
+    submit_many.add_argument(
+        "--workers",
+        type=int,
+        default=4,
+        help="maximum number of sbatch calls to run at once (default: 4)",
+    )
+    submit_many.add_argument(
+        "--max-retries",
+        "--max_retries",
+        type=int,
+        default=5,
+        help="number of times to retry an sbatch call that failed with 'Socket "
+        "timed out' or QOSMaxSubmitJobPerUserLimit (default: 5)",
+    )
+    submit_many.add_argument(
+        "--backoff",
+        type=float,
+        default=5,
+        help="seconds to wait before retrying a failed sbatch call; doubled at "
+        "each retry (default: 5)",
+    )
+
+    # create the parser for the "RETRY" command
+    # -----------------------------------------------------------------------
+    retry = subparsers.add_parser(
+        "retry",
+        help="prepare and submit new sbatch arrays for failed jobs, and for "
+        "submitted jobs that left no log",
+    )
+    retry = add_parser_options(retry, "wd", "spec", "ids-optional", "dry", "do-cc")
+    retry = add_rescan_option(retry)
+    retry.add_argument(
+        "--max-attempts",
+        "--max_attempts",
+        type=int,
+        default=3,
+        help="do not retry jobs that were submitted this many times already "
+        "(default: 3)",
+    )
+    retry.add_argument(
+        "--bump-time",
+        "--bump_time",
+        type=float,
+        metavar="FACTOR",
+        help="give jobs that timed out the wall time of their last attempt times "
+        "this factor (one job per array element)",
+    )
+    retry.add_argument(
+        "--bump-memory",
+        "--bump_memory",
+        type=float,
+        metavar="FACTOR",
+        help="give jobs that ran out of memory the memory of their last attempt "
+        "times this factor",
+    )
+    retry.add_argument(
+        "--time",
+        "-t",
+        type=valid_time,
+        action="store",
+        help="Manually specify wall time for the new sbatch arrays (hh:mm:ss), "
+        "overriding --bump-time",
+    )
+    retry.add_argument(
+        "--n-tasks",
+        "--n_tasks",
+        "-n",
+        type=int,
+        nargs=1,
+        action="store",
+        help="Number of threads to request (default: as in the last attempt)",
+    )
+    retry.add_argument(
+        "--memory",
+        "-m",
+        type=int,
+        nargs=1,
+        action="store",
+        help="Memory (in mb) to request, overriding --bump-memory (default: as in "
+        "the last attempt)",
+    )
+    retry.add_argument(
+        "--par-target",
+        "--par_target",
+        type=int,
+        default=0,
+        choices=range(0, 101),
+        metavar="[0-100]",
+        action="store",
+        help="How much to favor parallelization over serialization when packing "
+        "jobs into array elements; see prep-array (default: 0)",
+    )
+    retry.add_argument(
+        "--rate-limit",
+        "--rate_limit",
+        type=int,
+        action="store",
+        help="Limit the number of concurrent array jobs to the number provided, if "
+        "specified.",
+    )
+    retry.add_argument(
+        "--no-submit",
+        "--no_submit",
+        action="store_true",
+        help="Prepare the new sbatch arrays, but do not submit them.",
+    )
+
     # create the parser for the "COPY" command
     # -----------------------------------------------------------------------
     copy = subparsers.add_parser("copy", help="copy inputs to working directory")
@@ -452,6 +608,19 @@ def build_parser():
         action="store",
         help="Manual override to specify number" "of parcels to divide yo jobz",
     )
+    prep_array.add_argument(
+        "--par-target",
+        "--par_target",
+        type=int,
+        default=0,
+        choices=range(0, 101),
+        metavar="[0-100]",
+        action="store",
+        help="How much to favor parallelization (shorter array elements) over "
+        "serialization (fewer array elements), from 0 (fewest elements that fit "
+        "within max_job_time; default) to 100 (one element per job). Ignored if "
+        "--n-parcels is provided.",
+    )
     prep_array.add_argument(
         "--rate-limit",
         "--rate_limit",
@@ -460,6 +629,65 @@ def build_parser():
         help="Limit the number of concurrent array jobs to"
         "the number provided, if specified.",
     )
+    prep_array.add_argument(
+        "--group-by",
+        "--group_by",
+        type=str,
+        nargs="+",
+        action="store",
+        help="Column(s) of your db.csv identifying jobs that share inputs (e.g., "
+        "subject session). Such jobs will be kept in the same array element where "
+        "possible. Overrides parcel_group_by in your spec, if any.",
+    )
+    prep_array.add_argument(
+        "--auto-limits",
+        "--auto_limits",
+        action="store_true",
+        help="Read scheduler limits (e.g., MaxArraySize) from `scontrol show config`, "
+        "overriding any scheduler_limits provided in your spec. Arrays exceeding these "
+        "limits are split into several arrays with consecutive sbatch ids.",
+    )
+
+    # create the parser for the "PLAN" command
+    # -----------------------------------------------------------------------
+    plan = subparsers.add_parser(
+        "plan",
+        help="simulate expected makespan and cost of different sbatch array layouts",
+    )
+    plan = add_parser_options(plan, "wd", "spec", "ids")
+    plan.add_argument(
+        "--n-parcels",
+        "--n_parcels",
+        nargs="+",
+        type=int,
+        action="store",
+        help="Number(s) of parcels to simulate. If not provided, a few sensible "
+        "options are chosen based on your spec.",
+    )
+    plan.add_argument(
+        "--rate-limit",
+        "--rate_limit",
+        nargs="+",
+        type=int,
+        action="store",
+        help="Rate limit(s) (max concurrent array jobs) to simulate. If not "
+        "provided, no rate limit is assumed.",
+    )
+    plan.add_argument(
+        "--strategy",
+        nargs="+",
+        choices=["even", "balanced"],
+        default=["even", "balanced"],
+        action="store",
+        help="Packing strategies to simulate. Only even packing is recommended, as "
+        "it is the only one prep-array builds.",
+    )
+    plan.add_argument(
+        "--no-history",
+        "--no_history",
+        action="store_true",
+        help="Do not use runtimes of completed jobs; rely only on your spec's timing.",
+    )
 
     # create the parser for the "GENSCRIPTS" command
     # -----------------------------------------------------------------------
@@ -477,22 +705,220 @@ def build_parser():
     check_queue = check_subparsers.add_parser(
         "queue", help="check user queue on sbatch"
     )
+    check_queue = add_parser_options(check_queue, "wd", "spec")
+    check_queue.add_argument(
+        "--max-age",
+        "--max_age",
+        type=int,
+        default=60,
+        help="reuse the last queue snapshot taken from this working directory if it "
+        "is at most this many seconds old; 0 to always query squeue (default: 60)",
+    )
+    check_queue.add_argument(
+        "--show-jobs",
+        "--show_jobs",
+        action="store_true",
+        help="list the job ids run by each running sbatch job (or array element)",
+    )
     # ~~~ runtime ~~~
     check_runtimes = check_subparsers.add_parser(
         "runtime", help="describe runtime statistics for completed jobs"
     )
     check_runtimes = add_parser_options(check_runtimes, "wd", "spec", "ids")
+    check_runtimes = add_rescan_option(check_runtimes)
+    check_runtimes.add_argument(
+        "--group-by",
+        "--group_by",
+        nargs="+",
+        required=False,
+        help="columns in your database file to summarize runtimes by "
+        "(e.g., subject session)",
+    )
+    check_runtimes.add_argument(
+        "--near-limit",
+        "--near_limit",
+        type=float,
+        default=0.9,
+        help="flag jobs whose runtime (plus ramp up time) reaches this fraction of "
+        "max_job_time (default: 0.9)",
+    )
+    check_runtimes.add_argument(
+        "--export",
+        choices=["csv", "parquet"],
+        required=False,
+        help="save per-job runtimes and their summary to the checks directory, in "
+        "this format (parquet requires pyarrow)",
+    )
+    # ~~ status ~~~
+    check_status = check_subparsers.add_parser(
+        "status",
+        help="save a table of every job's status (log, success, runtime, outputs, "
+        "leftover inputs and work dirs) to the checks directory",
+    )
+    check_status = add_parser_options(check_status, "wd", "spec", "ids-optional")
+    check_status = add_rescan_option(check_status)
+    check_status.add_argument(
+        "--export",
+        choices=["csv", "parquet"],
+        default="csv",
+        help="format to save the table in (default: csv; parquet requires pyarrow)",
+    )
+    # ~~ runs ~~~
+    check_runs = check_subparsers.add_parser(
+        "runs",
+        help="validate jobs: outputs, leftover inputs and work dirs, logs, and any "
+        "tests declared in the spec (job_tests)",
+    )
+    check_runs = add_parser_options(check_runs, "wd", "spec", "ids-optional")
+    check_runs = add_rescan_option(
+        check_runs,
+        help="Re-parse all job logs, re-list all output directories and re-run all "
+        "tests, rather than only those whose inputs changed since they were last "
+        "checked.",
+    )
+    # ~~ index ~~~
+    check_index = check_subparsers.add_parser(
+        "index",
+        help="update the index of job output directories used by other checks "
+        "(only directories modified since they were last indexed are listed)",
+    )
+    check_index = add_parser_options(check_index, "wd", "spec", "ids-optional")
+    check_index.add_argument(
+        "--rebuild",
+        action="store_true",
+        required=False,
+        help="list all output directories again, e.g. if files were modified in "
+        "place",
+    )
+    # ~~ checksums ~~~
+    check_checksums = check_subparsers.add_parser(
+        "checksums",
+        help="record checksums of job output files (only files that changed since "
+        "they were last hashed are hashed again)",
+    )
+    check_checksums = add_parser_options(
+        check_checksums, "wd", "spec", "ids-optional"
+    )
+    check_checksums.add_argument(
+        "--algorithm",
+        choices=["xxh3_128", "xxh64", "blake2b", "sha256"],
+        required=False,
+        help="hash algorithm (default: xxh3_128 if the xxhash package is installed, "
+        "blake2b otherwise)",
+    )
+    check_checksums.add_argument(
+        "--verify",
+        action="store_true",
+        required=False,
+        help="hash all files again, and report files whose contents changed without "
+        "their size or modification time changing",
+    )
+    check_checksums.add_argument(
+        "--workers",
+        type=int,
+        required=False,
+        help="number of processes to hash files with (default: number of CPUs)",
+    )
     # ~~ completed ~~~
     check_completed = check_subparsers.add_parser(
         "completion", help="survey which jobs have been completed so far"
     )
     check_completed = add_parser_options(check_completed, "wd", "spec", "ids-optional")
+    check_completed = add_rescan_option(check_completed)
     check_completed.add_argument(
         "--show-failed-logs",
         "--show_failed_logs",
         help="print the job logs for failed jobs",
         action="store_true",
     )
+    check_completed.add_argument(
+        "--triage",
+        action="store_true",
+        help="group failed jobs by the error found at the end of their logs",
+    )
+    check_completed.add_argument(
+        "--watch",
+        action="store_true",
+        help="keep following progress (completed/failed/running counts, throughput "
+        "and ETA) until all jobs are done, or you hit Ctrl+C",
+    )
+    check_completed.add_argument(
+        "--interval",
+        type=int,
+        default=30,
+        help="seconds between refreshes when using --watch (default: 30)",
+    )
+    # ~~ usage ~~~
+    check_usage = check_subparsers.add_parser(
+        "usage",
+        help="report resource usage (memory, cpu, time) of submitted jobs, from sacct",
+    )
+    check_usage = add_parser_options(check_usage, "wd", "spec")
+    check_usage_ids = check_usage.add_mutually_exclusive_group(required=True)
+    check_usage_ids.add_argument(
+        "--sbatch-ids",
+        "--sbatch_ids",
+        type=int,
+        nargs="+",
+        help="sbatch ids of the jobs to report on",
+    )
+    check_usage_ids.add_argument(
+        "--slurm-ids",
+        "--slurm_ids",
+        type=int,
+        nargs="+",
+        help="Slurm job ids (as seen in squeue) of the jobs to report on",
+    )
+    check_usage.add_argument(
+        "--since",
+        type=int,
+        default=30,
+        help="how many days back to look for jobs, when looking them up by sbatch id "
+        "(default: 30)",
+    )
+    check_usage.add_argument(
+        "--refresh",
+        action="store_true",
+        help="query sacct again, even for jobs whose usage was cached",
+    )
+    # ~~ crosswalk ~~~
+    check_crosswalk = check_subparsers.add_parser(
+        "crosswalk",
+        help="look up which Slurm jobs (and array tasks) ran which jobs, as recorded "
+        "when submitting them",
+    )
+    check_crosswalk = add_parser_options(
+        check_crosswalk, "wd", "spec", "ids-optional"
+    )
+    check_crosswalk.add_argument(
+        "--slurm-id",
+        "--slurm_id",
+        type=str,
+        required=False,
+        help="list the jobs run by this Slurm job, or by one of its array tasks "
+        "(e.g., 18334739 or 18334739_117), instead",
+    )
+    # ~~ events ~~~
+    check_events = check_subparsers.add_parser(
+        "events",
+        help="summarize the event log of job lifecycle transitions: queue waits, "
+        "run times and throughput over time",
+    )
+    check_events = add_parser_options(check_events, "wd", "spec", "ids-optional")
+    check_events.add_argument(
+        "--freq",
+        type=str,
+        default="60min",
+        help="time bins to count finished jobs in, as a pandas frequency string "
+        "(e.g., 15min, 60min, 1D; default: 60min)",
+    )
+    check_events.add_argument(
+        "--export",
+        choices=["csv", "parquet"],
+        required=False,
+        help="save the timeline of every attempt at running each job to the checks "
+        "directory, in this format (parquet requires pyarrow)",
+    )
     check_log = check_subparsers.add_parser("log", help="print out a given log")
     check_log = add_parser_options(check_log, "wd", "spec")
     check_log_printing = check_log.add_mutually_exclusive_group()
@@ -2,4 +2,4 @@
 Submodule for storing and serializing stuff...
 """
 
-from classes import SlurmhelperDB
+from .classes import SlurmhelperDB, StateCache
@@ -1,104 +1,527 @@
+import json
 import logging
-import pickledb
+import sqlite3
+import time
+from contextlib import closing, contextmanager
+from pathlib import Path
 
 logger = logging.getLogger("cli")
 
+# project state store, kept in the working directory
+STATE_DB_FILE = "state.sqlite"
+
 
 class SlurmhelperDB:
     """
-    Class for interacting with the internal database.
+    Class for interacting with the internal database: a SQLite file in the working
+    directory holding the project's jobs, sbatch jobs (and the job ids run by each
+    of their array elements), their submissions to Slurm, and job status events.
+    Every update touches only the rows concerned, and the file is in WAL mode so that
+    concurrent slurmhelper calls can read while another one writes.
     """
 
+    SCHEMA_VERSION = 1
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)",
+        "CREATE TABLE IF NOT EXISTS jobs ("
+        "order_id INTEGER PRIMARY KEY, record TEXT, state TEXT, updated_at REAL)",
+        "CREATE TABLE IF NOT EXISTS sbatch_jobs ("
+        "sbatch_id INTEGER PRIMARY KEY, script TEXT, is_array INTEGER, "
+        "created_at REAL)",
+        "CREATE TABLE IF NOT EXISTS array_elements ("
+        "sbatch_id INTEGER, array_task INTEGER, order_id INTEGER, "
+        "PRIMARY KEY (sbatch_id, array_task, order_id))",
+        "CREATE INDEX IF NOT EXISTS array_elements_order_id "
+        "ON array_elements (order_id)",
+        "CREATE TABLE IF NOT EXISTS submissions ("
+        "slurm_job_id INTEGER PRIMARY KEY, sbatch_id INTEGER, job_name TEXT, "
+        "spec_name TEXT, spec_version TEXT, submitted_at REAL)",
+        "CREATE INDEX IF NOT EXISTS submissions_sbatch_id ON submissions (sbatch_id)",
+        "CREATE TABLE IF NOT EXISTS events ("
+        "event_id INTEGER PRIMARY KEY AUTOINCREMENT, order_id INTEGER, "
+        "sbatch_id INTEGER, slurm_id TEXT, event TEXT, detail TEXT, at REAL)",
+        "CREATE INDEX IF NOT EXISTS events_order_id ON events (order_id, at)",
+        "CREATE INDEX IF NOT EXISTS events_sbatch_id ON events (sbatch_id, at)",
+    )
+
     def __init__(self, dirs):
         """
-        Instantiates a SlurmhelperDB object.
+        Instantiates a SlurmhelperDB object, creating the database file (with no
+        contents) if it does not exist yet.
         :param dirs: dict, result of the compute_paths() function
         """
-        from pathlib import Path
+        self.db_file = Path(dirs["base"]) / STATE_DB_FILE
 
-        self.db_file = Path(dirs["base"]) / "database.db"
+        with closing(self._connect()) as con, con:
+            con.execute("PRAGMA journal_mode = WAL")
+            if con.execute("PRAGMA user_version").fetchone()[0] != self.SCHEMA_VERSION:
+                for statement in self.SCHEMA:
+                    con.execute(statement)
+                con.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION:d}")
 
-        if self.db_file.exists():
+        if self.is_initialized:
             logger.info(f"Slurmhelper DB file exists in: {str(self.db_file)}.")
-            self.__is_initialized = True
         else:
             logger.info(
-                "Slurmhelper DB file does not exist. Make sure you initialize it before moving forward."
+                "Slurmhelper DB has not been initialized. Make sure you initialize it "
+                "before moving forward."
+            )
+
+    def _connect(self):
+        con = sqlite3.connect(str(self.db_file), timeout=30)
+        con.execute("PRAGMA foreign_keys = ON")
+        return con
+
+    def __repr__(self):
+        return f"SlurmhelperDB instance for interacting with {self.db_file}"
+
+    def __str__(self):
+        return self.__repr__()
+
+    @property
+    def is_initialized(self):
+        return self.get_meta("dirs") is not None
+
+    def get_meta(self, key):
+        """
+        Retrieve a project-level setting (e.g., dirs, job_spec).
+        :param key: str
+        :return: the value stored (decoded from JSON), or None
+        """
+        with closing(self._connect()) as con:
+            row = con.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def set_meta(self, key, value):
+        """
+        Store a project-level setting.
+        :param key: str
+        :param value: anything JSON-serializable (other objects are stored as str)
+        :return:
+        """
+        with closing(self._connect()) as con, con:
+            con.execute(
+                "INSERT OR REPLACE INTO meta VALUES (?, ?)",
+                (key, json.dumps(value, default=str)),
             )
-            self.__is_initialized = False
 
     def initialize(self, dirs, job_df, job_spec):
         """
-        Creates a pickleDB database from scratch for a given project.
+        Fills in the database from scratch for a given project.
         :param dirs: dict, result of the compute_paths() function
         :param job_df: pandas.DataFrame (contents of CSV file)
         :param job_spec: dict, result of reading YAML file or whatever.
         :return:
         """
-
-        if self.db_file.exists():
+        if self.is_initialized:
             raise FileExistsError(
-                "Database file already exists for your project! You should not be initializing a new one."
+                "Database file already exists for your project! You should not be "
+                "initializing a new one."
             )
 
-        # Establish connection to database.
-        db = pickledb.load(self.db_file, False)
+        self.add_user_jobs(job_df)
+        self.set_meta("job_spec", job_spec)
+        # set last, as it marks the database as initialized
+        self.set_meta("dirs", dirs)
 
-        # Add a key to store the directory tree map
-        db.set("dirs", dirs)
+    def add_user_jobs(self, job_df):
+        """
+        Add (or update the records of) user jobs.
+        :param job_df: pandas.DataFrame with an order_id column (contents of CSV file),
+            or list of dicts
+        :return:
+        """
+        if hasattr(job_df, "to_dict"):
+            job_df = job_df.to_dict(orient="records")
+        now = time.time()
+        rows = [
+            (int(record["order_id"]), json.dumps(record, default=str), now)
+            for record in job_df
+        ]
+        with closing(self._connect()) as con, con:
+            con.executemany(
+                "INSERT INTO jobs (order_id, record, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (order_id) DO UPDATE SET "
+                "record = excluded.record, updated_at = excluded.updated_at",
+                rows,
+            )
 
-        # Add a key for our dataframe with jobs (already validated by the CLI interface class)
-        db.set("job_df", job_df)
+    def add_user_job(self, job):
+        """
+        Add a user job to the job database.
+        :param job: dict, the job's record (its row in the CSV file)
+        :return:
+        """
+        self.add_user_jobs([job])
 
-        # Add a key for our job spec
-        db.set(
-            "job_spec", job_spec
-        )  # should point to dict with spec, or to the JobSpec class, when finished...
+    def get_user_job(self, order_id):
+        """
+        Retrieve a user job's record and state.
+        :param order_id: int
+        :return: dict with record (dict), state and updated_at; None if not found
+        """
+        with closing(self._connect()) as con:
+            row = con.execute(
+                "SELECT record, state, updated_at FROM jobs WHERE order_id = ?",
+                (int(order_id),),
+            ).fetchone()
+        if row is None:
+            return None
+        return {"record": json.loads(row[0]), "state": row[1], "updated_at": row[2]}
 
-        # Add a key for our job objects
-        db.set("job_obj_dict", dict())
+    def set_job_states(self, states):
+        """
+        Update the state of a set of jobs (e.g., submitted, completed, failed).
+        :param states: dict, mapping job ids to states
+        :return:
+        """
+        now = time.time()
+        with closing(self._connect()) as con, con:
+            con.executemany(
+                "UPDATE jobs SET state = ?, updated_at = ? WHERE order_id = ?",
+                [(state, now, int(job)) for (job, state) in states.items()],
+            )
 
-        # Add a key for our sbatch jobs
-        db.set("sbatch_jobs", dict())
+    def add_sbatch_job(
+        self, sbatch_id, sbatch_job, script=None, is_array=False, replace=False
+    ):
+        """
+        Add an sbatch job, and the job ids run by each of its array elements. One at a
+        time, please!
+        :param sbatch_id: sbatch_id (int)
+        :param sbatch_job: dict, mapping array task ids (None for serial sbatch jobs)
+            to lists of job ids (see ..utils.slurm:wrapper_jobs())
+        :param script: path to the sbatch script
+        :param is_array: whether the sbatch job is an array
+        :param replace: if True, replace the sbatch job if it already exists (e.g.,
+            because its scripts were generated again) instead of raising an error
+        :return:
+        """
+        if not isinstance(sbatch_job, dict):
+            raise ValueError(
+                f"You did not provide a valid mapping of array elements to job ids "
+                f"to add. Aborting."
+            )
 
-        db.dump()
+        with closing(self._connect()) as con, con:
+            exists = con.execute(
+                "SELECT 1 FROM sbatch_jobs WHERE sbatch_id = ?", (int(sbatch_id),)
+            ).fetchone()
+            if exists is not None and replace:
+                con.execute(
+                    "DELETE FROM array_elements WHERE sbatch_id = ?", (int(sbatch_id),)
+                )
+            elif exists is not None:
+                raise ValueError(
+                    f"The specified sbatch_id ({sbatch_id}) already exists in the "
+                    f"database. Aborting operation to avoid adding a duplicate!"
+                )
+            con.execute(
+                "INSERT OR REPLACE INTO sbatch_jobs VALUES (?, ?, ?, ?)",
+                (int(sbatch_id), script, int(is_array), time.time()),
+            )
+            con.executemany(
+                "INSERT OR IGNORE INTO array_elements VALUES (?, ?, ?)",
+                [
+                    (int(sbatch_id), task, int(job))
+                    for (task, jobs) in sbatch_job.items()
+                    for job in jobs
+                ],
+            )
 
-    def __repr__(self):
-        return f"SlurmhelperDB instance for interacting with {self.db_file}"
+    def get_sbatch_job(self, sbatch_id):
+        """
+        Retrieve the job ids run by each element of an sbatch job.
+        :param sbatch_id: int
+        :return: dict, mapping array task ids (None for serial sbatch jobs) to lists of
+            job ids; empty if the sbatch job is unknown
+        """
+        rv = dict()
+        with closing(self._connect()) as con:
+            for task, job in con.execute(
+                "SELECT array_task, order_id FROM array_elements WHERE sbatch_id = ? "
+                "ORDER BY array_task, order_id",
+                (int(sbatch_id),),
+            ):
+                rv.setdefault(task, []).append(job)
+        return rv
 
-    def __str__(self):
-        return self.__repr__()
+    def find_job_elements(self, order_id):
+        """
+        Find the sbatch jobs (and array elements) that run a given job.
+        :param order_id: int
+        :return: list of (sbatch_id, array_task) tuples
+        """
+        with closing(self._connect()) as con:
+            return con.execute(
+                "SELECT sbatch_id, array_task FROM array_elements WHERE order_id = ? "
+                "ORDER BY sbatch_id",
+                (int(order_id),),
+            ).fetchall()
 
-    def add_sbatch_job(self, sbatch_id, sbatch_job):
+    def add_submission(
+        self,
+        sbatch_id,
+        slurm_job_id,
+        job_name=None,
+        spec_name=None,
+        spec_version=None,
+        submitted_at=None,
+    ):
         """
-        Add an sbatch job to the dict. One at a time, please!
-        :param sbatch_id: sbatch_id (integer?)
-        :param sbatch_job: sbatch job object.
+        Record the submission of an sbatch job to Slurm.
+        :param sbatch_id: int
+        :param slurm_job_id: int, as returned by sbatch
+        :param job_name: Slurm job name (e.g., sb-0001)
+        :param spec_name: name of the spec in use
+        :param spec_version: version of the spec in use
+        :param submitted_at: time of the submission (seconds since the epoch);
+            defaults to now
         :return:
         """
-        # Establish connection to database.
-        db = pickledb.load(self.db_file, False)
-
-        if sbatch_id in db.get("sbatch_jobs").keys():
-            raise ValueError(
-                f"The specified sbatch_id ({sbatch_id}) already exists in the database. "
-                f"Aborting operation to avoid adding a duplicate!"
+        with closing(self._connect()) as con, con:
+            con.execute(
+                "INSERT OR REPLACE INTO submissions VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    int(slurm_job_id),
+                    int(sbatch_id),
+                    job_name,
+                    spec_name,
+                    spec_version,
+                    time.time() if submitted_at is None else submitted_at,
+                ),
             )
 
-        # TODO: fix this ASAP once SbatchJob is implemented!!!!!!!
-        if not isinstance(sbatch_job, str):
-            raise ValueError(
-                f"You did not provide a valid SbatchJob object to add. Aborting."
+    def get_submissions(self, sbatch_id=None, slurm_job_id=None):
+        """
+        Retrieve submissions, by sbatch id or Slurm job id (or all of them).
+        :param sbatch_id: int, or None
+        :param slurm_job_id: int, or None
+        :return: list of dicts with slurm_job_id, sbatch_id, job_name, spec_name,
+            spec_version and submitted_at, oldest first
+        """
+        fields = (
+            "slurm_job_id",
+            "sbatch_id",
+            "job_name",
+            "spec_name",
+            "spec_version",
+            "submitted_at",
+        )
+        query = f"SELECT {', '.join(fields)} FROM submissions"
+        args = ()
+        if sbatch_id is not None:
+            query += " WHERE sbatch_id = ?"
+            args = (int(sbatch_id),)
+        elif slurm_job_id is not None:
+            query += " WHERE slurm_job_id = ?"
+            args = (int(slurm_job_id),)
+        with closing(self._connect()) as con:
+            rows = con.execute(query + " ORDER BY submitted_at", args).fetchall()
+        return [dict(zip(fields, row)) for row in rows]
+
+    def crosswalk(self, order_ids=None, slurm_job_id=None, array_task=None):
+        """
+        Look up which Slurm jobs ran which jobs: either the submissions of a set of
+        jobs, or the jobs run by a Slurm job (or one of its array tasks). Relay jobs
+        are left out.
+        :param order_ids: list of job ids, or None
+        :param slurm_job_id: int, or None
+        :param array_task: int, or None (all tasks of slurm_job_id)
+        :return: list of dicts with order_id, sbatch_id, array_task, slurm_job_id
+            (None for sbatch jobs that were not submitted), spec_version and
+            submitted_at, sorted by order_id and submission time
+        """
+        fields = (
+            "order_id",
+            "sbatch_id",
+            "array_task",
+            "slurm_job_id",
+            "spec_version",
+            "submitted_at",
+        )
+        query = (
+            "SELECT a.order_id, a.sbatch_id, a.array_task, s.slurm_job_id, "
+            "s.spec_version, s.submitted_at FROM array_elements a "
+            "LEFT JOIN submissions s ON s.sbatch_id = a.sbatch_id "
+            "AND s.job_name NOT LIKE '%-relay'"
+        )
+        args = ()
+        with closing(self._connect()) as con:
+            if slurm_job_id is not None:
+                query = query.replace("LEFT JOIN", "JOIN")
+                query += " WHERE s.slurm_job_id = ?"
+                args = (int(slurm_job_id),)
+                if array_task is not None:
+                    query += " AND a.array_task = ?"
+                    args += (int(array_task),)
+            elif order_ids is not None:
+                _fill_wanted(con, [int(job) for job in order_ids])
+                query += " WHERE a.order_id IN (SELECT value FROM wanted)"
+            query += " ORDER BY a.order_id, s.submitted_at"
+            rows = con.execute(query, args).fetchall()
+        return [dict(zip(fields, row)) for row in rows]
+
+    def add_events(self, events):
+        """
+        Record status events.
+        :param events: list of dicts with event, and any of order_id, sbatch_id,
+            slurm_id, detail and at (defaults to now)
+        :return:
+        """
+        now = time.time()
+        with closing(self._connect()) as con, con:
+            con.executemany(
+                "INSERT INTO events (order_id, sbatch_id, slurm_id, event, detail, at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        e.get("order_id"),
+                        e.get("sbatch_id"),
+                        e.get("slurm_id"),
+                        e["event"],
+                        e.get("detail"),
+                        e.get("at", now),
+                    )
+                    for e in events
+                ],
             )
 
-        db.dadd("sbatch_jobs", sbatch_job)
+    def get_events(self, order_id=None, sbatch_id=None):
+        """
+        Retrieve status events, by job id or sbatch id (or all of them).
+        :param order_id: int, or None
+        :param sbatch_id: int, or None
+        :return: list of dicts with order_id, sbatch_id, slurm_id, event, detail and
+            at, oldest first
+        """
+        fields = ("order_id", "sbatch_id", "slurm_id", "event", "detail", "at")
+        query = f"SELECT {', '.join(fields)} FROM events"
+        args = ()
+        if order_id is not None:
+            query += " WHERE order_id = ?"
+            args = (int(order_id),)
+        elif sbatch_id is not None:
+            query += " WHERE sbatch_id = ?"
+            args = (int(sbatch_id),)
+        with closing(self._connect()) as con:
+            rows = con.execute(query + " ORDER BY at, event_id", args).fetchall()
+        return [dict(zip(fields, row)) for row in rows]
 
-        db.dump()
+    def latest_events(self, order_ids=None):
+        """
+        Retrieve when each job last went through each kind of event.
+        :param order_ids: list of job ids, or None (all jobs)
+        :return: list of dicts with order_id, event and at (the latest time it was
+            recorded for that job)
+        """
+        fields = ("order_id", "event", "at")
+        query = (
+            "SELECT order_id, event, MAX(at) FROM events WHERE order_id IS NOT NULL"
+        )
+        with closing(self._connect()) as con:
+            if order_ids is not None:
+                _fill_wanted(con, [int(job) for job in order_ids])
+                query += " AND order_id IN (SELECT value FROM wanted)"
+            rows = con.execute(query + " GROUP BY order_id, event").fetchall()
+        return [dict(zip(fields, row)) for row in rows]
 
-    def add_user_job(self, job):
+    def last_seen(self, state):
         """
-        Add a user job object to the job database.
-        :param job:
-        :return:
+        Retrieve the latest event of the jobs in a given state, e.g., when and as
+        which Slurm job the jobs whose state is running were last seen running.
+        :param state: str, one of ..utils.events:JOB_EVENTS
+        :return: list of dicts with order_id, sbatch_id, slurm_id and at
+        """
+        fields = ("order_id", "sbatch_id", "slurm_id", "at")
+        with closing(self._connect()) as con:
+            # SQLite takes the bare columns from the row with the MAX(at)
+            rows = con.execute(
+                "SELECT e.order_id, e.sbatch_id, e.slurm_id, MAX(e.at) FROM events e "
+                "JOIN jobs j ON e.order_id = j.order_id "
+                "WHERE j.state = ? AND e.event = ? GROUP BY e.order_id",
+                (state, state),
+            ).fetchall()
+        return [dict(zip(fields, row)) for row in rows]
+
+
+def _fill_wanted(con, values):
+    """
+    Fill a temporary table, wanted (with a single column, value), with the keys of
+    the rows to select, e.g. with "... JOIN wanted w ON t.order_id = w.value". This
+    is faster than long IN (...) lists, which also run into SQLite's limit on the
+    number of query parameters.
+    :param con: sqlite3.Connection
+    :param values: iterable of keys (e.g., job ids or paths)
+    :return:
+    """
+    con.execute("CREATE TEMP TABLE IF NOT EXISTS wanted (value PRIMARY KEY)")
+    con.execute("DELETE FROM wanted")
+    con.executemany("INSERT OR IGNORE INTO wanted VALUES (?)", [(v,) for v in values])
+
+
+class StateCache:
+    """
+    Base class for caches kept in the project's state store (see SlurmhelperDB), such
+    as parsed job logs or directory listings, which let checks redo only the work
+    whose inputs changed. Subclasses declare their tables in TABLES, and bump
+    SCHEMA_VERSION whenever these (or the way their contents are computed) change:
+    the tables of an outdated cache are then dropped and created again, leaving the
+    rest of the state store alone.
+    """
+
+    # name of the cache, under which its schema version is kept in the meta table
+    NAME = None
+
+    SCHEMA_VERSION = 1
+
+    # table names, mapped to their column definitions
+    TABLES = dict()
+
+    def __init__(self, dirs):
+        """
+        Instantiates a cache, creating (or rebuilding) its tables if needed.
+        :param dirs: dict, result of the compute_paths() function
+        """
+        self.db_file = SlurmhelperDB(dirs).db_file
+        key = f"{self.NAME}_schema_version"
+        with self._transaction() as con:
+            row = con.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+            if row is None or json.loads(row[0]) != self.SCHEMA_VERSION:
+                logger.info(f"{self} is missing or outdated; rebuilding it.")
+                for table in self.TABLES:
+                    con.execute(f"DROP TABLE IF EXISTS {table}")
+                con.execute(
+                    "INSERT OR REPLACE INTO meta VALUES (?, ?)",
+                    (key, json.dumps(self.SCHEMA_VERSION)),
+                )
+            for table, columns in self.TABLES.items():
+                con.execute(f"CREATE TABLE IF NOT EXISTS {table} ({columns})")
+
+    def __repr__(self):
+        return f"{type(self).__name__} in {self.db_file}"
+
+    def _connect(self):
+        return sqlite3.connect(str(self.db_file), timeout=30)
+
+    @contextmanager
+    def _transaction(self):
+        """
+        Connect to the state store; changes are committed upon success (or rolled
+        back upon errors), and the connection is closed when done.
+        """
+        with closing(self._connect()) as con, con:
+            yield con
+
+    def _select(self, con, query, keys):
+        """
+        Run a query joining the temporary table wanted, filled with the given keys
+        (see _fill_wanted()).
+        :param con: sqlite3.Connection, from _transaction()
+        :param query: str, SQL
+        :param keys: iterable of keys (e.g., job ids or paths)
+        :return: sqlite3.Cursor
         """
-        pass
+        _fill_wanted(con, keys)
+        return con.execute(query)
@@ -264,6 +264,9 @@ class Job:
         self._jd["this_job_log_file"] = str(
             Path(bd["job_logs"]).joinpath("%s.txt" % (str(self)))
         )
+        self._jd["this_job_result_file"] = str(
+            Path(bd["job_results"]).joinpath("%s.tsv" % (str(self)))
+        )
         self._jd["this_job_inputs_dir"] = str(
             Path(bd["job_inputs"]).joinpath(str(self))
         )
@@ -319,9 +322,26 @@ class Job:
 
     @property
     def ran_successfully(self):
-        # assumption: exit code is last line!
-        lines = self.read_job_log_lines()
-        return lines[-1] == "0"
+        return self.read_job_log_outcome()["exit_code"] == 0
+
+    def read_job_log_outcome(self):
+        """
+        Reads exit code, success marker and runtime from the job's result record or,
+        if there is none, from the end of the job log, without reading the whole
+        thing (see ..utils.logs:read_job_outcome()).
+        :return: dict
+        """
+        from ..utils.logs import read_job_outcome
+
+        if not self.has_job_log:
+            raise FileNotFoundError(
+                f"No log file is available for job {self.id} in "
+                f"{self._jd['this_job_log_file']}!"
+            )
+
+        return read_job_outcome(
+            self._jd["this_job_log_file"], self._jd["this_job_result_file"]
+        )
 
     def read_job_log_lines(self):
         from ..utils.reporting import read_log_file_lines
@@ -357,6 +377,9 @@ class TestableJob(Job):
     Initially, this class will serve specifically for the rshrfmatlab project.
     In the future, my hope is to construct a more generic class, than people
     can then enhance with methods addressing their own specific needs / tests.
+
+    To check many jobs, use ..utils.validation:validate_jobs(), which runs the same
+    tests for all of them at once.
     """
 
     def __init__(self, db, paths, order_id, config):
@@ -369,14 +392,17 @@ class TestableJob(Job):
         self._glob_expr = self.record["glob_output_expr"]
         self._dir_outputs = self.record["output_dir"]
         self._dir_inputs = os.path.join(
-            paths["job_work"], "{job:05d}".format(job=self.id)
+            paths["job_inputs"], "{job:05d}".format(job=self.id)
         )
         self._dir_work = os.path.join(
-            paths["job_inputs"], "{job:05d}".format(job=self.id)
+            paths["job_work"], "{job:05d}".format(job=self.id)
         )
         self._path_log = os.path.join(
             paths["job_logs"], "{job:05d}.txt".format(job=self.id)
         )
+        self._path_record = os.path.join(
+            paths["job_results"], "{job:05d}.tsv".format(job=self.id)
+        )
         self.config = config
         # run tests
         self.run_tests()
@@ -418,7 +444,7 @@ class TestableJob(Job):
         if not os.path.isdir(self._dir_outputs):
             rv["logs"].append("Output directory does not exist.")
         else:
-            g_list = glob.glob(self._glob_expr)
+            g_list = glob.glob(os.path.join(self._dir_outputs, self._glob_expr))
             if len(g_list) == self.config["expected_n_files"]:
                 rv["result"] = True
             else:
@@ -448,7 +474,7 @@ class TestableJob(Job):
     def test_check_work(self):
         rv = {"result": False, "logs": []}
 
-        if not os.path.isdir(self._dir_inputs):
+        if not os.path.isdir(self._dir_work):
             rv["result"] = True
         else:
             rv["logs"].append(
@@ -459,30 +485,45 @@ class TestableJob(Job):
         self._tests_results["check_work"] = rv
 
     def test_check_logs(self):
+        from ..utils.logs import SUCCESS_MARKER, read_log_tail_lines, read_result_record
+
         rv = {"result": False, "logs": []}
 
+        record = None
+        if os.path.isfile(self._path_record):
+            record = read_result_record(self._path_record)
+
         if not os.path.isfile(self._path_log):
             rv["logs"].append(
                 "Job log file NOT found at {dir}".format(dir=self._path_log)
             )
-        else:
-            with open(self._path_log, "r") as logfile:
-                log = logfile.read().splitlines()
-                if len(log) == 0:
-                    rv["logs"].append("Log file is empty.")
-                elif len(log) == 1:
-                    rv["logs"].append(
-                        "Log file is one line long? Weird. Line is:\n{line1}".format(
-                            line1=log[0]
-                        )
+        elif record is not None:
+            if record["exit_code"] == 0:
+                rv["result"] = True
+            else:
+                rv["logs"].append(
+                    "Job exited with status {code} (see {path})".format(
+                        code=record["exit_code"], path=self._path_record
                     )
-                elif log[-1] == "0" and log[-2] == "SUCCESS":
-                    rv["result"] = True
-                else:
-                    rv["logs"].append(
-                        "Log ending is not as expected. Last two lines are:"
-                        "\n{line1}\n{line2}".format(line1=log[-2], line2=log[-1])
+                )
+        else:
+            # only the ending matters, so don't read the whole (possibly huge) log
+            log = read_log_tail_lines(self._path_log, n_lines=2)
+            if len(log) == 0:
+                rv["logs"].append("Log file is empty.")
+            elif len(log) == 1:
+                rv["logs"].append(
+                    "Log file is one line long? Weird. Line is:\n{line1}".format(
+                        line1=log[0]
                     )
+                )
+            elif log[-1] == "0" and log[-2] == SUCCESS_MARKER:
+                rv["result"] = True
+            else:
+                rv["logs"].append(
+                    "Log ending is not as expected. Last two lines are:"
+                    "\n{line1}\n{line2}".format(line1=log[-2], line2=log[-1])
+                )
 
         # Append results to results dict
         self._tests_results["check_log"] = rv
@@ -500,11 +541,30 @@ class TestableJob(Job):
                 rv[log_key] = " ; ".join(self._tests_results[test]["logs"])
             return rv
 
+    def test_spec_declared(self):
+        from ..utils.job_tests import parse_job_tests, run_job_test, stat_output_files
+
+        tests = parse_job_tests(self.config)
+        if len(tests) == 0:
+            return
+
+        job = dict(self.record, output_dir=self._dir_outputs)
+        files = stat_output_files(
+            sorted(glob.glob(os.path.join(self._dir_outputs, self._glob_expr)))
+        )
+        for test in tests:
+            rv = run_job_test(test, job, files)
+            self._tests_results[test["name"]] = {
+                "result": rv["result"],
+                "logs": rv["logs"],
+            }
+
     def run_tests(self):
         self.test_check_outputs()
         self.test_check_inputs()
         self.test_check_work()
         self.test_check_logs()
+        self.test_spec_declared()
 
         # update validity if applicable
         self._tests_ran = True
@@ -849,7 +909,6 @@ class SbatchArray(__SubmittableSbatchJob):
             - even: attempt to split jobs into parcels that
         :return:
         """
-        from slurmhelper.utils.time import calculate_min_number_of_parcels
         from slurmhelper.utils.misc import find_optimal_n_parcels
 
         if not isinstance(parallel, int) and parallel >= 0 and parallel <= 100:
@@ -858,8 +917,7 @@ class SbatchArray(__SubmittableSbatchJob):
             )
 
         n_jobs = len(self.jobs.keys())
-        n_parcels_min = calculate_min_number_of_parcels(n_jobs, self.spec)
-        return find_optimal_n_parcels(n_jobs, n_parcels_min, parallel)
+        return find_optimal_n_parcels(n_jobs, self.spec, parallel)
 
     def __initialize_elements(self, parallel=50):
         """
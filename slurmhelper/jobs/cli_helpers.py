@@ -3,18 +3,21 @@ import os
 from string import Template
 from time import sleep
 
+import pandas as pd
 import progressbar
 
 from .utils import build_job_objects
-from ..utils.io import write_job_script
-from ..utils.misc import split_list
-from ..utils.time import calculate_wall_time, calculate_min_number_of_parcels
+from ..utils.events import record_job_events
+from ..utils.io import load_db, write_job_script
+from ..utils.misc import find_optimal_n_parcels, split_list, split_list_grouped
+from ..utils.slurm import ARRAY_START_INDEX, get_scheduler_limits, plan_array_chunks
+from ..utils.time import calculate_wall_time
 
 logger = logging.getLogger("cli")
 
 
 # Implementation of the prep portion of the script...
-def prep_job(config, job_list, paths, args, array_job_index=None):
+def prep_job(config, job_list, paths, args, array_job_index=None, sbatch_id=None):
     """
         Will create a submission wrapper for one or more jobs, which
         are aggregated to be run serially. This function can be used for
@@ -27,6 +30,7 @@ def prep_job(config, job_list, paths, args, array_job_index=None):
         :param args: parsed ArgParse object
         :param array_job_index: None if this is not to be run as array;
                                 integer if part of array.jobs
+        :param sbatch_id: sbatch id to use; if None, taken from args.sbatch_id
     ❯ ls
     00001_clean.sh 00001_run.sh   00002_copy.sh  00003_clean.sh 00003_run.sh
     00001_copy.sh  00002_clean.sh 00002_run.sh   00003_copy.sh
@@ -37,15 +41,16 @@ def prep_job(config, job_list, paths, args, array_job_index=None):
     """
 
     logger.info("========== BEGIN PREPPING SERIAL JOB ==========")
-    # Wall time
+    if sbatch_id is None:
+        sbatch_id = args.sbatch_id[0]
 
     # Give me a good job name
     if args.operation == "prep-array" and array_job_index is not None:
         job_name = "sb-{sbatch_id:04d}-{array_job_index:03d}".format(
-            sbatch_id=args.sbatch_id[0], array_job_index=array_job_index
+            sbatch_id=sbatch_id, array_job_index=array_job_index
         )
     else:
-        job_name = "sb-{sbatch_id:04d}".format(sbatch_id=args.sbatch_id[0])
+        job_name = "sb-{sbatch_id:04d}".format(sbatch_id=sbatch_id)
 
     # begin assembling the thingy
     if args.no_header or args.operation == "prep-array":
@@ -70,23 +75,26 @@ def prep_job(config, job_list, paths, args, array_job_index=None):
         header_f = "\n".join([hdr, config["preamble"]])
 
     # Ok, let's create the section where we call each job script.
-    script_call = "bash {target_path} 2>&1 | tee {job_log_path}"
+    script_call = "run_job {job_id:05d} {target_path}"
 
     job_calls = []
     for job_id in job_list:
         script_name = "{job_id:05d}_run.sh".format(job_id=job_id)
         target_path = os.path.join(paths["job_scripts"], script_name)
-        job_log_path = os.path.join(
-            paths["job_logs"], "{job_id:05d}.txt".format(job_id=job_id)
-        )
-        job_calls.append(
-            script_call.format(target_path=target_path, job_log_path=job_log_path)
-        )
+        job_calls.append(script_call.format(job_id=job_id, target_path=target_path))
 
     job_calls_str = "\n".join(job_calls)
+
+    # If requested, run everything off node-local scratch instead.
+    if config.get("local_staging") not in (None, False):
+        job_calls_str = build_staged_job_calls(
+            config["local_staging"], job_list, paths, job_name
+        )
+
     script = "\n\n".join(
         [
             header_f,
+            build_job_runner(paths),
             job_calls_str,
             '''echo "~~~~~~~~~~~~~ END SLURM JOB ~~~~~~~~~~~~~~"''',
             "exit",
@@ -94,7 +102,9 @@ def prep_job(config, job_list, paths, args, array_job_index=None):
     )
 
     if not args.dry:
-        write_job_script(job_name, args.sbatch_id[0], paths, script)
+        write_job_script(job_name, sbatch_id, paths, script)
+        if array_job_index is None:
+            record_job_events(paths, "scripted", job_list, sbatch_id=sbatch_id)
 
     if args.verbose or args.dry:
         logger.info(
@@ -112,44 +122,284 @@ def prep_job(config, job_list, paths, args, array_job_index=None):
     return job_name
 
 
+def build_job_runner(paths):
+    """
+    Builds the run_job bash function used by submission wrappers to call each job
+    script. It tees the job's output to its log, and writes a result record to
+    logs/results/<job_id>.tsv once the job is done: a header line with the fields in
+    ..utils.logs:RECORD_FIELDS, and a tab-separated line with the job id, start and
+    end times (seconds since the epoch), exit code, host, peak memory use (in KB;
+    measured with /usr/bin/time, left blank if it is not available), and the signal
+    that ended the job and its likely cause (see ..utils.logs:RECORD_CAUSES; blank
+    if the job exited normally). The record is written atomically, and any previous
+    one is removed when the job starts.
+
+    Jobs killed along with their wrapper (e.g., when Slurm sends SIGTERM at the time
+    limit, or upon scancel) get a record too, written from a trap. The wrapper's EXIT
+    trap calls job_killed, so any other EXIT trap set later must call it as well (see
+    build_staged_job_calls()).
+
+    Usage: run_job <job_id> <path to run script>
+
+    :param paths: dict output of calculate_directories()
+    :return: str, bash code
+    """
+    from ..utils.logs import RECORD_FIELDS
+
+    logs = paths["job_logs"]
+    results = paths["job_results"]
+    header = "\\t".join(RECORD_FIELDS)
+    values = "\\t".join(["%s"] * len(RECORD_FIELDS))
+
+    return "\n".join(
+        [
+            "# ~~~ run a job script, keeping its log and a record of its result ~~~",
+            "current_job='' current_record='' current_start=''",
+            "write_record() {",
+            "    local record=$1 max_rss=''",
+            "    if [ -f $record.rss ]; then",
+            "        max_rss=$(tail -n 1 $record.rss | grep -E '^[0-9]+$' || true)",
+            "        rm -f $record.rss",
+            "    fi",
+            f"    printf '{header}\\n{values}\\n' \\",
+            '        "$2" "$3" "$4" "$5" "$(hostname)" "$max_rss" "$6" "$7" \\',
+            "        > $record.tmp && mv $record.tmp $record",
+            "}",
+            "run_job() {",
+            "    local job_id=$1 script=$2",
+            f"    local record={results}/$job_id.tsv",
+            "    local start exit_code sig='' cause=''",
+            f"    mkdir -p {results} && rm -f $record",
+            "    start=$(date +%s)",
+            "    current_job=$job_id current_record=$record current_start=$start",
+            "    if [ -x /usr/bin/time ]; then",
+            f"        /usr/bin/time -f %M -o $record.rss bash $script 2>&1 | tee {logs}/$job_id.txt",
+            "    else",
+            f"        bash $script 2>&1 | tee {logs}/$job_id.txt",
+            "    fi",
+            "    exit_code=${PIPESTATUS[0]}",
+            "    current_job=''",
+            "    if [ $exit_code -gt 128 ]; then",
+            "        sig=$(kill -l $((exit_code - 128)) 2> /dev/null || true)",
+            "        if [ \"$sig\" = KILL ]; then cause=KILLED; else cause=SIGNALED; fi",
+            "    fi",
+            '    write_record $record $job_id $start $(date +%s) $exit_code "$sig" "$cause"',
+            "}",
+            "",
+            "# ~~~ if the wrapper is killed, record the job it was running ~~~",
+            "job_killed() {",
+            "    local sig=$1 exit_code=$2 cause=$3",
+            "    if [ -z \"$current_job\" ]; then return 0; fi",
+            "    if [ -n \"${SLURM_JOB_END_TIME:-}\" ] && [ \"$sig\" = TERM ] &&",
+            "        [ $(date +%s) -ge $((SLURM_JOB_END_TIME - 60)) ]; then",
+            "        cause=TIMEOUT",
+            "    fi",
+            "    write_record $current_record $current_job $current_start $(date +%s) \\",
+            '        $exit_code "$sig" "$cause"',
+            "    current_job=''",
+            "}",
+            "trap 'job_killed TERM 143 CANCELLED; exit 143' TERM",
+            "trap 'job_killed INT 130 CANCELLED; exit 130' INT",
+            "trap 'job_killed \"\" $? WRAPPER_EXIT' EXIT",
+        ]
+    )
+
+
+def build_staged_job_calls(staging, job_list, paths, job_name):
+    """
+    Builds the section of a submission wrapper that calls each job script, such that
+    jobs run off node-local scratch rather than the shared working directory:
+
+    1. inputs (and any existing work dirs) for all jobs in the wrapper are copied
+       once to a temporary directory under staging['path'] (default: $TMPDIR);
+    2. each job's run script is rewritten on the fly so that its inputs and work
+       dirs point to the local copies, and then run (see build_job_runner());
+    3. after each job, its local work dir is synced back to the working directory.
+       If the job removed its local inputs/work dirs (e.g., upon success), their
+       shared counterparts are removed too, as the original script would have.
+
+    The temporary directory is removed when the wrapper exits.
+
+    :param staging: dict, the local_staging section of your spec
+    :param job_list: list of jobs to prepare
+    :param paths: dict output of calculate_directories()
+    :param job_name: name of the wrapper (used to name the temporary directory)
+    :return: str, bash code
+    """
+    if not isinstance(staging, dict):  # e.g., local_staging: true
+        staging = dict()
+    local_path = staging.get("path", "${TMPDIR:-/tmp}")
+    inputs = paths["job_inputs"]
+    work = paths["job_work"]
+    job_ids = " ".join(["{job_id:05d}".format(job_id=job_id) for job_id in job_list])
+
+    rv = [
+        "# ~~~ stage inputs to node-local scratch ~~~",
+        f"stage_dir=$(mktemp -d -p {local_path} {job_name}.XXXXXX)",
+        """trap 'job_killed "" $? WRAPPER_EXIT; rm -rf "$stage_dir"' EXIT""",
+        'echo "Staging inputs to $stage_dir"',
+        "mkdir -p $stage_dir/inputs $stage_dir/work $stage_dir/scripts",
+        f"for job_id in {job_ids}; do",
+        f"    if [ -d {inputs}/$job_id ]; then cp -r {inputs}/$job_id $stage_dir/inputs/; fi",
+        f"    if [ -d {work}/$job_id ]; then cp -r {work}/$job_id $stage_dir/work/; fi",
+        "done",
+    ]
+
+    for job_id in job_list:
+        job = "{job_id:05d}".format(job_id=job_id)
+        run_script = os.path.join(paths["job_scripts"], f"{job}_run.sh")
+        local_script = f"$stage_dir/scripts/{job}_run.sh"
+        rv += [
+            "",
+            f'sed -e "s#{inputs}#$stage_dir/inputs#g" -e "s#{work}#$stage_dir/work#g" '
+            f"{run_script} > {local_script}",
+            f"run_job {job} {local_script}",
+            f"if [ -d $stage_dir/work/{job} ]; then",
+            f"    mkdir -p {work}/{job} && cp -r $stage_dir/work/{job}/. {work}/{job}/",
+            "else",
+            f"    rm -rf {work}/{job}",
+            "fi",
+            f"if [ ! -d $stage_dir/inputs/{job} ]; then rm -rf {inputs}/{job}; fi",
+        ]
+
+    return "\n".join(rv)
+
+
 # this does the array stuff
-def prep_job_array(config, job_list, paths, args):
+def prep_job_array(config, job_list, paths, args, show_instructions=True):
     """
     Will create an array-ified submission wrapper a list of jobs, which
     are automagically arranged into an optimized array of serial jobs :)
 
+    If the array would not fit within the scheduler limits (MaxArraySize,
+    MaxSubmitJobs; see ..utils.slurm:get_scheduler_limits()), it is split into
+    several arrays with consecutive sbatch ids, starting from args.sbatch_id.
+
     :param config: dict, output of load_spec()
     :param job_list: list of jobs to prepare
     :param paths: dict output of calculate_directories()
     :param args: parsed ArgParse object
-    :return: job_name: name of script to run job
+    :param show_instructions: if False, do not print how to submit the arrays (e.g.,
+        when they are submitted by the caller)
+    :return: list of sbatch ids used
     """
     # allow for manual override of number of parcels, else, calculate it
     if args.n_parcels is not None:
         n_parcels = args.n_parcels[0]
     else:
-        n_parcels = calculate_min_number_of_parcels(len(job_list), config)
-
-    # divvy up my jobs evenly
-    job_array = split_list(job_list, wanted_parts=n_parcels)
+        n_parcels = find_optimal_n_parcels(len(job_list), config, args.par_target)
+
+    # divvy up my jobs evenly, keeping jobs that share inputs together if asked to
+    group_by = args.group_by
+    if group_by is None:
+        group_by = config.get("parcel_group_by")
+    if isinstance(group_by, str):
+        group_by = [group_by]
+    if group_by:
+        db = load_db(os.path.join(paths["base"], "db.csv")).set_index("order_id")
+        missing = set(group_by) - set(db.columns)
+        if len(missing) > 0:
+            raise ValueError(
+                f"Cannot group jobs by columns missing from your db.csv: {missing}"
+            )
+        keys = list(db.loc[job_list, group_by].itertuples(index=False, name=None))
+        job_array = split_list_grouped(job_list, keys, wanted_parts=n_parcels)
+        logger.info(
+            f"Grouped jobs by {group_by}: {len(set(keys))} groups across "
+            f"{len(job_array)} parcels."
+        )
+        n_parcels = len(job_array)
+    else:
+        job_array = split_list(job_list, wanted_parts=n_parcels)
 
     # verbose print statement because, reasons
     logger.info("JOB ARRAY IS:")
     logger.info(job_array)
 
+    # make sure we play nice with the scheduler's limits
+    limits = get_scheduler_limits(config, auto=args.auto_limits)
+    chunks = plan_array_chunks(n_parcels, limits, args.rate_limit)
+    sbatch_ids = [args.sbatch_id[0] + i for i in range(len(chunks["sizes"]))]
+
+    if len(sbatch_ids) > 1:
+        print(
+            f"Your {n_parcels} parcels exceed the scheduler limits for a single array, "
+            f"so they will be split into {len(sbatch_ids)} "
+            f"{'chained' if chunks['chained'] else 'concurrent'} arrays with sbatch ids "
+            f"{sbatch_ids[0]} to {sbatch_ids[-1]}."
+        )
+        # bail out before writing anything if some of these ids are taken already
+        for sb_id in sbatch_ids:
+            sb_path = os.path.join(paths["slurm_scripts"], f"sb-{sb_id:04d}.sh")
+            if os.path.exists(sb_path):
+                raise ValueError(
+                    f"The sbatch_id {sb_id:04d}, needed for this array, has already been used, "
+                    f"as evidenced by an existing script with the same id. Aborting. "
+                    f"Choose a different ID!"
+                )
+
+    start = 0
+    for i, sb_id in enumerate(sbatch_ids):
+        chunk = job_array[start : start + chunks["sizes"][i]]
+        start += chunks["sizes"][i]
+        _prep_array_chunk(config, chunk, paths, args, sb_id, chunks["throttle"])
+        if chunks["chained"] and i + 1 < len(sbatch_ids):
+            _prep_relay_script(
+                config, paths, args, sb_id, sbatch_ids[i + 1], i + 2 < len(sbatch_ids)
+            )
+
+    if not args.dry:
+        print("Done!")
+        if not show_instructions:
+            pass
+        elif len(sbatch_ids) == 1:
+            tgt_path = os.path.join(
+                paths["slurm_scripts"], "sb-{id:04d}.sh".format(id=sbatch_ids[0])
+            )
+            print("Please run the following command to submit your sbatch job array:")
+            print(f"\n  sbatch {tgt_path}\n")
+        elif chunks["chained"]:
+            print(
+                "Please submit the first array using slurmhelper submit; the remaining "
+                "arrays will be submitted automatically, one after the other:"
+            )
+            print(f"\n  slurmhelper submit --sbatch-id {sbatch_ids[0]} <...>\n")
+        else:
+            print("Please submit each of these arrays using slurmhelper submit:")
+            for sb_id in sbatch_ids:
+                print(f"  slurmhelper submit --sbatch-id {sb_id} <...>")
+
+    return sbatch_ids
+
+
+def _prep_array_chunk(config, job_array, paths, args, sbatch_id, throttle=None):
+    """
+    Writes out an sbatch array script (and its element scripts) for a list of parcels.
+    :param config: dict, output of load_spec()
+    :param job_array: list o' lists, with job ids for each array element
+    :param paths: dict output of calculate_directories()
+    :param args: parsed ArgParse object
+    :param sbatch_id: int, sbatch id for this array
+    :param throttle: int or None, max number of concurrently running elements
+    :return: job_name: name of array script
+    """
+    n_parcels = len(job_array)
+
     # for each parcel to include in the array
     for i in progressbar.progressbar(range(0, n_parcels), redirect_stdout=True):
         # retrieve my parcel
         parcel = job_array[i]
-        arr_j_i = i + 100
+        arr_j_i = i + ARRAY_START_INDEX
         # make as many jobs as we want, each job is a buddy :)
         # this will write out the sub_job scripts too
-        prep_job(config, parcel, paths, args, array_job_index=arr_j_i)
+        prep_job(
+            config, parcel, paths, args, array_job_index=arr_j_i, sbatch_id=sbatch_id
+        )
         sleep(0.1)
 
     # ok, here's the array script...
     job_name = "sb-{sbatch_id:04d}".format(
-        sbatch_id=args.sbatch_id[0]
+        sbatch_id=sbatch_id
     )  # notice, we still have an sb- name, this is
 
     # for all jobs submitted...
@@ -166,19 +416,19 @@ def prep_job_array(config, job_list, paths, args):
     log_out = os.path.join(
         paths["slurm_logs"], "{job_name}-%a.txt".format(job_name=job_name)
     )
-    if args.rate_limit is not None:
-        steppity = """%{rate}""".format(rate=args.rate_limit)
+    if throttle is not None:
+        steppity = """%{rate}""".format(rate=throttle)
     else:
         steppity = ""
 
     arr = "#SBATCH --array={start_index:d}-{end_index:d}{step}".format(
-        start_index=100, end_index=(100 + n_parcels - 1), step=steppity
+        start_index=ARRAY_START_INDEX,
+        end_index=(ARRAY_START_INDEX + n_parcels - 1),
+        step=steppity,
     )
     path_to_array = os.path.join(
         paths["slurm_scripts"],
-        "sb-{sbatch_id:04d}-$SLURM_ARRAY_TASK_ID.sh".format(
-            sbatch_id=args.sbatch_id[0]
-        ),
+        "sb-{sbatch_id:04d}-$SLURM_ARRAY_TASK_ID.sh".format(sbatch_id=sbatch_id),
     )
 
     hdr = Template(config["header"]).safe_substitute(
@@ -199,7 +449,10 @@ def prep_job_array(config, job_list, paths, args):
     )
     if not args.dry:
         # finally, write out the array script
-        write_job_script(job_name, args.sbatch_id[0], paths, array_script)
+        write_job_script(job_name, sbatch_id, paths, array_script)
+        record_job_events(
+            paths, "scripted", [j for p in job_array for j in p], sbatch_id=sbatch_id
+        )
 
         tgt_path = os.path.join(
             paths["slurm_scripts"], "{name}.sh".format(name=job_name)
@@ -209,9 +462,146 @@ def prep_job_array(config, job_list, paths, args):
 
         logger.debug("Contents of ARRAY script:\n------------------\n")
         logger.debug(array_script)
-        print("Done!")
-        print("Please run the following command to submit your sbatch job array:")
-        print(f"\n  sbatch {tgt_path}\n")
+
+    return job_name
+
+
+def _prep_relay_script(config, paths, args, sbatch_id, next_sbatch_id, next_has_relay):
+    """
+    Writes out a tiny "relay" sbatch script (sb-<sbatch_id>-relay.sh) that submits the
+    next array in a chain. submit_sbatch() submits it with a dependency on the array
+    with the same sbatch id, so the next array only enters the queue once this one is
+    done (and thus does not count against MaxSubmitJobs in the meantime). As it runs
+    outside of slurmhelper, the relay appends what it submitted to a file in the
+    working directory, to be imported into the state database later on (see
+    ..jobs.submit:import_relay_submissions()).
+    :param config: dict, output of load_spec()
+    :param paths: dict output of calculate_directories()
+    :param args: parsed ArgParse object
+    :param sbatch_id: int, sbatch id of the array this relay waits on
+    :param next_sbatch_id: int, sbatch id of the array this relay submits
+    :param next_has_relay: bool, whether the next array has a relay of its own
+    :return: job_name: name of relay script
+    """
+    from .submit import RELAY_SUBMISSIONS_FILE
+
+    job_name = "sb-{sbatch_id:04d}-relay".format(sbatch_id=sbatch_id)
+    next_name = "sb-{sbatch_id:04d}".format(sbatch_id=next_sbatch_id)
+
+    hdr = Template(config["header"]).safe_substitute(
+        job_name=job_name,
+        log_path=os.path.join(paths["slurm_logs"], f"{job_name}.txt"),
+        n_tasks=1,
+        mem=1000,
+        time="0:10:0",
+        job_array="",
+    )
+
+    # sbatch id, Slurm job id, job name, time, spec name and version
+    submissions = os.path.join(paths["base"], RELAY_SUBMISSIONS_FILE)
+    spec = "\\t".join(
+        [config.get("spec_name") or "", str(config.get("spec_version") or "")]
+    )
+
+    def record(slurm_id, name):
+        return (
+            f"printf '%s\\t%s\\t%s\\t%s\\t{spec}\\n' {next_sbatch_id} "
+            f'"{slurm_id}" {name} "$(date +%s)" >> {submissions}'
+        )
+
+    # submit from the pertinent crashes dir, as submit_sbatch() would
+    from_path = os.path.join(paths["crashes"], next_name)
+    body = [
+        f"mkdir -p {from_path}",
+        f"cd {from_path}",
+        # under bash -e, a failed sbatch would end the relay before it is recorded
+        'next_id=$(sbatch --parsable {path}) || next_id=""'.format(
+            path=os.path.join(paths["slurm_scripts"], f"{next_name}.sh")
+        ),
+        "next_id=${next_id%%;*}",  # drop the cluster name, if any
+        record("$next_id", next_name),
+        f'echo "Sbatch job {next_name}.sh submitted, with Slurm ID $next_id."',
+    ]
+    if next_has_relay:
+        next_relay = os.path.join(paths["slurm_scripts"], f"{next_name}-relay.sh")
+        body += [
+            "relay_id=$(sbatch --parsable --dependency=afterany:$next_id "
+            f'{next_relay}) || relay_id=""',
+            "relay_id=${relay_id%%;*}",
+            record("$relay_id", f"{next_name}-relay"),
+        ]
+    relay_script = "\n".join([hdr] + body + ["exit"])
+
+    if not args.dry:
+        write_job_script(job_name, sbatch_id, paths, relay_script)
+        logger.debug("Contents of RELAY script:\n------------------\n")
+        logger.debug(relay_script)
+
+    return job_name
+
+
+def plan_job_array(config, job_list, paths, args):
+    """
+    Simulates several ways of arranging a list of jobs into an sbatch array (see
+    ..utils.planning:plan_layouts()), prints out the expected makespan and cost of
+    each, and recommends one.
+
+    :param config: dict, output of load_spec()
+    :param job_list: list of jobs to plan for
+    :param paths: dict output of calculate_directories()
+    :param args: parsed ArgParse object
+    :return: pd.DataFrame with one row per layout simulated
+    """
+    from ..utils.planning import plan_layouts
+    from ..utils.reporting import read_job_runtimes
+
+    history = None
+    if not args.no_history:
+        logger.info("Reading runtime history from logs of completed jobs...")
+        history = read_job_runtimes(paths, job_list)
+        print(f"Runtime history available for {len(history)} completed jobs.")
+
+    plans = plan_layouts(
+        job_list,
+        config,
+        n_parcels_list=args.n_parcels,
+        rate_limits=args.rate_limit,
+        strategies=args.strategy,
+        history=history,
+    )
+
+    if len(plans) == 0:
+        print(
+            f"None of the numbers of parcels to try is between 1 and the number of "
+            f"jobs ({len(job_list)}); nothing to simulate."
+        )
+        return plans
+
+    with pd.option_context(
+        "display.max_columns", None, "display.width", 200, "display.precision", 1
+    ):
+        print(plans.to_string(index=False))
+
+    if not plans["recommended"].any():
+        print(
+            "\nNo layout recommended: prep-array only builds even packing, which was "
+            "not simulated (see --strategy)."
+        )
+        return plans
+
+    best = plans[plans["recommended"]].iloc[0]
+    print(
+        f"\nRecommended layout: {best['n_parcels']} parcels ({best['strategy']} packing"
+        f"{'' if pd.isna(best['rate_limit']) else ', rate limit %d' % best['rate_limit']}), "
+        f"expected makespan {best['makespan']}, {best['node_hours']:.1f} node-hours requested."
+    )
+    if (plans["strategy"] != "even").any():
+        print(
+            "Note: prep-array currently only implements even packing; other layouts "
+            "are shown for comparison."
+        )
+
+    return plans
 
 
 def generate_run_scripts(dirs, config, args, job_list=None):
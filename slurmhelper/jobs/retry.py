@@ -0,0 +1,351 @@
+"""
+Resubmission of failed jobs: pick the jobs that failed (or never produced a log)
+from the status cache, repack them into new arrays (see
+..jobs.cli_helpers:prep_job_array()) with more time or memory if that is what they
+ran out of, and submit them.
+"""
+
+import argparse
+import datetime
+import glob
+import logging
+import math
+import os
+import re
+import subprocess
+
+import pandas as pd
+
+from .cli_helpers import prep_job_array
+from .submit import import_relay_submissions, submit_many
+from ..cli.parser import DEFAULT_MEMORY, DEFAULT_N_TASKS
+from ..db import SlurmhelperDB
+from ..utils.io import copy_or_clean
+from ..utils.queue_status import get_queue_snapshot, queue_table
+from ..utils.reporting import get_job_status
+from ..utils.slurm import (
+    expand_by_job,
+    parse_slurm_duration,
+    parse_slurm_memory,
+    wrapper_jobs,
+)
+from ..utils.time import delta_to_slurm_time
+from ..utils.usage import read_usage
+
+logger = logging.getLogger("cli")
+
+# failure causes (sacct states of the last attempt) that more resources may fix
+BUMPABLE_CAUSES = {"TIMEOUT": "time", "OUT_OF_MEMORY": "memory"}
+
+_SBATCH_SCRIPT = re.compile(r"^sb-(\d{4})")
+_WRAPPER_SCRIPT = re.compile(r"^sb-(\d{4})\.sh$")
+_DIRECTIVES = {
+    "time": re.compile(r"^#SBATCH\s+(?:--time[= ]|-t\s*)(\S+)", re.M),
+    "memory": re.compile(r"^#SBATCH\s+--mem[= ](\S+)", re.M),
+    "n_tasks": re.compile(r"^#SBATCH\s+--ntasks-per-node[= ](\d+)", re.M),
+}
+
+
+def next_free_sbatch_id(dirs):
+    """
+    Find the lowest sbatch id above all those used so far, by scripts in the working
+    directory or by sbatch jobs recorded in the state database.
+    :param dirs: output of ..utils.io:calculate_directories()
+    :return: int
+    """
+    used = [0]
+    for path in glob.glob(os.path.join(dirs["slurm_scripts"], "sb-*.sh")):
+        match = _SBATCH_SCRIPT.match(os.path.basename(path))
+        if match:
+            used.append(int(match.group(1)))
+    for row in SlurmhelperDB(dirs).get_submissions():
+        used.append(row["sbatch_id"])
+    return max(used) + 1
+
+
+def read_sbatch_resources(dirs, sbatch_id):
+    """
+    Read the resources requested by an sbatch script.
+    :param dirs: output of ..utils.io:calculate_directories()
+    :param sbatch_id: int
+    :return: dict with time (seconds), memory (MB) and n_tasks; None where unknown
+    """
+    rv = {"time": None, "memory": None, "n_tasks": None}
+    path = os.path.join(dirs["slurm_scripts"], f"sb-{sbatch_id:04d}.sh")
+    if not os.path.exists(path):
+        return rv
+    with open(path, "r") as f:
+        script = f.read()
+    for key, pattern in _DIRECTIVES.items():
+        match = pattern.search(script)
+        if match is None:
+            continue
+        value = match.group(1)
+        if key == "time":
+            rv[key] = parse_slurm_duration(value)
+        elif key == "memory":
+            # sbatch takes plain numbers to be MB
+            kb = parse_slurm_memory(value if not value.isdigit() else f"{value}M")
+            rv[key] = math.ceil(kb / 1024) if kb is not None else None
+        else:
+            rv[key] = int(value)
+    return rv
+
+
+def find_retry_candidates(dirs, job_list=None, rescan=False, queue_ttl=0):
+    """
+    List jobs that failed, or that were submitted but left no log, and are not in
+    the queue anymore; along with how many times they were submitted, and why their
+    last attempt ended (its state in sacct, e.g. TIMEOUT or OUT_OF_MEMORY).
+    Submissions made by relay jobs count too: they are imported first (see
+    ..jobs.submit:import_relay_submissions()), and any that went unrecorded are
+    looked up in sacct by job name.
+    :param dirs: output of ..utils.io:calculate_directories()
+    :param job_list: list of job ids to consider; if None, all jobs are considered
+    :param rescan: if True, re-parse all logs regardless of the status cache
+    :param queue_ttl: max age (seconds) of a queue snapshot to reuse
+    :return: pd.DataFrame indexed by order_id, with columns status (failed or
+        missing), attempts, last_sbatch_id (Int64) and cause (sacct state, or NA)
+    """
+    import_relay_submissions(dirs)
+    status = get_job_status(dirs, job_list, rescan=rescan)
+    failed = status.index[
+        status["has_log"] & status["exit_code"].notna() & ~status["success"]
+    ]
+    no_outcome = status.index[status["exit_code"].isna()]
+
+    columns = ["order_id", "sbatch_id", "slurm_job_id"]
+    submissions = pd.DataFrame(
+        SlurmhelperDB(dirs).crosswalk(order_ids=status.index.tolist()),
+        columns=columns,
+    ).dropna(subset=["slurm_job_id"])
+    unrecorded = _unrecorded_submissions(
+        dirs, list(failed) + list(no_outcome), set(submissions["sbatch_id"])
+    )
+    submissions = pd.concat([submissions, unrecorded[columns]], ignore_index=True)
+    # Slurm job ids go up with each submission
+    submitted = submissions.sort_values("slurm_job_id").groupby("order_id")
+    attempts = submitted["sbatch_id"].nunique()
+    last_sbatch_id = submitted["sbatch_id"].last()
+
+    # jobs with no outcome only count as missing once they are out of the queue;
+    # killed jobs (e.g., for running out of time) leave a log with no exit code
+    queued = set()
+    if len(no_outcome) > 0:
+        jobs, _ = get_queue_snapshot(dirs, ttl=queue_ttl)
+        if len(jobs) > 0:
+            queued = set(expand_by_job(queue_table(dirs, jobs)).index)
+    missing = [
+        job for job in no_outcome if job in attempts.index and job not in queued
+    ]
+
+    df = pd.DataFrame(
+        {"status": ["failed"] * len(failed) + ["missing"] * len(missing)},
+        index=pd.Index(list(failed) + missing, name="order_id", dtype="int64"),
+    ).sort_index()
+    df["attempts"] = attempts.reindex(df.index).fillna(0).astype("int64")
+    df["last_sbatch_id"] = last_sbatch_id.reindex(df.index).astype("Int64")
+    df["cause"] = _last_attempt_states(dirs, df)
+    return df
+
+
+def _unrecorded_submissions(dirs, job_ids, recorded):
+    """
+    Find submissions of a set of jobs missing from the state database (e.g., arrays
+    submitted by relay jobs that did not record their submissions), by looking up
+    the sbatch jobs whose scripts run them in sacct, by job name.
+    :param dirs: output of ..utils.io:calculate_directories()
+    :param job_ids: list of job ids
+    :param recorded: set of sbatch ids whose submissions are recorded
+    :return: pd.DataFrame with columns order_id, sbatch_id and slurm_job_id
+    """
+    rv = pd.DataFrame(columns=["order_id", "sbatch_id", "slurm_job_id"])
+    job_ids = set(job_ids)
+    sbatch_ids = []
+    for path in glob.glob(os.path.join(dirs["slurm_scripts"], "sb-*.sh")):
+        match = _WRAPPER_SCRIPT.match(os.path.basename(path))
+        if match is None or int(match.group(1)) in recorded:
+            continue
+        elements = wrapper_jobs(dirs, int(match.group(1)))
+        if any(job in job_ids for jobs in elements.values() for job in jobs):
+            sbatch_ids.append(int(match.group(1)))
+    if len(job_ids) == 0 or len(sbatch_ids) == 0:
+        return rv
+    try:
+        usage = read_usage(dirs, sbatch_ids=sorted(sbatch_ids))
+    except (OSError, subprocess.CalledProcessError) as err:
+        logger.warning(f"Could not query sacct for unrecorded submissions: {err}")
+        return rv
+    if len(usage) == 0:
+        return rv
+    logger.info(
+        f"Found submissions of {usage['sbatch_id'].nunique()} sbatch jobs in sacct "
+        f"that were not recorded."
+    )
+    by_job = expand_by_job(usage).reset_index()
+    return by_job[by_job["order_id"].isin(job_ids)][rv.columns]
+
+
+def _last_attempt_states(dirs, df):
+    sbatch_ids = sorted({int(sb) for sb in df["last_sbatch_id"].dropna()})
+    causes = pd.Series(pd.NA, index=df.index, dtype="object")
+    if len(sbatch_ids) == 0:
+        return causes
+    try:
+        usage = read_usage(dirs, sbatch_ids=sbatch_ids)
+    except (OSError, subprocess.CalledProcessError) as err:
+        logger.warning(f"Could not query sacct for failure causes: {err}")
+        return causes
+    if len(usage) == 0:
+        return causes
+    by_job = expand_by_job(usage)
+    # only the last attempt tells why the job needs a retry
+    last = df["last_sbatch_id"].reindex(by_job.index)
+    by_job = by_job[(by_job["sbatch_id"] == last).fillna(False)]
+    by_job = by_job[~by_job.index.duplicated(keep="last")]
+    causes.update(by_job["state"])
+    return causes
+
+
+def plan_retry_groups(dirs, candidates, bump_time=None, bump_memory=None):
+    """
+    Group retry candidates by what they need: jobs that ran out of time (or memory)
+    get the time (or memory) of their last attempt times a factor, if one is given;
+    others are retried with the memory and tasks of their last attempt. The time of
+    an array element covers its whole parcel, so it is only carried over (bumped)
+    for timed-out jobs, which are then retried one per element.
+    :param dirs: output of ..utils.io:calculate_directories()
+    :param candidates: pd.DataFrame, output of find_retry_candidates()
+    :param bump_time: factor to multiply the wall time of timed-out jobs by, or None
+    :param bump_memory: factor to multiply the memory of out-of-memory jobs by, or
+        None
+    :return: list of dicts with name, job_list, time (seconds), memory (MB) and
+        n_tasks (None to use the defaults), and n_parcels (None to compute it)
+    """
+    factors = {"time": bump_time, "memory": bump_memory}
+    resources = {
+        int(sb): read_sbatch_resources(dirs, int(sb))
+        for sb in candidates["last_sbatch_id"].dropna().unique()
+    }
+
+    def bumped(cause):
+        resource = BUMPABLE_CAUSES.get(cause)
+        return resource if resource is not None and factors[resource] else None
+
+    groups = []
+    keys = candidates["cause"].map(lambda c: bumped(c) or "")
+    for key, jobs in candidates.groupby(keys):
+        previous = [
+            resources[int(sb)] for sb in jobs["last_sbatch_id"].dropna().unique()
+        ]
+        group = {"name": f"{key}-bumped" if key else "as-before"}
+        for resource in ("time", "memory", "n_tasks"):
+            values = [p[resource] for p in previous if p[resource] is not None]
+            group[resource] = max(values) if len(values) > 0 else None
+        if key and group[key] is not None:
+            group[key] = math.ceil(group[key] * factors[key])
+        group["n_parcels"] = None
+        if key == "time" and group["time"] is not None:
+            group["n_parcels"] = len(jobs)
+        else:
+            group["time"] = None
+        group["job_list"] = jobs.index.tolist()
+        groups.append(group)
+    return groups
+
+
+def retry_jobs(config, dirs, args, job_list=None):
+    """
+    Prepare (and submit) new arrays for failed and missing jobs, capped at a maximum
+    number of attempts per job.
+    :param config: dict, output of load_spec()
+    :param dirs: output of ..utils.io:calculate_directories()
+    :param args: parsed ArgParse object (see the retry command)
+    :param job_list: list of job ids to consider; if None, all jobs are considered
+    :return: list of job ids prepared for a retry
+    """
+    candidates = find_retry_candidates(dirs, job_list, rescan=args.rescan)
+    exhausted = candidates[candidates["attempts"] >= args.max_attempts]
+    candidates = candidates[candidates["attempts"] < args.max_attempts]
+
+    n_missing = (candidates["status"] == "missing").sum()
+    print(f"jobs failed: {(candidates['status'] == 'failed').sum()}")
+    print(f"jobs missing (submitted, but with no outcome in logs): {n_missing}")
+    if len(exhausted) > 0:
+        print(
+            f"jobs not retried, as they reached {args.max_attempts} attempts: "
+            f"{len(exhausted)}"
+        )
+        logger.info(exhausted.index.tolist())
+    if len(candidates) == 0:
+        print("Nothing to retry.")
+        return []
+    causes = candidates["cause"].fillna("unknown").value_counts()
+    print("causes of last attempts (sacct state):")
+    for cause, n in causes.items():
+        print(f"    {cause}: {n}")
+
+    groups = plan_retry_groups(dirs, candidates, args.bump_time, args.bump_memory)
+    job_list = candidates.index.tolist()
+    if args.dry:
+        pass
+    elif args.do_reset:
+        print("The --do-reset flag was used. Clean and then copy will be run first.")
+        copy_or_clean(job_list, "clean", dirs["job_scripts"], dirs)
+        copy_or_clean(job_list, "copy", dirs["job_scripts"], dirs)
+    elif args.do_clean:
+        print("The --do-clean flag was used. Clean scripts will be run first.")
+        copy_or_clean(job_list, "clean", dirs["job_scripts"], dirs)
+    elif args.do_copy:
+        print("The --do-copy flag was used. Input copy scripts will be run first.")
+        copy_or_clean(job_list, "copy", dirs["job_scripts"], dirs)
+
+    sbatch_id = next_free_sbatch_id(dirs)
+    to_submit = []
+    for group in groups:
+        prep_args = argparse.Namespace(**vars(args))
+        prep_args.operation = "prep-array"
+        prep_args.sbatch_id = [sbatch_id]
+        prep_args.n_parcels = None
+        if group["n_parcels"] is not None:
+            prep_args.n_parcels = [group["n_parcels"]]
+        prep_args.group_by = None
+        prep_args.auto_limits = False
+        prep_args.no_header = False
+        if args.time is None and group["time"] is not None:
+            prep_args.time = delta_to_slurm_time(
+                datetime.timedelta(seconds=group["time"])
+            )
+        # as prep-array would, when the last attempt's script cannot be read
+        if args.memory is None:
+            prep_args.memory = [group["memory"] or DEFAULT_MEMORY]
+        if args.n_tasks is None:
+            prep_args.n_tasks = [group["n_tasks"] or DEFAULT_N_TASKS]
+
+        print(
+            f"\nretrying {len(group['job_list'])} jobs ({group['name']}) from sbatch "
+            f"id {sbatch_id}, with time {prep_args.time or 'as per spec'}, memory "
+            f"{prep_args.memory[0]} MB and {prep_args.n_tasks[0]} tasks"
+        )
+        sbatch_ids = prep_job_array(
+            config, group["job_list"], dirs, prep_args, show_instructions=False
+        )
+        # chained arrays are submitted by the relay job of the previous one
+        relays = [
+            os.path.join(dirs["slurm_scripts"], f"sb-{sb:04d}-relay.sh")
+            for sb in sbatch_ids
+        ]
+        to_submit += [
+            sb
+            for (i, sb) in enumerate(sbatch_ids)
+            if i == 0 or not os.path.exists(relays[i - 1])
+        ]
+        sbatch_id = sbatch_ids[-1] + 1
+
+    if args.dry:
+        print("\nDry run: nothing was written or submitted.")
+    elif args.no_submit:
+        print(f"\nsbatch ids prepared, to submit: {' '.join(map(str, to_submit))}")
+    else:
+        submit_many(to_submit, dirs, config)
+    return job_list
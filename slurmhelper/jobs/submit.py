@@ -1,15 +1,114 @@
-def submit_sbatch(id, dirs):
+import logging
+import os
+import random
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+logger = logging.getLogger("cli")
+
+# sbatch errors worth retrying after a while: the controller being too busy to
+# answer, or the per-user limit on queued jobs being hit
+TRANSIENT_SBATCH_ERRORS = ("Socket timed out", "QOSMaxSubmitJobPerUserLimit")
+
+# seconds to wait before the first retry (doubling at each retry), and at most
+SBATCH_BACKOFF = 5
+SBATCH_MAX_BACKOFF = 300
+
+# submissions made by relay jobs (see ..jobs.cli_helpers:_prep_relay_script()), kept
+# in the working directory until imported into the state database; one per line, with
+# these tab-separated fields
+RELAY_SUBMISSIONS_FILE = "relay_submissions.tsv"
+RELAY_SUBMISSION_FIELDS = (
+    "sbatch_id",
+    "slurm_job_id",
+    "job_name",
+    "submitted_at",
+    "spec_name",
+    "spec_version",
+)
+
+
+class SubmissionNotRecorded(Exception):
+    """
+    Raised when an sbatch job was submitted, but its submission could not be
+    recorded in the state database (see record_submission()).
+    """
+
+    def __init__(self, sbatch_id, slurm_id, err):
+        super().__init__(
+            f"sb-{sbatch_id:04d} was submitted as Slurm job {slurm_id}, but its "
+            f"submission could not be recorded: {err}"
+        )
+        self.sbatch_id = sbatch_id
+        self.slurm_id = slurm_id
+
+
+class RelayNotSubmitted(Exception):
+    """
+    Raised when an sbatch job was submitted, but the relay job meant to submit the
+    next array in its chain (see ..jobs.cli_helpers:_prep_relay_script()) was not.
+    """
+
+    def __init__(self, sbatch_id, slurm_id, err):
+        reason = err.stderr.strip() if getattr(err, "stderr", None) else err
+        super().__init__(
+            f"sb-{sbatch_id:04d} was submitted as Slurm job {slurm_id}, but its "
+            f"relay was not: {reason}"
+        )
+        self.sbatch_id = sbatch_id
+        self.slurm_id = slurm_id
+        self.reason = reason
+
+
+def run_sbatch(args, cwd, max_retries=5, backoff=SBATCH_BACKOFF):
+    """
+    Run sbatch, retrying with exponential backoff (and some jitter, so concurrent
+    submissions do not retry in lockstep) when it fails with a transient error (see
+    TRANSIENT_SBATCH_ERRORS).
+    :param args: list of arguments to sbatch
+    :param cwd: directory to run sbatch from
+    :param max_retries: number of times to retry before giving up
+    :param backoff: seconds to wait before the first retry
+    :return: sbatch's output (e.g., 'Submitted batch job 18334739\n')
+    """
+    for attempt in range(max_retries + 1):
+        proc = subprocess.run(
+            ["sbatch"] + list(args),
+            cwd=cwd,
+            encoding="UTF-8",
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        if proc.returncode == 0:
+            return proc.stdout
+        transient = any(err in proc.stderr for err in TRANSIENT_SBATCH_ERRORS)
+        if not transient or attempt == max_retries:
+            raise subprocess.CalledProcessError(
+                proc.returncode, proc.args, output=proc.stdout, stderr=proc.stderr
+            )
+        wait = min(SBATCH_MAX_BACKOFF, backoff * 2**attempt) * random.uniform(0.5, 1)
+        logger.warning(
+            f"sbatch failed ({proc.stderr.strip()}); retrying in {wait:.1f} seconds "
+            f"({attempt + 1}/{max_retries})"
+        )
+        time.sleep(wait)
+
+
+def submit_sbatch(id, dirs, config=None, max_retries=5, backoff=SBATCH_BACKOFF):
     """
     Helper function to submit sbatch scripts. It does so from a "crashes" file, such that any
     nipype related crash files would dump to a "crashes" directory corresponding to the sbatch submission.
     This hopefully makes debugging a bit easier?
     :param id: sbatch_id (int)
     :param dirs: dirs dictionary generated by calculate_directories.
+    :param config: dict generated from reading the .yml spec, if any (its name and
+        version are recorded along with the submission)
+    :param max_retries: number of times to retry sbatch on transient errors
+    :param backoff: seconds to wait before the first retry
     :return:
     """
-    from pathlib import Path
-    import subprocess
-    import os
 
     script_to_submit = Path(dirs["slurm_scripts"]) / f"sb-{str(id).zfill(4)}.sh"
     if not script_to_submit.exists():
@@ -28,21 +127,239 @@ def submit_sbatch(id, dirs):
     from_path = from_path / f"sb-{str(id).zfill(4)}"
     from_path.mkdir(parents=True, exist_ok=True)
 
-    cmd_output = subprocess.check_output(
-        ["sbatch", str(script_to_submit)],
-        encoding="UTF-8",
+    cmd_output = run_sbatch(
+        [str(script_to_submit)],
         cwd=str(from_path),  # run from the pertinent crashes dir, so things are neat
+        max_retries=max_retries,
+        backoff=backoff,
     )
 
     # Output looks like this: 'Submitted batch job 18334739\n'
     slurm_id = cmd_output.strip().replace("Submitted batch job ", "")
+    if not slurm_id.isdigit():
+        raise ValueError(f"Unexpected output from sbatch: {cmd_output.strip()!r}")
 
     print(
         f"Sbatch job sb-{str(id).zfill(4)}.sh submitted.\n"
         f"The Slurm ID for this job (seen in squeue) is {slurm_id}."
     )
 
-    # TODO: Save this sbatch_id and slurm_id crosswalk to an internal database, allowing us to track what slurm job id corresponds with our internal
-    #       sbatch_id.
+    # the job is in the queue by now, so carry on (e.g., with its relay) regardless
+    not_recorded = []
+    try:
+        record_submission(dirs, id, slurm_id, script_to_submit.stem, config)
+    except Exception as err:
+        not_recorded.append(err)
 
+    # If this array is part of a chain (see prep_job_array), queue up the relay job that
+    # will submit the next array once this one is done.
+    relay = Path(dirs["slurm_scripts"]) / f"sb-{str(id).zfill(4)}-relay.sh"
+    relay_error = None
+    if relay.exists():
+        try:
+            relay_output = run_sbatch(
+                [f"--dependency=afterany:{slurm_id}", str(relay)],
+                cwd=str(from_path),
+                max_retries=max_retries,
+                backoff=backoff,
+            )
+        except subprocess.CalledProcessError as err:
+            relay_error = err
+            print(
+                f"Array sb-{str(id).zfill(4)} submitted, relay {relay.name} not "
+                f"submitted: {err.stderr.strip() if err.stderr else err}\n"
+                f"The next array in the chain will not be submitted on its own."
+            )
+        else:
+            print(
+                f"Relay job {relay.name} submitted; the next array in the chain will "
+                f"be submitted once Slurm job {slurm_id} is done."
+            )
+            relay_id = relay_output.strip().replace("Submitted batch job ", "")
+            try:
+                if not relay_id.isdigit():
+                    raise ValueError(
+                        f"Unexpected output from sbatch: {relay_output.strip()!r}"
+                    )
+                record_submission(dirs, id, relay_id, relay.stem, config)
+            except Exception as err:
+                not_recorded.append(err)
+
+    if relay_error is not None:
+        for err in not_recorded:
+            logger.warning(f"Submission of sb-{str(id).zfill(4)} not recorded: {err}")
+        raise RelayNotSubmitted(id, slurm_id, relay_error) from relay_error
+    if len(not_recorded) > 0:
+        raise SubmissionNotRecorded(id, slurm_id, not_recorded[0]) from not_recorded[0]
     return cmd_output
+
+
+def submit_many(
+    ids, dirs, config=None, n_workers=4, max_retries=5, backoff=SBATCH_BACKOFF
+):
+    """
+    Submit several sbatch jobs, through a bounded pool of concurrent sbatch calls
+    (see submit_sbatch()). A failed submission does not stop the others; sbatch jobs
+    that were submitted but could not be recorded are reported apart from those that
+    failed to submit.
+    :param ids: list of sbatch ids
+    :param dirs: dirs dictionary generated by calculate_directories.
+    :param config: dict generated from reading the .yml spec, if any
+    :param n_workers: maximum number of sbatch calls running at once
+    :param max_retries: number of times to retry each sbatch call on transient errors
+    :param backoff: seconds to wait before the first retry
+    :return: dict, mapping sbatch ids to their Slurm job id, or to the error raised
+        (SubmissionNotRecorded or RelayNotSubmitted if the sbatch job was submitted
+        nonetheless)
+    """
+
+    def work(sbatch_id):
+        try:
+            output = submit_sbatch(sbatch_id, dirs, config, max_retries, backoff)
+            return output.strip().replace("Submitted batch job ", "")
+        except Exception as err:  # so that one sbatch job does not sink the others
+            return err
+
+    with ThreadPoolExecutor(max_workers=n_workers) as pool:
+        results = dict(zip(ids, pool.map(work, ids)))
+
+    not_recorded = {
+        sb: err
+        for (sb, err) in results.items()
+        if isinstance(err, SubmissionNotRecorded)
+    }
+    relay_failed = {
+        sb: err
+        for (sb, err) in results.items()
+        if isinstance(err, RelayNotSubmitted)
+    }
+    failed = {
+        sb: err
+        for (sb, err) in results.items()
+        if isinstance(err, Exception)
+        and sb not in not_recorded
+        and sb not in relay_failed
+    }
+    print(f"\nsbatch jobs submitted: {len(results) - len(failed)}/{len(results)}")
+    for sbatch_id, err in failed.items():
+        reason = err.stderr.strip() if hasattr(err, "stderr") and err.stderr else err
+        print(f"sb-{sbatch_id:04d} not submitted: {reason}")
+    for sbatch_id, err in not_recorded.items():
+        print(
+            f"sb-{sbatch_id:04d} submitted as Slurm job {err.slurm_id}, not recorded: "
+            f"{err.__cause__}"
+        )
+    for sbatch_id, err in relay_failed.items():
+        print(
+            f"sb-{sbatch_id:04d} submitted as Slurm job {err.slurm_id}, relay not "
+            f"submitted: {err.reason}"
+        )
+    return results
+
+
+def record_submission(
+    dirs, sbatch_id, slurm_id, job_name, config=None, submitted_at=None
+):
+    """
+    Save the crosswalk between an sbatch id, the Slurm job id it was given, and the
+    job ids run by each of its array elements (read from its scripts) to the
+    project's state database, so it can be looked up later on (see check crosswalk),
+    and add a submitted event for each of these jobs to the event log.
+    :param dirs: dirs dictionary generated by calculate_directories.
+    :param sbatch_id: sbatch_id (int)
+    :param slurm_id: Slurm job id, as returned by sbatch
+    :param job_name: Slurm job name (e.g., sb-0001 or sb-0001-relay)
+    :param config: dict generated from reading the .yml spec, if any
+    :param submitted_at: time of the submission (seconds since the epoch), if it was
+        not just now (e.g., for submissions made by relay jobs)
+    :return:
+    """
+    from ..db import SlurmhelperDB
+    from ..utils.events import record_events
+    from ..utils.slurm import wrapper_jobs
+
+    config = config or dict()
+    state_db = SlurmhelperDB(dirs)
+    if not job_name.endswith("-relay"):
+        elements = wrapper_jobs(dirs, int(sbatch_id))
+        if state_db.get_sbatch_job(sbatch_id) != elements:
+            state_db.add_sbatch_job(
+                sbatch_id,
+                elements,
+                script=str(Path(dirs["slurm_scripts"]) / f"{job_name}.sh"),
+                is_array=None not in elements,
+                replace=True,
+            )
+    if submitted_at is None:
+        submitted_at = time.time()
+    state_db.add_submission(
+        sbatch_id,
+        int(slurm_id),
+        job_name=job_name,
+        spec_name=config.get("spec_name"),
+        spec_version=config.get("spec_version"),
+        submitted_at=submitted_at,
+    )
+    if not job_name.endswith("-relay"):
+        record_events(
+            dirs,
+            [
+                {
+                    "order_id": int(job),
+                    "sbatch_id": int(sbatch_id),
+                    "slurm_id": f"{slurm_id}" if task is None else f"{slurm_id}_{task}",
+                    "event": "submitted",
+                    "at": submitted_at,
+                }
+                for (task, jobs) in elements.items()
+                for job in jobs
+            ],
+        )
+
+
+def import_relay_submissions(dirs):
+    """
+    Record the submissions made by relay jobs, which they append to
+    RELAY_SUBMISSIONS_FILE in the working directory, to the state database (see
+    record_submission()). Submissions already recorded are skipped, so this can be
+    called as often as needed, e.g. before looking up submissions.
+    :param dirs: dirs dictionary generated by calculate_directories.
+    :return: number of submissions imported
+    """
+    from ..db import SlurmhelperDB
+
+    path = os.path.join(dirs["base"], RELAY_SUBMISSIONS_FILE)
+    if not os.path.exists(path):
+        return 0
+    with open(path, "r") as f:
+        lines = f.read().splitlines()
+
+    known = {row["slurm_job_id"] for row in SlurmhelperDB(dirs).get_submissions()}
+    n_imported = 0
+    for line in lines:
+        row = dict(zip(RELAY_SUBMISSION_FIELDS, line.split("\t")))
+        if len(row) != len(RELAY_SUBMISSION_FIELDS) or not row["sbatch_id"].isdigit():
+            logger.debug(f"Skipping malformed line in {path}: {line}")
+            continue
+        if not row["slurm_job_id"].isdigit():
+            logger.warning(f"A relay job failed to submit {row['job_name']}.")
+            continue
+        if int(row["slurm_job_id"]) in known:
+            continue
+        record_submission(
+            dirs,
+            int(row["sbatch_id"]),
+            row["slurm_job_id"],
+            row["job_name"],
+            config={
+                "spec_name": row["spec_name"] or None,
+                "spec_version": row["spec_version"] or None,
+            },
+            submitted_at=float(row["submitted_at"]),
+        )
+        known.add(int(row["slurm_job_id"]))
+        n_imported += 1
+
+    if n_imported > 0:
+        logger.info(f"Imported {n_imported} submissions made by relay jobs.")
+    return n_imported
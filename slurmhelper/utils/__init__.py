@@ -6,8 +6,20 @@ Submodules
 .. autosummary::
     :toctree: _autosummary
 
+    analytics
+    checksums
+    events
     io
+    job_tests
+    local_slurm
+    logs
     misc
+    output_index
+    planning
+    queue_status
     reporting
+    slurm
     time
+    usage
+    validation
 """
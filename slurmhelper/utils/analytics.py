@@ -0,0 +1,154 @@
+"""
+Runtime analytics: summarize how long jobs actually took, overall or by groups of
+jobs (e.g., by subject or session), to help tune job_time and max_job_time.
+"""
+
+import logging
+import time
+
+import pandas as pd
+
+from .io import export_table
+
+logger = logging.getLogger("cli")
+
+DEFAULT_PERCENTILES = (0.5, 0.75, 0.9, 0.95, 0.99)
+
+# runtimes (plus ramp up time) above this fraction of max_job_time are flagged
+NEAR_LIMIT = 0.9
+
+# runtimes further than this many IQRs from the quartiles of their group are
+# flagged as outliers (Tukey's fences); groups smaller than OUTLIER_MIN_GROUP are
+# not considered
+OUTLIER_IQR_FACTOR = 1.5
+OUTLIER_MIN_GROUP = 4
+
+
+def build_runtime_table(status, db, config, group_by=None, near_limit=NEAR_LIMIT):
+    """
+    Assemble a per-job runtime table for successfully completed jobs, joined with
+    their database columns and flagged against the time limits in the spec.
+    :param status: pd.DataFrame, output of ..utils.reporting:get_job_status()
+    :param db: pd.DataFrame, job database (db.csv)
+    :param config: dict generated from reading the .yml spec
+    :param group_by: list of db columns to look for outliers within (None: all jobs)
+    :param near_limit: fraction of max_job_time above which to flag runtimes
+    :return: pd.DataFrame indexed by order_id, with the db columns, runtime
+        (seconds), host, max_rss_kb, and columns:
+        - frac_job_time: runtime as a fraction of job_time
+        - frac_max_job_time: runtime (plus ramp up time) as a fraction of max_job_time
+        - over_job_time: runtime exceeds job_time
+        - near_wall_time: frac_max_job_time is at least near_limit
+        - outlier: runtime is an outlier within its group (see OUTLIER_IQR_FACTOR)
+    """
+    done = status.loc[
+        status["success"] & status["runtime"].notna(), ["runtime", "host", "max_rss_kb"]
+    ]
+    df = db.set_index("order_id").join(done, how="inner")
+    df["runtime"] = df["runtime"].astype("float64")
+
+    job_time = config["job_time"].total_seconds()
+    ramp_up = config["job_ramp_up_time"].total_seconds()
+    max_time = config["max_job_time"].total_seconds()
+
+    df["frac_job_time"] = df["runtime"] / job_time
+    df["frac_max_job_time"] = (df["runtime"] + ramp_up) / max_time
+    df["over_job_time"] = df["runtime"] > job_time
+    df["near_wall_time"] = df["frac_max_job_time"] >= near_limit
+    df["outlier"] = flag_outliers(df, group_by)
+
+    return df.sort_index()
+
+
+def _grouped(df, group_by):
+    if group_by:
+        return df.groupby(list(group_by))
+    return df.groupby(pd.Series(True, index=df.index))
+
+
+def flag_outliers(df, group_by=None, factor=OUTLIER_IQR_FACTOR):
+    """
+    Flag runtimes outside of Tukey's fences within their group.
+    :param df: pd.DataFrame with a runtime column (and the group_by columns)
+    :param group_by: list of columns to group by (None: all jobs in one group)
+    :param factor: number of IQRs beyond the quartiles to put the fences at
+    :return: pd.Series of bools, aligned with df
+    """
+    runtime = _grouped(df, group_by)["runtime"]
+    q1 = runtime.transform(lambda x: x.quantile(0.25))
+    q3 = runtime.transform(lambda x: x.quantile(0.75))
+    n = runtime.transform("count")
+    iqr = q3 - q1
+    out = (df["runtime"] < q1 - factor * iqr) | (df["runtime"] > q3 + factor * iqr)
+    return out & (n >= OUTLIER_MIN_GROUP)
+
+
+def summarize_runtimes(df, group_by=None, percentiles=DEFAULT_PERCENTILES):
+    """
+    Summarize a runtime table (see build_runtime_table()), overall or by group.
+    :param df: pd.DataFrame, output of build_runtime_table()
+    :param group_by: list of columns to group by (None: all jobs in one group)
+    :param percentiles: percentiles (between 0 and 1) to compute
+    :return: pd.DataFrame, one row per group, with counts of jobs and flags, and
+        runtime statistics (seconds)
+    """
+    grouped = _grouped(df, group_by)
+    runtime = grouped["runtime"]
+
+    quantiles = runtime.quantile(list(percentiles)).unstack()
+    quantiles.columns = [f"p{round(q * 100):d}" for q in quantiles.columns]
+
+    summary = pd.concat(
+        [
+            runtime.count().rename("n_jobs"),
+            runtime.mean().rename("mean"),
+            runtime.min().rename("min"),
+            quantiles,
+            runtime.max().rename("max"),
+            grouped["over_job_time"].sum().rename("n_over_job_time"),
+            grouped["near_wall_time"].sum().rename("n_near_wall_time"),
+            grouped["outlier"].sum().rename("n_outliers"),
+        ],
+        axis=1,
+    )
+    if not group_by:
+        summary.index = ["all jobs"]
+    return summary
+
+
+def suggest_time_settings(df, config, percentile=0.9):
+    """
+    Suggest values for the time settings in the spec, from observed runtimes. As in
+    the spec guidelines, job_time should be around the 90th percentile of runtimes,
+    and max_job_time should leave room for the longest job plus ramp up time.
+    :param df: pd.DataFrame, output of build_runtime_table()
+    :param config: dict generated from reading the .yml spec
+    :param percentile: percentile of runtimes to suggest as job_time
+    :return: dict with suggested job_time and the minimum max_job_time (timedeltas)
+    """
+    ramp_up = config["job_ramp_up_time"]
+    return {
+        "job_time": pd.Timedelta(seconds=df["runtime"].quantile(percentile)).ceil(
+            "s"
+        ),
+        "min_max_job_time": (ramp_up + pd.Timedelta(seconds=df["runtime"].max())).ceil(
+            "s"
+        ),
+    }
+
+
+def export_runtimes(df, summary, checks_dir, fmt="csv"):
+    """
+    Save a runtime table and its summary to the checks directory, as
+    runtimes_<timestamp>.<fmt> and runtimes_summary_<timestamp>.<fmt>.
+    :param df: pd.DataFrame, output of build_runtime_table()
+    :param summary: pd.DataFrame, output of summarize_runtimes()
+    :param checks_dir: path to checks directory
+    :param fmt: one of ..utils.io:EXPORT_FORMATS; parquet requires pyarrow or fastparquet
+    :return: list of paths written
+    """
+    timestamp = time.strftime("%Y%m%d-%H%M%S")
+    return [
+        export_table(table, checks_dir, name, fmt, timestamp)
+        for name, table in (("runtimes", df), ("runtimes_summary", summary))
+    ]
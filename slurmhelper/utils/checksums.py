@@ -0,0 +1,214 @@
+"""
+Checksum manifests of job outputs, so outputs can be verified (e.g., before work
+directories are cleaned up). Files are hashed in a process pool; files whose size
+and mtime did not change since they were last hashed are not hashed again.
+"""
+
+import hashlib
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+logger = logging.getLogger("cli")
+
+# size of the chunks files are read in, when hashing them
+HASH_CHUNK_BYTES = 1 << 20
+
+# hash algorithms available for manifests, fastest first; xxhash ones require the
+# xxhash package
+MANIFEST_ALGORITHMS = ("xxh3_128", "xxh64", "blake2b", "sha256")
+
+MANIFEST_COLUMNS = ("path", "size", "mtime", "digest")
+
+
+def available_algorithms():
+    """
+    List the manifest hash algorithms available in this environment.
+    :return: list of algorithm names, fastest first
+    """
+    return [
+        a for a in MANIFEST_ALGORITHMS if not a.startswith("xxh") or xxhash is not None
+    ]
+
+
+def _new_hasher(algorithm):
+    if algorithm.startswith("xxh"):
+        if xxhash is None:
+            raise ImportError(
+                f"Hash algorithm {algorithm} requires the xxhash package; please "
+                f"install it, or use one of: {' '.join(available_algorithms())}"
+            )
+        return getattr(xxhash, algorithm)()
+    return hashlib.new(algorithm)
+
+
+def hash_file(path, algorithm="sha256", chunk_size=HASH_CHUNK_BYTES):
+    """
+    Hash a file, reading it in chunks.
+    :param path: path to file
+    :param algorithm: name of a hashlib algorithm, or of an xxhash one (e.g., xxh64)
+    :param chunk_size: number of bytes to read at a time
+    :return: hex digest
+    """
+    h = _new_hasher(algorithm)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def manifest_path(checksums_dir, job_id):
+    return os.path.join(checksums_dir, "{job:05d}.tsv".format(job=job_id))
+
+
+def read_manifest(path):
+    """
+    Read a job's checksum manifest.
+    :param path: path to manifest
+    :return: tuple, (algorithm, dict mapping file paths to (size, mtime, digest)
+        tuples); (None, {}) if there is no manifest
+    """
+    if not os.path.isfile(path):
+        return None, dict()
+    # mtimes are compared with those of files, so they must read back exactly
+    df = pd.read_csv(path, sep="\t", float_precision="round_trip")
+    algorithm = df.columns[-1]
+    df[algorithm] = df[algorithm].astype(str)
+    return algorithm, {
+        p: (size, mtime, digest)
+        for (p, size, mtime, digest) in df.itertuples(index=False, name=None)
+    }
+
+
+def write_manifest(path, algorithm, files):
+    """
+    Write a job's checksum manifest (tab-separated; the digest column is named after
+    the algorithm), atomically.
+    :param path: path to manifest
+    :param algorithm: hash algorithm used
+    :param files: dict mapping file paths to (size, mtime, digest) tuples
+    :return:
+    """
+    df = pd.DataFrame(
+        [(p,) + files[p] for p in sorted(files)], columns=MANIFEST_COLUMNS
+    ).rename(columns={"digest": algorithm})
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    df.to_csv(tmp_path, sep="\t", index=False)
+    os.replace(tmp_path, path)
+
+
+def _hash_one(args):
+    path, algorithm = args
+    try:
+        return hash_file(path, algorithm)
+    except OSError:
+        return None
+
+
+def hash_files(paths, algorithm, n_workers=None):
+    """
+    Hash a set of files in a process pool.
+    :param paths: list of paths
+    :param algorithm: hash algorithm
+    :param n_workers: number of processes to use (defaults to the number of CPUs)
+    :return: dict mapping paths to hex digests (None for files that could not be read)
+    """
+    if len(paths) == 0:
+        return dict()
+    # small chunks of work per process, but not one at a time
+    chunksize = max(1, min(64, len(paths) // (4 * (n_workers or os.cpu_count()))))
+    with ProcessPoolExecutor(max_workers=n_workers) as pool:
+        digests = pool.map(
+            _hash_one, [(p, algorithm) for p in paths], chunksize=chunksize
+        )
+        return dict(zip(paths, digests))
+
+
+def update_manifests(
+    checksums_dir, output_files, algorithm, n_workers=None, verify=False
+):
+    """
+    Bring the checksum manifests of a set of jobs up to date with their output files.
+    Only files that are new, or whose size or mtime changed, are hashed; with verify,
+    all files are hashed again and compared with their recorded digests.
+    :param checksums_dir: directory to keep manifests in (one per job)
+    :param output_files: dict, mapping job ids to lists of their output files, as
+        ..utils.job_tests:OutputFile tuples
+    :param algorithm: hash algorithm (see available_algorithms())
+    :param n_workers: number of processes used to hash files
+    :param verify: if True, hash all files again, and report those whose digest does
+        not match their manifest even though their size and mtime did not change
+    :return: pd.DataFrame indexed by order_id, with columns n_files, n_hashed,
+        n_unreadable, n_changed (files hashed again whose digest changed), n_removed
+        (files in the manifest that no longer exist), and n_corrupt (with verify:
+        digest changed but size and mtime did not)
+    """
+    os.makedirs(checksums_dir, exist_ok=True)
+    manifests = {
+        job: read_manifest(manifest_path(checksums_dir, job)) for job in output_files
+    }
+
+    to_hash = set()
+    for job, files in output_files.items():
+        recorded_algorithm, recorded = manifests[job]
+        for f in files:
+            if (
+                verify
+                or recorded_algorithm != algorithm
+                or recorded.get(f.path, (None, None))[:2] != (f.size, f.mtime)
+            ):
+                to_hash.add(f.path)
+
+    logger.info(f"Hashing {len(to_hash)} files with {algorithm}...")
+    digests = hash_files(sorted(to_hash), algorithm, n_workers)
+
+    rows = []
+    for job, files in output_files.items():
+        recorded_algorithm, recorded = manifests[job]
+        if recorded_algorithm != algorithm:
+            recorded = dict()
+        current = dict()
+        counts = {"n_hashed": 0, "n_unreadable": 0, "n_changed": 0, "n_corrupt": 0}
+        for f in files:
+            old = recorded.get(f.path)
+            if f.path not in digests:
+                current[f.path] = old
+                continue
+            digest = digests[f.path]
+            counts["n_hashed"] += 1
+            if digest is None:
+                counts["n_unreadable"] += 1
+                continue
+            if old is not None and old[2] != digest:
+                if old[:2] == (f.size, f.mtime):
+                    counts["n_corrupt"] += 1
+                else:
+                    counts["n_changed"] += 1
+            current[f.path] = (f.size, f.mtime, digest)
+
+        n_removed = len(set(recorded) - {f.path for f in files})
+        if counts["n_hashed"] > 0 or n_removed > 0 or recorded_algorithm != algorithm:
+            write_manifest(manifest_path(checksums_dir, job), algorithm, current)
+        rows.append(
+            dict(counts, order_id=job, n_files=len(current), n_removed=n_removed)
+        )
+
+    return pd.DataFrame(
+        rows,
+        columns=[
+            "order_id",
+            "n_files",
+            "n_hashed",
+            "n_unreadable",
+            "n_changed",
+            "n_removed",
+            "n_corrupt",
+        ],
+    ).set_index("order_id")
@@ -0,0 +1,361 @@
+"""
+Event log of job lifecycle transitions (scripted, staged, submitted, pending,
+running, completed, failed, cleaned), kept in the project's state database (see
+..db:SlurmhelperDB). Events are recorded as jobs are prepared, staged, submitted,
+seen in the queue and found finished in their logs, so that queue waits, run times
+and throughput can be computed from the log alone, without re-reading logs or
+querying Slurm.
+"""
+
+import logging
+import sqlite3
+import subprocess
+import time
+
+import numpy as np
+import pandas as pd
+
+from ..db import SlurmhelperDB
+from .logs import scan_job_logs
+from .slurm import TERMINAL_STATES, expand_by_job
+from .usage import read_usage
+
+logger = logging.getLogger("cli")
+
+JOB_EVENTS = (
+    "scripted",
+    "staged",
+    "submitted",
+    "pending",
+    "running",
+    "completed",
+    "failed",
+    "cleaned",
+)
+
+# squeue states (see ..utils.slurm:parse_squeue()) recorded as events
+QUEUE_EVENTS = {
+    "PENDING": "pending",
+    "CONFIGURING": "running",
+    "RUNNING": "running",
+    "COMPLETING": "running",
+}
+
+# events timed in the timeline of each attempt at running a job
+ATTEMPT_EVENTS = ("submitted", "pending", "running", "completed", "failed")
+
+EVENT_FIELDS = ("order_id", "sbatch_id", "slurm_id", "event", "detail", "at")
+
+# detail of the failed events of jobs that left the queue without an exit code, when
+# sacct does not tell how they ended
+LOST_DETAIL = "left queue without exit code"
+
+
+def record_events(dirs, events):
+    """
+    Append events to the event log, and set the state of the jobs concerned to
+    their last event. Failing to record events is not fatal to the operation that
+    triggered them, so database errors are only logged.
+    :param dirs: output of ..utils.io:calculate_directories()
+    :param events: list of dicts with event (one of JOB_EVENTS), and any of
+        order_id, sbatch_id, slurm_id, detail and at (defaults to now)
+    :return: number of events recorded
+    """
+    if len(events) == 0:
+        return 0
+    try:
+        state_db = SlurmhelperDB(dirs)
+        state_db.add_events(events)
+        state_db.set_job_states(
+            {e["order_id"]: e["event"] for e in events if e.get("order_id") is not None}
+        )
+    except sqlite3.Error as err:
+        logger.warning(f"Could not record {len(events)} job events: {err}")
+        return 0
+    logger.info(f"Recorded {len(events)} job events.")
+    return len(events)
+
+
+def record_job_events(dirs, event, job_list, sbatch_id=None, at=None, detail=None):
+    """
+    Record the same event for a set of jobs.
+    :param dirs: output of ..utils.io:calculate_directories()
+    :param event: one of JOB_EVENTS
+    :param job_list: list of job ids
+    :param sbatch_id: int, or None
+    :param at: time of the event (seconds since the epoch); defaults to now
+    :param detail: str, or None
+    :return: number of events recorded
+    """
+    at = time.time() if at is None else at
+    return record_events(
+        dirs,
+        [
+            {
+                "order_id": int(job),
+                "sbatch_id": sbatch_id,
+                "event": event,
+                "detail": detail,
+                "at": at,
+            }
+            for job in job_list
+        ],
+    )
+
+
+def latest_job_events(dirs, job_list=None):
+    """
+    Tabulate when each job last went through each kind of event.
+    :param dirs: output of ..utils.io:calculate_directories()
+    :param job_list: list of job ids, or None (all jobs)
+    :return: pd.DataFrame indexed by order_id, with a column per event in
+        JOB_EVENTS (time it was last recorded, or NaN) and last_event
+    """
+    rows = pd.DataFrame(
+        SlurmhelperDB(dirs).latest_events(job_list), columns=["order_id", "event", "at"]
+    )
+    df = rows.pivot(index="order_id", columns="event", values="at")
+    df = df.reindex(columns=list(JOB_EVENTS)).astype("float64")
+    # ties (e.g., running backdated by a runtime of 0) go by lifecycle order
+    rows["rank"] = rows["event"].map({e: i for (i, e) in enumerate(JOB_EVENTS)})
+    df["last_event"] = (
+        rows.sort_values(["at", "rank"]).groupby("order_id")["event"].last()
+    )
+    df.index = df.index.astype("int64")
+    return df.rename_axis(index="order_id", columns=None)
+
+
+def record_queue_events(dirs, queue, taken_at):
+    """
+    Record pending and running events for jobs in a queue snapshot, where this is a
+    change from their last recorded event, and the outcome of the jobs last seen
+    running that have left the queue since (see record_lost_jobs()).
+    :param dirs: output of ..utils.io:calculate_directories()
+    :param queue: pd.DataFrame, output of ..utils.queue_status:queue_table()
+    :param taken_at: time the snapshot was taken (seconds since the epoch)
+    :return: number of events recorded
+    """
+    in_queue = expand_by_job(queue)
+    n_events = record_lost_jobs(dirs, in_queue.index, taken_at)
+
+    jobs = in_queue[in_queue["state"].isin(QUEUE_EVENTS)]
+    jobs = jobs[~jobs.index.duplicated(keep="last")]
+    if len(jobs) == 0:
+        return n_events
+    event = jobs["state"].map(QUEUE_EVENTS)
+    last = latest_job_events(dirs, jobs.index.tolist())["last_event"]
+    new = jobs[event != last.reindex(jobs.index)]
+    return n_events + record_events(
+        dirs,
+        [
+            {
+                "order_id": int(job),
+                "sbatch_id": None if pd.isna(row.sbatch_id) else int(row.sbatch_id),
+                "slurm_id": row.slurm_id,
+                "event": QUEUE_EVENTS[row.state],
+                "detail": row.reason or None,
+                "at": taken_at,
+            }
+            for (job, row) in new.iterrows()
+        ],
+    )
+
+
+def record_lost_jobs(dirs, queued, taken_at):
+    """
+    Record the outcome of the jobs last seen running that are not in the queue
+    anymore. Those whose log (or result record) has an exit code get the usual
+    completed or failed event (see record_log_events()). The others were killed
+    before they could write one (e.g., on a node failure), and are recorded as
+    failed at the time of the snapshot, detailed by their final state in sacct if
+    it is known, or else by LOST_DETAIL.
+    :param dirs: output of ..utils.io:calculate_directories()
+    :param queued: list-like of the job ids in the queue snapshot
+    :param taken_at: time the snapshot was taken (seconds since the epoch)
+    :return: number of events recorded
+    """
+    try:
+        seen = SlurmhelperDB(dirs).last_seen("running")
+    except sqlite3.Error as err:
+        logger.warning(f"Could not look up the jobs last seen running: {err}")
+        return 0
+    lost = pd.DataFrame(seen, columns=["order_id", "sbatch_id", "slurm_id", "at"])
+    lost = lost[~lost["order_id"].isin(queued) & (lost["at"] < taken_at)]
+    if len(lost) == 0:
+        return 0
+
+    status = scan_job_logs(
+        dirs["job_logs"],
+        lost["order_id"].tolist(),
+        results_dir=dirs.get("job_results"),
+    )
+    finished = status[status["exit_code"].notna()]
+    n_events = record_log_events(dirs, finished)
+
+    lost = lost[~lost["order_id"].isin(finished.index)]
+    states = _sacct_states(dirs, lost["slurm_id"].dropna())
+    return n_events + record_events(
+        dirs,
+        [
+            {
+                "order_id": int(row.order_id),
+                "sbatch_id": None if pd.isna(row.sbatch_id) else int(row.sbatch_id),
+                "slurm_id": row.slurm_id,
+                "event": "failed",
+                "detail": states.get(row.slurm_id, LOST_DETAIL),
+                "at": taken_at,
+            }
+            for row in lost.itertuples()
+        ],
+    )
+
+
+def _sacct_states(dirs, slurm_ids):
+    """
+    Look up the final state of Slurm jobs (or array tasks) in sacct.
+    :param dirs: output of ..utils.io:calculate_directories()
+    :param slurm_ids: list-like of Slurm ids (e.g., 1234 or 1234_101)
+    :return: dict, mapping Slurm ids to their state (one of TERMINAL_STATES); empty
+        if sacct cannot be queried
+    """
+    slurm_job_ids = sorted({int(str(i).split("_")[0]) for i in slurm_ids})
+    if len(slurm_job_ids) == 0:
+        return dict()
+    try:
+        usage = read_usage(dirs, slurm_ids=slurm_job_ids)
+    except (OSError, subprocess.CalledProcessError) as err:
+        logger.warning(f"Could not query sacct ({err}); final job states unknown.")
+        return dict()
+    usage = usage[usage["state"].isin(TERMINAL_STATES)]
+    return dict(zip(usage["slurm_id"], usage["state"]))
+
+
+def record_log_events(dirs, status):
+    """
+    Record completed and failed events for jobs whose logs show they finished since
+    their last recorded outcome, timed by their result record (or log). Jobs whose
+    start was not seen in the queue since they were last submitted also get a
+    running event, backdated by their runtime, where it is known.
+    :param dirs: output of ..utils.io:calculate_directories()
+    :param status: pd.DataFrame, output of ..utils.logs:scan_job_logs()
+    :return: number of events recorded
+    """
+    finished = status[status["exit_code"].notna()]
+    if len(finished) == 0:
+        return 0
+    ended = finished["record_mtime"].fillna(finished["log_mtime"])
+    latest = latest_job_events(dirs, finished.index.tolist()).reindex(finished.index)
+
+    # comparisons with NaN are False: jobs with no outcome recorded yet are new
+    new = ~(ended <= latest[["completed", "failed"]].max(axis=1))
+    seen_running = latest["running"] >= latest["submitted"].fillna(-np.inf)
+    backfill = new & finished["runtime"].notna() & ~seen_running
+    started = ended - finished["runtime"].astype("float64")
+
+    events = [
+        {"order_id": int(job), "event": "running", "at": started[job]}
+        for job in finished.index[backfill]
+    ]
+    events += [
+        {
+            "order_id": int(job),
+            "event": "completed" if finished.at[job, "success"] else "failed",
+            "detail": _outcome_detail(finished.loc[job]),
+            "at": ended[job],
+        }
+        for job in finished.index[new]
+    ]
+    return record_events(dirs, events)
+
+
+def _outcome_detail(status):
+    """
+    Describe the outcome of a job, e.g. 'exit code 143 (TIMEOUT, SIGTERM)'.
+    :param status: pd.Series, a row of ..utils.logs:scan_job_logs()
+    :return: str
+    """
+    detail = f"exit code {status['exit_code']}"
+    causes = []
+    if pd.notna(status.get("cause")):
+        causes.append(status["cause"])
+    if pd.notna(status.get("signal")):
+        causes.append(f"SIG{status['signal']}")
+    if len(causes) > 0:
+        detail += f" ({', '.join(causes)})"
+    return detail
+
+
+def read_events(dirs, job_list=None):
+    """
+    Read the event log.
+    :param dirs: output of ..utils.io:calculate_directories()
+    :param job_list: list of job ids to keep, or None (all events)
+    :return: pd.DataFrame with the columns in EVENT_FIELDS, oldest first
+    """
+    df = pd.DataFrame(SlurmhelperDB(dirs).get_events(), columns=EVENT_FIELDS)
+    df["order_id"] = df["order_id"].astype("float64").astype("Int64")
+    df["sbatch_id"] = df["sbatch_id"].astype("float64").astype("Int64")
+    df["at"] = df["at"].astype("float64")
+    if job_list is not None:
+        df = df[df["order_id"].isin(job_list)]
+    return df.reset_index(drop=True)
+
+
+def job_timeline(events):
+    """
+    Lay out the events of each attempt at running a job side by side. An attempt
+    starts when the job is submitted, or when it is seen in the queue after
+    anything but a submission (e.g., for arrays submitted by a relay job).
+    :param events: pd.DataFrame, output of read_events()
+    :return: pd.DataFrame indexed by order_id and attempt, with sbatch_id, the
+        first time of each event in ATTEMPT_EVENTS (seconds since the epoch, or
+        NaN), outcome (completed, failed, or NA if unknown yet), and queue_wait
+        and run_time (pd.Timedelta)
+    """
+    df = events[events["order_id"].notna()].sort_values("at", kind="mergesort")
+    previous = df.groupby("order_id")["event"].shift()
+    starts = (df["event"] == "submitted") | (
+        df["event"].isin(["pending", "running"])
+        & ~previous.isin(["submitted", "pending", "running"])
+    )
+    df = df.assign(attempt=starts.astype("int64").groupby(df["order_id"]).cumsum())
+    df = df[df["attempt"] > 0]
+
+    keys = ["order_id", "attempt"]
+    times = df.pivot_table(index=keys, columns="event", values="at", aggfunc="min")
+    timeline = times.reindex(columns=list(ATTEMPT_EVENTS)).astype("float64")
+    timeline.columns.name = None
+    timeline.insert(0, "sbatch_id", df.groupby(keys)["sbatch_id"].first())
+
+    queued = timeline["submitted"].fillna(timeline["pending"])
+    ended = timeline["completed"].fillna(timeline["failed"])
+    timeline["outcome"] = pd.Series(
+        np.select(
+            [timeline["completed"].notna(), timeline["failed"].notna()],
+            ["completed", "failed"],
+            default=None,
+        ),
+        index=timeline.index,
+        dtype="object",
+    )
+    timeline["queue_wait"] = pd.to_timedelta(timeline["running"] - queued, unit="s")
+    timeline["run_time"] = pd.to_timedelta(ended - timeline["running"], unit="s")
+    return timeline
+
+
+def throughput(events, freq="60min"):
+    """
+    Count jobs finished over time.
+    :param events: pd.DataFrame, output of read_events()
+    :param freq: pandas frequency string of the time bins (e.g., 15min, 60min, 1D)
+    :return: pd.DataFrame indexed by time bin (UTC, including empty bins), with the
+        number of jobs completed and failed in each
+    """
+    done = events[events["event"].isin(["completed", "failed"])]
+    counts = pd.crosstab(
+        pd.to_datetime(done["at"], unit="s").dt.floor(freq).rename("time"),
+        done["event"],
+    )
+    counts = counts.reindex(columns=["completed", "failed"], fill_value=0)
+    counts.columns.name = None
+    return counts.resample(freq).sum()
@@ -6,7 +6,7 @@ import logging
 import os
 import subprocess
 from pathlib import Path
-from time import sleep
+from time import sleep, strftime
 
 import pandas as pd
 import progressbar
@@ -36,6 +36,35 @@ def is_valid_db(db_file):
     return "order_id" in db.columns
 
 
+EXPORT_FORMATS = ("csv", "parquet")
+
+
+def export_table(table, checks_dir, name, fmt="csv", timestamp=None):
+    """
+    Save a table to the checks directory, as <name>_<timestamp>.<fmt>.
+    :param table: pd.DataFrame to save (its index is saved too)
+    :param checks_dir: path to checks directory
+    :param name: file name prefix (e.g., status)
+    :param fmt: one of EXPORT_FORMATS; parquet requires pyarrow or fastparquet
+    :param timestamp: str to use as timestamp; defaults to the current time
+    :return: path written
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(
+            f"Invalid export format: {fmt}. Should be one of: {' '.join(EXPORT_FORMATS)}"
+        )
+    if timestamp is None:
+        timestamp = strftime("%Y%m%d-%H%M%S")
+
+    path = os.path.join(checks_dir, f"{name}_{timestamp}.{fmt}")
+    if fmt == "csv":
+        table.to_csv(path)
+    else:
+        table.to_parquet(path)
+    logger.info(f"Wrote file: {path}")
+    return path
+
+
 def calculate_directories(basepath, base_dir_name):
     """
     Calculate the directory structure we want to build for running
@@ -48,10 +77,12 @@ def calculate_directories(basepath, base_dir_name):
     return {
         "base": base,
         "checks": os.path.join(base, "checks"),
+        "checksums": os.path.join(base, "checks", "checksums"),
         "slurm_scripts": os.path.join(base, "scripts", "slurm"),
         "slurm_logs": os.path.join(base, "logs", "slurm"),
         "job_scripts": os.path.join(base, "scripts", "jobs"),
         "job_logs": os.path.join(base, "logs", "jobs"),
+        "job_results": os.path.join(base, "logs", "results"),
         "job_inputs": os.path.join(base, "inputs"),
         "job_work": os.path.join(base, "work"),
         "crashes": os.path.join(base, "crashes"),
@@ -117,7 +148,7 @@ def write_job_script(job_id, sbatch_id, dirs, script):
             logger.info(f"Wrote file: {path_sbatch}")
 
 
-def copy_or_clean(job_list, operation, path_scripts):
+def copy_or_clean(job_list, operation, path_scripts, dirs=None):
     """
     Helper function designed to facilitate:
 
@@ -131,11 +162,14 @@ def copy_or_clean(job_list, operation, path_scripts):
     :param job_list: list o' job ids to work with
     :param operation: either copy or clear
     :param path_scripts: where do we expect to find the scripts generated from R (abs path)
+    :param dirs: output of calculate_directories(); if given, jobs whose script ran
+        successfully are logged as staged (copy) or cleaned (clean) in the event log
     :return: nothin', just some good ol' stuff done via bash
     """
     if not (operation == "copy" or operation == "clean"):
         raise AssertionError("invalid operation specified: %s" % (operation))
     logger.info("========== BEGIN DOING STUFF ==========")
+    done = []
     for i in progressbar.progressbar(range(len(job_list)), redirect_stdout=True):
         job_id = job_list[i]
         logger.info(
@@ -148,11 +182,17 @@ def copy_or_clean(job_list, operation, path_scripts):
         )
         target_path = os.path.join(path_scripts, script_name)
         logger.info("RUNNING: bash {tgt_path}".format(tgt_path=target_path))
-        subprocess.run(["bash", target_path])
+        if subprocess.run(["bash", target_path]).returncode == 0:
+            done.append(job_id)
         logger.info(
             "----------- DONE DOING STUFF FOR JOB {job_id:05d} -----------".format(
                 job_id=job_id
             )
         )
         sleep(0.1)
+    if dirs is not None:
+        from .events import record_job_events
+
+        event = "staged" if operation == "copy" else "cleaned"
+        record_job_events(dirs, event, done)
     logger.info("========== TOTALLY DONE! YEE HAW :) ==========")
@@ -0,0 +1,344 @@
+"""
+Pluggable job tests, declared in the spec (job_tests) and run on the outputs of a set
+of jobs in a thread pool. Results are cached per job and test, so a test is only run
+again once its settings or the job's output files change.
+"""
+
+import hashlib
+import importlib
+import logging
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from ..db import StateCache
+from .checksums import hash_file
+from .logs import N_WORKERS
+
+logger = logging.getLogger("cli")
+
+OutputFile = namedtuple("OutputFile", ["path", "size", "mtime"])
+
+# test types, by name; see register_job_test()
+JOB_TESTS = dict()
+
+# names of the tests always run by ..utils.validation:validate_jobs()
+BUILTIN_TEST_NAMES = ("check_outputs", "check_inputs", "check_work", "check_log")
+
+
+def register_job_test(name):
+    """
+    Decorator, registers a function as a job test type that can be used in the spec.
+    Test functions are called with the job (a dict with its db columns, order_id and
+    output_dir), the list of its output files (OutputFile tuples), and the
+    remaining keys of the test's entry in the spec, and return a tuple (result,
+    list of log messages).
+    :param name: name of the test type (the spec's type key)
+    :return: decorator
+    """
+
+    def decorator(func):
+        JOB_TESTS[name] = func
+        return func
+
+    return decorator
+
+
+@register_job_test("file_count")
+def test_file_count(job, files, expected=None, min_files=None, max_files=None):
+    n = len(files)
+    if expected is not None and n != expected:
+        return False, [f"expected {expected:d} files, found {n:d}"]
+    if min_files is not None and n < min_files:
+        return False, [f"expected at least {min_files:d} files, found {n:d}"]
+    if max_files is not None and n > max_files:
+        return False, [f"expected at most {max_files:d} files, found {n:d}"]
+    return True, []
+
+
+@register_job_test("min_file_size")
+def test_min_file_size(job, files, min_bytes=1):
+    small = [
+        f"{os.path.basename(f.path)} ({f.size:d} bytes)"
+        for f in files
+        if f.size < min_bytes
+    ]
+    if len(small) > 0:
+        return False, [f"files smaller than {min_bytes:d} bytes: {', '.join(small)}"]
+    return True, []
+
+
+@register_job_test("checksum")
+def test_checksum(job, files, manifest, algorithm="sha256"):
+    """
+    Compare output files with a manifest in the format written by sha256sum and
+    the like (<digest>  <file name>, one per line), whose path may use the job's
+    db columns and output_dir, e.g. '{output_dir}/SHA256SUMS'.
+    """
+    path = manifest.format(**job)
+    if not os.path.isfile(path):
+        return False, [f"checksum manifest not found at {path}"]
+
+    expected = dict()
+    with open(path, "r") as f:
+        for line in f:
+            parts = line.rstrip("\n").split(None, 1)
+            if len(parts) == 2:
+                # a leading * marks files hashed in binary mode
+                expected[parts[1].lstrip("*")] = parts[0].lower()
+
+    found = {os.path.basename(f.path): f.path for f in files}
+    logs = []
+    for name, digest in sorted(expected.items()):
+        if name not in found:
+            logs.append(f"{name} is missing")
+        elif hash_file(found[name], algorithm) != digest:
+            logs.append(f"{name} does not match its checksum")
+    return len(logs) == 0, logs
+
+
+@register_job_test("python")
+def test_python(job, files, function, **params):
+    """
+    Run a custom test, given as 'package.module:function'; it is called like the
+    built-in tests, with any other keys of the test's entry as keyword arguments.
+    """
+    return load_callable(function)(job, files, **params)
+
+
+def load_callable(spec):
+    """
+    Import a function from its 'package.module:function' name.
+    :param spec: str
+    :return: function
+    """
+    module, _, name = spec.partition(":")
+    if name == "":
+        raise ValueError(f"Invalid test function: {spec}. Should be module:function")
+    return getattr(importlib.import_module(module), name)
+
+
+def parse_job_tests(config):
+    """
+    Read the job tests declared in the spec (job_tests): a list of entries with a
+    type (one of JOB_TESTS), an optional name (defaults to the type), and settings
+    for that type.
+    :param config: dict generated from reading the .yml spec
+    :return: list of dicts with name, type and params
+    """
+    tests = []
+    for entry in config.get("job_tests") or []:
+        entry = dict(entry)
+        test_type = entry.pop("type", None)
+        if test_type not in JOB_TESTS:
+            raise ValueError(
+                f"Invalid job test type: {test_type}. Should be one of: "
+                f"{' '.join(sorted(JOB_TESTS))}"
+            )
+        name = entry.pop("name", test_type)
+        if name in BUILTIN_TEST_NAMES:
+            raise ValueError(f"Job test name {name} is reserved for built-in tests.")
+        if name in {t["name"] for t in tests}:
+            raise ValueError(f"Job test {name} is declared more than once.")
+        tests.append({"name": name, "type": test_type, "params": entry})
+    return tests
+
+
+def fingerprint(test, files):
+    """
+    Summarize what a test's result depends on: its settings, and the names, sizes
+    and mtimes of the job's output files.
+    """
+    key = repr(
+        (
+            test["type"],
+            sorted(test["params"].items()),
+            sorted((os.path.basename(f.path), f.size, f.mtime) for f in files),
+        )
+    )
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+class JobTestCache(StateCache):
+    """
+    Cache of job test results, keyed by job id and test name, kept in the project's
+    state store.
+    """
+
+    NAME = "job_tests"
+
+    FIELDS = ("order_id", "test", "fingerprint", "result", "log", "seconds")
+
+    TABLES = {
+        "job_tests": "order_id INTEGER, test TEXT, fingerprint TEXT, result INTEGER, "
+        "log TEXT, seconds REAL, PRIMARY KEY (order_id, test)"
+    }
+
+    def load(self, test_names):
+        """
+        Retrieve cached results for a set of tests.
+        :param test_names: list of test names
+        :return: dict, mapping (order_id, test) to dicts with fingerprint, result,
+            log and seconds
+        """
+        fields = ", ".join(f"t.{field}" for field in self.FIELDS)
+        with self._transaction() as con:
+            rows = self._select(
+                con,
+                f"SELECT {fields} FROM job_tests t JOIN wanted w ON t.test = w.value",
+                test_names,
+            )
+            return {
+                (row[0], row[1]): dict(zip(self.FIELDS[2:], row[2:])) for row in rows
+            }
+
+    def store(self, results):
+        """
+        Add or update results.
+        :param results: list of dicts with the keys in FIELDS
+        :return:
+        """
+        with self._transaction() as con:
+            con.executemany(
+                "INSERT OR REPLACE INTO job_tests VALUES (?, ?, ?, ?, ?, ?)",
+                [tuple(r[field] for field in self.FIELDS) for r in results],
+            )
+
+    def discard(self, job_ids):
+        """
+        Forget results for a set of jobs, so their tests are run again.
+        :param job_ids: list of job ids
+        :return:
+        """
+        with self._transaction() as con:
+            con.executemany(
+                "DELETE FROM job_tests WHERE order_id = ?",
+                [(int(job),) for job in job_ids],
+            )
+
+
+def stat_output_files(paths):
+    """
+    Stat a job's output files.
+    :param paths: list of paths
+    :return: list of OutputFile tuples (files that vanished are left out)
+    """
+    files = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            continue
+        files.append(OutputFile(path, st.st_size, st.st_mtime))
+    return files
+
+
+def stat_job_outputs(output_files, n_workers=N_WORKERS):
+    """
+    Stat the output files of a set of jobs, in a thread pool.
+    :param output_files: dict, mapping job ids to lists of paths
+    :param n_workers: number of threads to use
+    :return: dict, mapping job ids to lists of OutputFile tuples
+    """
+    with ThreadPoolExecutor(max_workers=n_workers) as pool:
+        return dict(
+            zip(output_files, pool.map(stat_output_files, output_files.values()))
+        )
+
+
+def run_job_test(test, job, files):
+    """
+    Run a single test on a single job; errors raised by the test are reported as
+    failures.
+    :param test: dict, from parse_job_tests()
+    :param job: dict with the job's db columns, order_id and output_dir
+    :param files: list of OutputFile tuples
+    :return: dict with result (bool), logs (list of str) and seconds
+    """
+    start = time.perf_counter()
+    try:
+        result, logs = JOB_TESTS[test["type"]](job, files, **test["params"])
+    except Exception as err:
+        result, logs = False, [f"test raised {type(err).__name__}: {err}"]
+    return {
+        "result": bool(result),
+        "logs": list(logs),
+        "seconds": time.perf_counter() - start,
+    }
+
+
+def run_job_tests(jobs, output_files, tests, cache=None, n_workers=N_WORKERS):
+    """
+    Run tests on a set of jobs in a thread pool, skipping those whose cached result
+    is still valid (see fingerprint()).
+    :param jobs: pd.DataFrame indexed by order_id, with the db columns and output_dir
+    :param output_files: dict, mapping job ids to lists of their output files, as
+        OutputFile tuples, or as paths (which are then stat'ed)
+    :param tests: list of dicts, from parse_job_tests()
+    :param cache: JobTestCache object, or None
+    :param n_workers: number of threads to use
+    :return: tuple, (pd.DataFrame indexed by order_id with result_<test> and
+        log_<test> columns, pd.DataFrame with the number of jobs tested, of cached
+        results used, and time spent for each test)
+    """
+    cached = cache.load([t["name"] for t in tests]) if cache is not None else dict()
+    records = jobs.reset_index().to_dict(orient="records")
+
+    def work(job):
+        files = output_files.get(job["order_id"], [])
+        if not all(isinstance(f, OutputFile) for f in files):
+            files = stat_output_files(files)
+        rv = dict()
+        for test in tests:
+            key = (job["order_id"], test["name"])
+            fp = fingerprint(test, files)
+            if key in cached and cached[key]["fingerprint"] == fp:
+                rv[test["name"]] = dict(cached[key], fresh=False)
+            else:
+                res = run_job_test(test, job, files)
+                rv[test["name"]] = {
+                    "fingerprint": fp,
+                    "result": res["result"],
+                    "log": " ; ".join(res["logs"]),
+                    "seconds": res["seconds"],
+                    "fresh": True,
+                }
+        return rv
+
+    with ThreadPoolExecutor(max_workers=n_workers) as pool:
+        outcomes = dict(zip(jobs.index, pool.map(work, records)))
+
+    if cache is not None:
+        cache.store(
+            [
+                dict(res, order_id=int(job), test=name)
+                for (job, results) in outcomes.items()
+                for (name, res) in results.items()
+                if res["fresh"]
+            ]
+        )
+
+    df = pd.DataFrame(index=jobs.index)
+    timings = []
+    for test in tests:
+        res = [outcomes[job][test["name"]] for job in jobs.index]
+        df[f"result_{test['name']}"] = [bool(r["result"]) for r in res]
+        df[f"log_{test['name']}"] = [r["log"] for r in res]
+        fresh = [r for r in res if r["fresh"]]
+        timings.append(
+            {
+                "test": test["name"],
+                "n_run": len(fresh),
+                "n_cached": len(res) - len(fresh),
+                "seconds": sum(r["seconds"] for r in fresh),
+            }
+        )
+        logger.info(
+            f"Job test {test['name']}: ran on {len(fresh)} jobs in "
+            f"{timings[-1]['seconds']:.2f} seconds, {len(res) - len(fresh)} cached."
+        )
+
+    return df, pd.DataFrame(timings, columns=["test", "n_run", "n_cached", "seconds"])
@@ -0,0 +1,919 @@
+"""
+Local stand-in for Slurm, to run slurmhelper end to end (prep, submit, check) on a
+machine without a cluster, e.g. for testing and benchmarking. It provides sbatch,
+squeue and sacct commands backed by a small scheduler that runs submitted scripts
+as local processes, a bounded number at a time, honoring job arrays (and their %
+throttles), dependencies, time limits and output paths.
+
+To use it, write the commands to a directory, and put it first in your PATH::
+
+    python -m slurmhelper.utils.local_slurm install ~/local-slurm/bin
+    export PATH=~/local-slurm/bin:$PATH
+
+Jobs are kept in a SQLite file in $SLURMHELPER_LOCAL_SLURM_DIR (default:
+~/.slurmhelper/local_slurm); up to $SLURMHELPER_LOCAL_SLURM_WORKERS (default: the
+number of CPUs) array tasks run at once, each taking one slot regardless of the
+resources it requests. The scheduler is started by sbatch when needed, and exits
+once there is nothing left that it could run. Memory requests are recorded but not
+enforced.
+"""
+
+import argparse
+import datetime
+import fcntl
+import json
+import logging
+import os
+import re
+import shlex
+import signal
+import sqlite3
+import subprocess
+import sys
+import time
+from contextlib import closing
+
+logger = logging.getLogger("cli")
+
+STATE_DIR_ENV = "SLURMHELPER_LOCAL_SLURM_DIR"
+WORKERS_ENV = "SLURMHELPER_LOCAL_SLURM_WORKERS"
+DEFAULT_STATE_DIR = os.path.join("~", ".slurmhelper", "local_slurm")
+
+COMMANDS = ("sbatch", "squeue", "sacct")
+
+# as run by the commands written by install()
+MODULE = "slurmhelper.utils.local_slurm"
+
+# job ids handed out start here
+FIRST_JOB_ID = 1000
+
+# seconds between scheduler passes, and of inactivity before the scheduler exits
+POLL_SECONDS = 0.2
+IDLE_SECONDS = 5
+
+# seconds between SIGTERM and SIGKILL, when a task runs out of time
+KILL_GRACE_SECONDS = 5
+
+NODE_NAME = "localhost"
+
+# task states, as reported by squeue and sacct
+ACTIVE_STATES = ("PENDING", "RUNNING")
+
+_ARRAY_RANGE = re.compile(r"^(\d+)(?:-(\d+)(?::(\d+))?)?$")
+
+
+def state_dir():
+    return os.path.expanduser(os.environ.get(STATE_DIR_ENV, DEFAULT_STATE_DIR))
+
+
+def n_workers():
+    return int(os.environ.get(WORKERS_ENV, 0)) or os.cpu_count()
+
+
+def connect():
+    """
+    Open the emulator's job database, creating it if needed.
+    :return: sqlite3.Connection
+    """
+    os.makedirs(state_dir(), exist_ok=True)
+    con = sqlite3.connect(os.path.join(state_dir(), "jobs.sqlite"), timeout=30)
+    con.execute("PRAGMA journal_mode = WAL")
+    con.execute(
+        "CREATE TABLE IF NOT EXISTS jobs ("
+        "job_id INTEGER PRIMARY KEY, name TEXT, script TEXT, cwd TEXT, "
+        "output TEXT, error TEXT, is_array INTEGER, throttle INTEGER, "
+        "dependency TEXT, time_limit REAL, mem TEXT, cpus INTEGER, "
+        "partition TEXT, env TEXT, submit_time REAL)"
+    )
+    con.execute(
+        "CREATE TABLE IF NOT EXISTS tasks ("
+        "job_id INTEGER, task_id INTEGER, state TEXT, reason TEXT, pid INTEGER, "
+        "start_time REAL, end_time REAL, exit_code INTEGER, signal INTEGER, "
+        "total_cpu REAL, max_rss_kb INTEGER, PRIMARY KEY (job_id, task_id))"
+    )
+    con.execute("CREATE INDEX IF NOT EXISTS tasks_state ON tasks (state)")
+    return con
+
+
+# ~~~ parsing ~~~
+
+
+def parse_array(text):
+    """
+    Parse an sbatch --array specification.
+    :param text: str, e.g. '100-199', '1,3,5-7', '0-15:4' or '100-199%10'
+    :return: tuple, (sorted list of task ids, throttle or None)
+    """
+    spec, _, throttle = text.partition("%")
+    tasks = set()
+    for part in spec.split(","):
+        match = _ARRAY_RANGE.match(part.strip())
+        if match is None:
+            raise ValueError(f"Invalid job array specification: {text}")
+        start, end, step = match.groups()
+        end = start if end is None else end
+        tasks.update(range(int(start), int(end) + 1, int(step or 1)))
+    return sorted(tasks), int(throttle) if throttle else None
+
+
+def parse_time_limit(text):
+    """
+    Parse an sbatch --time limit (M, M:S, H:M:S, D-H, D-H:M or D-H:M:S).
+    :param text: str
+    :return: float, seconds (None if unlimited)
+    """
+    text = text.strip()
+    if text.upper() in {"", "UNLIMITED", "INFINITE", "-1"}:
+        return None
+    if "-" in text:
+        days, text = text.split("-", 1)
+        parts = [int(p) for p in text.split(":")] + [0] * 3
+        hours, minutes, seconds = parts[:3]
+        return ((int(days) * 24 + hours) * 60 + minutes) * 60 + seconds
+    parts = [int(p) for p in text.split(":")]
+    if len(parts) == 1:
+        return parts[0] * 60
+    if len(parts) == 2:
+        return parts[0] * 60 + parts[1]
+    return (parts[0] * 60 + parts[1]) * 60 + parts[2]
+
+
+def parse_dependency(text):
+    """
+    Parse an sbatch --dependency specification, e.g. 'afterany:123:124,afterok:125'.
+    Only after, afterany, afterok and afternotok are supported.
+    :param text: str
+    :return: list of (condition, job id) tuples
+    """
+    rv = []
+    for part in text.replace("?", ",").split(","):
+        if part == "":
+            continue
+        condition, *job_ids = part.split(":")
+        if condition not in {"after", "afterany", "afterok", "afternotok"}:
+            raise ValueError(f"Unsupported dependency type: {condition}")
+        rv += [(condition, int(job.split("+")[0])) for job in job_ids]
+    return rv
+
+
+def _sbatch_parser():
+    parser = argparse.ArgumentParser(prog="sbatch", add_help=False)
+    parser.add_argument("--job-name", "-J")
+    parser.add_argument("--output", "-o")
+    parser.add_argument("--error", "-e")
+    parser.add_argument("--array", "-a")
+    parser.add_argument("--dependency", "-d")
+    parser.add_argument("--time", "-t")
+    parser.add_argument("--mem")
+    parser.add_argument("--ntasks-per-node", type=int)
+    parser.add_argument("--ntasks", "-n", type=int)
+    parser.add_argument("--cpus-per-task", "-c", type=int)
+    parser.add_argument("--partition", "-p")
+    parser.add_argument("--chdir", "-D")
+    parser.add_argument("--parsable", action="store_true")
+    return parser
+
+
+def parse_sbatch_directives(script):
+    """
+    Read the #SBATCH lines at the top of a batch script (up to its first command).
+    :param script: str, contents of the script
+    :return: list of arguments
+    """
+    args = []
+    for line in script.splitlines()[1:]:
+        line = line.strip()
+        if line.startswith("#SBATCH"):
+            args += shlex.split(line[len("#SBATCH") :], comments=True)
+        elif line != "" and not line.startswith("#"):
+            break
+    return args
+
+
+def expand_filename_pattern(pattern, job_id, task_id, name):
+    """
+    Fill in an sbatch --output/--error pattern (%A, %a, %j, %x, %u and %%).
+    """
+    fields = {
+        "A": str(job_id),
+        "a": str(task_id) if task_id is not None else "4294967294",
+        "j": str(job_id),
+        "x": name,
+        "u": os.environ.get("USER", ""),
+        "%": "%",
+    }
+    return re.sub(r"%([Aajxu%])", lambda m: fields[m.group(1)], pattern)
+
+
+def format_duration(seconds):
+    """
+    Format a duration like Slurm does ([D-]HH:MM:SS).
+    """
+    if seconds is None:
+        return "UNLIMITED"
+    seconds = int(seconds)
+    days, seconds = divmod(seconds, 86400)
+    text = "{:02d}:{:02d}:{:02d}".format(
+        seconds // 3600, seconds % 3600 // 60, seconds % 60
+    )
+    return f"{days}-{text}" if days > 0 else text
+
+
+def _format_timestamp(t):
+    if t is None:
+        return "Unknown"
+    return datetime.datetime.fromtimestamp(t).strftime("%Y-%m-%dT%H:%M:%S")
+
+
+# ~~~ sbatch ~~~
+
+
+def sbatch(argv):
+    """
+    Submit a batch script: record its job (and array tasks), and make sure the
+    scheduler is running.
+    :param argv: command-line arguments, as for sbatch
+    :return: exit code
+    """
+    parser = _sbatch_parser()
+    cli_args, rest = parser.parse_known_args(argv)
+    script_args = [a for a in rest if not a.startswith("-")]
+    if len(script_args) == 0:
+        print("sbatch: error: no batch script given", file=sys.stderr)
+        return 1
+    script_path = script_args[0]
+    try:
+        with open(script_path, "r") as f:
+            script = f.read()
+    except OSError as err:
+        print(
+            f"sbatch: error: Unable to open file {script_path}: {err}",
+            file=sys.stderr,
+        )
+        return 1
+    if not script.startswith("#!"):
+        print(
+            "sbatch: error: This does not look like a batch script.  The first line "
+            'must start with #! followed by the path to an interpreter.',
+            file=sys.stderr,
+        )
+        return 1
+
+    # command-line options take precedence over #SBATCH directives
+    opts, _ = parser.parse_known_args(parse_sbatch_directives(script))
+    for key, value in vars(cli_args).items():
+        if value is not None and value is not False:
+            setattr(opts, key, value)
+
+    try:
+        tasks, throttle = (
+            parse_array(opts.array) if opts.array else ([None], None)
+        )
+        dependency = parse_dependency(opts.dependency) if opts.dependency else []
+        time_limit = parse_time_limit(opts.time) if opts.time else None
+    except ValueError as err:
+        print(f"sbatch: error: {err}", file=sys.stderr)
+        return 1
+
+    cwd = os.path.abspath(opts.chdir or os.getcwd())
+    name = opts.job_name or os.path.basename(script_path)
+    default_output = "slurm-%A_%a.out" if opts.array else "slurm-%j.out"
+    cpus = (opts.ntasks_per_node or opts.ntasks or 1) * (opts.cpus_per_task or 1)
+
+    with closing(connect()) as con, con:
+        con.execute("BEGIN IMMEDIATE")
+        known = {
+            row[0]
+            for row in con.execute(
+                f"SELECT job_id FROM jobs WHERE job_id IN "
+                f"({','.join('?' * len(dependency))})",
+                [job for (_, job) in dependency],
+            )
+        }
+        if len(known) < len({job for (_, job) in dependency}):
+            print(
+                "sbatch: error: Batch job submission failed: Job dependency problem",
+                file=sys.stderr,
+            )
+            return 1
+        job_id = con.execute(
+            "SELECT COALESCE(MAX(job_id) + 1, ?) FROM jobs", (FIRST_JOB_ID,)
+        ).fetchone()[0]
+        con.execute(
+            "INSERT INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                job_id,
+                name,
+                script,
+                cwd,
+                opts.output or default_output,
+                opts.error,
+                int(opts.array is not None),
+                throttle,
+                opts.dependency,
+                time_limit,
+                opts.mem,
+                cpus,
+                opts.partition or "local",
+                json.dumps(dict(os.environ)),
+                time.time(),
+            ),
+        )
+        con.executemany(
+            "INSERT INTO tasks (job_id, task_id, state, reason) VALUES (?, ?, ?, ?)",
+            [
+                (job_id, task, "PENDING", "Dependency" if dependency else "None")
+                for task in tasks
+            ],
+        )
+
+    ensure_scheduler()
+    if opts.parsable:
+        print(job_id)
+    else:
+        print(f"Submitted batch job {job_id}")
+    return 0
+
+
+# ~~~ scheduler ~~~
+
+
+def _lock_path():
+    return os.path.join(state_dir(), "scheduler.lock")
+
+
+def ensure_scheduler():
+    """
+    Start the scheduler in the background, unless it is running already.
+    """
+    os.makedirs(state_dir(), exist_ok=True)
+    with open(_lock_path(), "a") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return  # held by a running scheduler
+        fcntl.flock(lock, fcntl.LOCK_UN)
+    with open(os.path.join(state_dir(), "scheduler.log"), "a") as log:
+        subprocess.Popen(
+            [sys.executable, "-m", MODULE, "scheduler"],
+            stdin=subprocess.DEVNULL,
+            stdout=log,
+            stderr=subprocess.STDOUT,
+            start_new_session=True,
+        )
+
+
+def _dependency_status(con, dependency):
+    """
+    :return: 'ok' if a job's dependencies are satisfied, 'wait' if they may still be,
+        'never' if they cannot be anymore
+    """
+    status = "ok"
+    for condition, job in parse_dependency(dependency or ""):
+        states = [
+            row[0]
+            for row in con.execute("SELECT state FROM tasks WHERE job_id = ?", (job,))
+        ]
+        if condition == "after":
+            if "PENDING" in states:
+                status = "wait"
+        elif any(s in ACTIVE_STATES for s in states):
+            status = "wait"
+        elif condition == "afterok" and any(s != "COMPLETED" for s in states):
+            return "never"
+        elif condition == "afternotok" and all(s == "COMPLETED" for s in states):
+            return "never"
+    return status
+
+
+class _RunningTask:
+    def __init__(self, job, task_id):
+        self.job_id = job["job_id"]
+        self.task_id = task_id
+        self.time_limit = job["time_limit"]
+        self.start = time.time()
+        self.timed_out = False
+        self.killed_at = None
+
+        script_dir = os.path.join(state_dir(), "scripts")
+        os.makedirs(script_dir, exist_ok=True)
+        script = os.path.join(script_dir, f"{self.job_id}.sh")
+        if not os.path.exists(script):
+            with open(script, "w") as f:
+                f.write(job["script"])
+            os.chmod(script, 0o755)
+
+        env = json.loads(job["env"])
+        env.update(
+            {
+                "SLURM_JOB_ID": str(self.job_id),
+                "SLURM_JOBID": str(self.job_id),
+                "SLURM_JOB_NAME": job["name"],
+                "SLURM_SUBMIT_DIR": job["cwd"],
+                "SLURM_CPUS_ON_NODE": str(job["cpus"]),
+                "SLURM_JOB_NODELIST": NODE_NAME,
+                "SLURMD_NODENAME": NODE_NAME,
+            }
+        )
+        if task_id is not None:
+            env.update(
+                {
+                    "SLURM_ARRAY_JOB_ID": str(self.job_id),
+                    "SLURM_ARRAY_TASK_ID": str(task_id),
+                }
+            )
+        if self.time_limit is not None:
+            env["SLURM_JOB_END_TIME"] = str(int(self.start + self.time_limit))
+
+        def open_log(pattern):
+            path = os.path.join(
+                job["cwd"],
+                expand_filename_pattern(pattern, self.job_id, task_id, job["name"]),
+            )
+            try:
+                return open(path, "w")
+            except OSError:
+                # as Slurm, run the job anyway
+                return open(os.devnull, "w")
+
+        out = open_log(job["output"])
+        err = open_log(job["error"]) if job["error"] else subprocess.STDOUT
+        try:
+            self.proc = subprocess.Popen(
+                [script],
+                cwd=job["cwd"],
+                env=env,
+                stdin=subprocess.DEVNULL,
+                stdout=out,
+                stderr=err,
+                start_new_session=True,
+            )
+        except OSError as error:
+            # e.g., a bad #! line or a missing working directory; as slurmstepd,
+            # leave the error in the job's log
+            out.write(f"slurmstepd: error: execve(): {job['name']}: {error}\n")
+            raise
+        finally:
+            out.close()
+            if err is not subprocess.STDOUT:
+                err.close()
+
+    def poll(self):
+        """
+        :return: None if still running, else (exit status, rusage)
+        """
+        now = time.time()
+        if self.time_limit is not None and now - self.start > self.time_limit:
+            if self.killed_at is None:
+                self.timed_out = True
+                self.killed_at = now
+                self._signal(signal.SIGTERM)
+            elif now - self.killed_at > KILL_GRACE_SECONDS:
+                self._signal(signal.SIGKILL)
+        pid, status, rusage = os.wait4(self.proc.pid, os.WNOHANG)
+        if pid == 0:
+            return None
+        self.proc.returncode = status
+        return status, rusage
+
+    def _signal(self, sig):
+        try:
+            os.killpg(self.proc.pid, sig)
+        except ProcessLookupError:
+            pass
+
+
+def _finish(con, task, status, rusage):
+    code = os.waitstatus_to_exitcode(status)
+    if task.timed_out:
+        state = "TIMEOUT"
+    elif code == 0:
+        state = "COMPLETED"
+    elif code < 0:
+        state = "CANCELLED" if -code in {signal.SIGTERM, signal.SIGKILL} else "FAILED"
+    else:
+        state = "FAILED"
+    con.execute(
+        "UPDATE tasks SET state = ?, reason = 'None', end_time = ?, exit_code = ?, "
+        "signal = ?, total_cpu = ?, max_rss_kb = ? WHERE job_id = ? AND task_id IS ?",
+        (
+            state,
+            time.time(),
+            max(code, 0),
+            max(-code, 0),
+            rusage.ru_utime + rusage.ru_stime,
+            rusage.ru_maxrss,
+            task.job_id,
+            task.task_id,
+        ),
+    )
+
+
+def _launch_failed(con, job_id, task_id):
+    now = time.time()
+    con.execute(
+        "UPDATE tasks SET state = 'FAILED', reason = 'launch failed', "
+        "start_time = ?, end_time = ?, exit_code = 1, signal = 0, total_cpu = 0, "
+        "max_rss_kb = 0 WHERE job_id = ? AND task_id IS ?",
+        (now, now, job_id, task_id),
+    )
+
+
+def _set_reason(con, job_id, reason):
+    con.execute(
+        "UPDATE tasks SET reason = ? WHERE job_id = ? AND state = 'PENDING' "
+        "AND reason != ?",
+        (reason, job_id, reason),
+    )
+
+
+def _schedule(con, running, slots):
+    """
+    Start the pending tasks that can run, in submission order.
+    :return: number of tasks started
+    """
+    con.row_factory = sqlite3.Row
+    jobs = {
+        row["job_id"]: row
+        for row in con.execute(
+            "SELECT * FROM jobs WHERE job_id IN "
+            "(SELECT job_id FROM tasks WHERE state = 'PENDING')"
+        )
+    }
+    con.row_factory = None
+
+    started = 0
+    per_job = dict()
+    for task in running:
+        per_job[task.job_id] = per_job.get(task.job_id, 0) + 1
+
+    for job_id in sorted(jobs):
+        job = jobs[job_id]
+        deps = _dependency_status(con, job["dependency"])
+        if deps != "ok":
+            _set_reason(
+                con,
+                job_id,
+                "DependencyNeverSatisfied" if deps == "never" else "Dependency",
+            )
+            continue
+        n_free = slots - len(running)
+        if job["throttle"]:
+            n_free = min(n_free, job["throttle"] - per_job.get(job_id, 0))
+        to_start = [
+            row[0]
+            for row in con.execute(
+                "SELECT task_id FROM tasks WHERE job_id = ? AND state = 'PENDING' "
+                "ORDER BY task_id LIMIT ?",
+                (job_id, max(n_free, 0)),
+            )
+        ]
+        for task_id in to_start:
+            try:
+                task = _RunningTask(job, task_id)
+            except OSError as err:
+                logger.warning(f"Could not launch job {job_id}, task {task_id}: {err}")
+                _launch_failed(con, job_id, task_id)
+                continue
+            running.append(task)
+            per_job[job_id] = per_job.get(job_id, 0) + 1
+            started += 1
+            con.execute(
+                "UPDATE tasks SET state = 'RUNNING', reason = ?, pid = ?, "
+                "start_time = ? WHERE job_id = ? AND task_id IS ?",
+                (NODE_NAME, task.proc.pid, task.start, job_id, task_id),
+            )
+        if len(running) >= slots:
+            _set_reason(con, job_id, "Resources")
+        else:
+            _set_reason(con, job_id, "JobArrayTaskLimit")
+    return started
+
+
+def run_scheduler():
+    """
+    Run tasks as they become eligible, until none is running and none can start.
+    Only one scheduler runs at a time (see ensure_scheduler()).
+    """
+    os.makedirs(state_dir(), exist_ok=True)
+    with open(_lock_path(), "a") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return
+        slots = n_workers()
+        running = []
+        idle_since = time.time()
+
+        with closing(connect()) as con:
+            # tasks left running by a scheduler that died are lost
+            with con:
+                con.execute(
+                    "UPDATE tasks SET state = 'NODE_FAIL', end_time = ? "
+                    "WHERE state = 'RUNNING'",
+                    (time.time(),),
+                )
+            while True:
+                with con:
+                    last_job = con.execute("SELECT MAX(job_id) FROM jobs").fetchone()
+                    for task in list(running):
+                        outcome = task.poll()
+                        if outcome is not None:
+                            _finish(con, task, *outcome)
+                            running.remove(task)
+                    started = _schedule(con, running, slots)
+                if started > 0 or len(running) > 0:
+                    idle_since = time.time()
+                elif time.time() - idle_since > IDLE_SECONDS:
+                    # jobs submitted from now on start a new scheduler; make sure
+                    # none was submitted since the last pass
+                    con.execute("BEGIN IMMEDIATE")
+                    latest = con.execute("SELECT MAX(job_id) FROM jobs").fetchone()
+                    if latest == last_job:
+                        fcntl.flock(lock, fcntl.LOCK_UN)
+                        con.commit()
+                        return
+                    con.commit()
+                time.sleep(POLL_SECONDS)
+
+
+# ~~~ squeue and sacct ~~~
+
+
+def _select_tasks(con, job_ids=None, names=None, states=None, since=None):
+    query = (
+        "SELECT t.job_id, t.task_id, t.state, t.reason, t.start_time, t.end_time, "
+        "t.exit_code, t.signal, t.total_cpu, t.max_rss_kb, j.name, j.is_array, "
+        "j.time_limit, j.mem, j.cpus, j.partition, j.submit_time "
+        "FROM tasks t JOIN jobs j ON t.job_id = j.job_id WHERE 1 = 1"
+    )
+    args = []
+    if job_ids is not None:
+        query += f" AND t.job_id IN ({','.join('?' * len(job_ids))})"
+        args += list(job_ids)
+    if names is not None:
+        query += f" AND j.name IN ({','.join('?' * len(names))})"
+        args += list(names)
+    if states is not None:
+        query += f" AND t.state IN ({','.join('?' * len(states))})"
+        args += list(states)
+    if since is not None:
+        query += " AND j.submit_time >= ?"
+        args.append(since)
+    query += " ORDER BY t.job_id, t.task_id"
+    fields = (
+        "job_id",
+        "task_id",
+        "state",
+        "reason",
+        "start_time",
+        "end_time",
+        "exit_code",
+        "signal",
+        "total_cpu",
+        "max_rss_kb",
+        "name",
+        "is_array",
+        "time_limit",
+        "mem",
+        "cpus",
+        "partition",
+        "submit_time",
+    )
+    return [dict(zip(fields, row)) for row in con.execute(query, args)]
+
+
+def _slurm_id(task):
+    if task["is_array"]:
+        return f"{task['job_id']}_{task['task_id']}"
+    return str(task["job_id"])
+
+
+def _elapsed(task):
+    if task["start_time"] is None:
+        return 0
+    return (task["end_time"] or time.time()) - task["start_time"]
+
+
+def _job_id_filter(text):
+    # e.g., 123,124_101 -> job ids 123 and 124 (tasks are not filtered on)
+    return [int(j.split("_")[0]) for j in text.split(",") if j != ""]
+
+
+SQUEUE_CODES = {
+    "i": _slurm_id,
+    "A": lambda t: str(t["job_id"]),
+    "F": lambda t: str(t["job_id"]),
+    "K": lambda t: str(t["task_id"]) if t["is_array"] else "N/A",
+    "j": lambda t: t["name"],
+    "T": lambda t: t["state"],
+    "t": lambda t: {"PENDING": "PD", "RUNNING": "R"}.get(t["state"], t["state"]),
+    "M": lambda t: format_duration(_elapsed(t)),
+    "l": lambda t: format_duration(t["time_limit"]),
+    "D": lambda t: "1",
+    "C": lambda t: str(t["cpus"]),
+    "P": lambda t: t["partition"],
+    "u": lambda t: os.environ.get("USER", ""),
+    "R": lambda t: NODE_NAME if t["state"] == "RUNNING" else f"({t['reason']})",
+    "N": lambda t: NODE_NAME if t["state"] == "RUNNING" else "",
+}
+
+SQUEUE_HEADERS = {
+    "i": "JOBID",
+    "A": "JOBID",
+    "F": "ARRAY_JOB_ID",
+    "K": "ARRAY_TASK_ID",
+    "j": "NAME",
+    "T": "STATE",
+    "t": "ST",
+    "M": "TIME",
+    "l": "TIME_LIMIT",
+    "D": "NODES",
+    "C": "CPUS",
+    "P": "PARTITION",
+    "u": "USER",
+    "R": "NODELIST(REASON)",
+    "N": "NODELIST",
+}
+
+SQUEUE_DEFAULT_FORMAT = "%.18i %.9P %.8j %.8u %.2t %.10M %.6D %R"
+
+
+def format_squeue_line(fmt, task=None):
+    """
+    Fill in an squeue --format string for a task, or its header if task is None
+    (field widths are honored; unknown codes are left empty).
+    """
+
+    def field(match):
+        align, width, code = match.groups()
+        if task is None:
+            value = SQUEUE_HEADERS.get(code, "")
+        else:
+            value = SQUEUE_CODES.get(code, lambda t: "")(task)
+        if width:
+            value = value[: int(width)]
+            value = value.ljust(int(width)) if align == "-" else value.rjust(int(width))
+        return value
+
+    return re.sub(r"%(-|\.)?(\d+)?([A-Za-z])", field, fmt)
+
+
+def squeue(argv):
+    """
+    List pending and running jobs (array tasks one per line).
+    :param argv: command-line arguments, as for squeue (--format, --noheader,
+        --jobs and --name are supported; --user and --array are accepted)
+    :return: exit code
+    """
+    parser = argparse.ArgumentParser(prog="squeue", add_help=False)
+    parser.add_argument("--format", "-o", default=SQUEUE_DEFAULT_FORMAT)
+    parser.add_argument("--noheader", "-h", action="store_true")
+    parser.add_argument("--jobs", "-j")
+    parser.add_argument("--name", "-n")
+    parser.add_argument("--user", "-u")
+    parser.add_argument("--array", "-r", action="store_true")
+    args, _ = parser.parse_known_args(argv)
+
+    with closing(connect()) as con:
+        tasks = _select_tasks(
+            con,
+            job_ids=_job_id_filter(args.jobs) if args.jobs else None,
+            names=args.name.split(",") if args.name else None,
+            states=ACTIVE_STATES,
+        )
+    if not args.noheader:
+        print(format_squeue_line(args.format))
+    for task in tasks:
+        print(format_squeue_line(args.format, task))
+    return 0
+
+
+SACCT_CODES = {
+    "JobID": _slurm_id,
+    "JobIDRaw": lambda t: str(t["job_id"]),
+    "JobName": lambda t: t["name"],
+    "State": lambda t: t["state"],
+    "ExitCode": lambda t: f"{t['exit_code'] or 0}:{t['signal'] or 0}",
+    "Elapsed": lambda t: format_duration(_elapsed(t)),
+    "TotalCPU": lambda t: format_duration(t["total_cpu"] or 0),
+    "MaxRSS": lambda t: "",
+    "ReqMem": lambda t: (
+        f"{t['mem']}M" if (t["mem"] or "").isdigit() else t["mem"] or ""
+    ),
+    "AllocCPUS": lambda t: str(t["cpus"]) if t["start_time"] is not None else "0",
+    "NodeList": lambda t: NODE_NAME if t["start_time"] is not None else "None assigned",
+    "Partition": lambda t: t["partition"],
+    "Timelimit": lambda t: format_duration(t["time_limit"]),
+    "Submit": lambda t: _format_timestamp(t["submit_time"]),
+    "Start": lambda t: _format_timestamp(t["start_time"]),
+    "End": lambda t: _format_timestamp(t["end_time"]),
+}
+
+SACCT_DEFAULT_FORMAT = "JobID,JobName,Partition,AllocCPUS,State,ExitCode"
+
+
+def sacct(argv):
+    """
+    Report accounting data for jobs, in sacct's parsable format: one line for each
+    job (or array task), followed by one for its batch step (which carries MaxRSS).
+    :param argv: command-line arguments, as for sacct (--format, --jobs, --name,
+        --starttime, --noheader and --parsable/--parsable2 are supported)
+    :return: exit code
+    """
+    parser = argparse.ArgumentParser(prog="sacct", add_help=False)
+    parser.add_argument("--format", "-o", default=SACCT_DEFAULT_FORMAT)
+    parser.add_argument("--jobs", "-j")
+    parser.add_argument("--name")
+    parser.add_argument("--starttime", "-S")
+    parser.add_argument("--noheader", "-n", action="store_true")
+    parser.add_argument("--parsable", "-p", action="store_true")
+    parser.add_argument("--parsable2", "-P", action="store_true")
+    args, _ = parser.parse_known_args(argv)
+
+    fields = [f.split("%")[0] for f in args.format.split(",")]
+    if args.starttime is not None:
+        since = datetime.datetime.fromisoformat(args.starttime).timestamp()
+    elif args.jobs is None:
+        # as sacct, default to jobs since midnight
+        since = datetime.datetime.combine(
+            datetime.date.today(), datetime.time()
+        ).timestamp()
+    else:
+        since = None
+
+    with closing(connect()) as con:
+        tasks = _select_tasks(
+            con,
+            job_ids=_job_id_filter(args.jobs) if args.jobs else None,
+            names=args.name.split(",") if args.name else None,
+            since=since,
+        )
+
+    end = "|" if args.parsable else ""
+    if not args.noheader:
+        print("|".join(fields) + end)
+    for task in tasks:
+        print("|".join(SACCT_CODES.get(f, lambda t: "")(task) for f in fields) + end)
+        if task["start_time"] is not None:
+            step = dict(task, name="batch")
+            values = [SACCT_CODES.get(f, lambda t: "")(step) for f in fields]
+            for i, f in enumerate(fields):
+                if f == "JobID":
+                    values[i] += ".batch"
+                elif f == "MaxRSS":
+                    values[i] = f"{task['max_rss_kb'] or 0}K"
+                elif f == "ReqMem":
+                    values[i] = ""
+            print("|".join(values) + end)
+    return 0
+
+
+# ~~~ entry point ~~~
+
+
+def install(bin_dir):
+    """
+    Write sbatch, squeue and sacct commands to a directory, running this module with
+    the current Python interpreter.
+    :param bin_dir: directory to write to
+    :return: list of paths written
+    """
+    bin_dir = os.path.expanduser(bin_dir)
+    os.makedirs(bin_dir, exist_ok=True)
+    written = []
+    for command in COMMANDS:
+        path = os.path.join(bin_dir, command)
+        with open(path, "w") as f:
+            f.write(
+                "#!/bin/sh\n"
+                f'exec {shlex.quote(sys.executable)} -m {MODULE} {command} "$@"\n'
+            )
+        os.chmod(path, 0o755)
+        written.append(path)
+    return written
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) == 0 or argv[0] not in COMMANDS + ("scheduler", "install"):
+        print(
+            f"usage: python -m {MODULE} "
+            f"{{{','.join(COMMANDS + ('scheduler', 'install'))}}} ...",
+            file=sys.stderr,
+        )
+        return 2
+    command, argv = argv[0], argv[1:]
+    if command == "install":
+        for path in install(argv[0] if argv else "."):
+            print(f"wrote {path}")
+        print("put this directory first in your PATH to use these commands.")
+        return 0
+    if command == "scheduler":
+        run_scheduler()
+        return 0
+    return {"sbatch": sbatch, "squeue": squeue, "sacct": sacct}[command](argv)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
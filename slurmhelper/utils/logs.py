@@ -0,0 +1,636 @@
+"""
+Routines for reading and parsing job log files quickly, without loading whole logs,
+and the result records written next to them by the sbatch wrappers.
+"""
+
+import logging
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from ..db import StateCache
+
+logger = logging.getLogger("cli")
+
+# noise printed by some programs (e.g., MATLAB) when not run from a terminal
+STTY_NOISE = "stty: standard input: Inappropriate ioctl for device"
+
+# assumptions about how run scripts end their logs (see the built-in specs):
+#   ...
+#   runtime: <seconds>   (optional)
+#   SUCCESS              (or FAILURE)
+#   <exit status>
+SUCCESS_MARKER = "SUCCESS"
+RUNTIME_PREFIX = "runtime: "
+
+TAIL_BYTES = 4096
+
+# sbatch wrappers write a result record (<job_id>.tsv) for each job they run: a
+# header line with these fields, and a line of values (see
+# ..jobs.cli_helpers:build_job_runner()); records written before signal and cause
+# were added have only the first six fields
+RECORD_FIELDS = (
+    "order_id",
+    "start",
+    "end",
+    "exit_code",
+    "host",
+    "max_rss_kb",
+    "signal",
+    "cause",
+)
+
+# likely causes of a job ending on a signal, as recorded by the sbatch wrappers
+RECORD_CAUSES = {
+    "TIMEOUT": "wrapper got SIGTERM at its time limit",
+    "CANCELLED": "wrapper got SIGTERM (or SIGINT) before its time limit, e.g. from "
+    "scancel or preemption, or its time limit is unknown",
+    "KILLED": "job killed by SIGKILL, e.g. by the out-of-memory killer",
+    "SIGNALED": "job killed by another signal",
+    "WRAPPER_EXIT": "wrapper exited while the job was running",
+}
+
+# threads used to read logs in parallel
+N_WORKERS = 16
+
+
+def read_log_tail_lines(path_to_file, n_lines=3, n_bytes=TAIL_BYTES):
+    """
+    Read the last lines of a log file, by seeking from the end of the file rather than
+    reading it all. Lines are stripped and stty noise is filtered out, as in
+    ..utils.reporting:read_log_file_lines().
+    :param path_to_file: path to log file
+    :param n_lines: minimum number of (filtered) lines wanted; the window read is
+        doubled until it has this many, or the whole file was read
+    :param n_bytes: size of the initial window to read from the end of the file
+    :return: list of lines (possibly more than n_lines)
+    """
+    with open(path_to_file, "rb") as log:
+        size = log.seek(0, os.SEEK_END)
+        while True:
+            start = max(0, size - n_bytes)
+            log.seek(start)
+            lines = log.read().decode("utf-8", errors="replace").splitlines()
+            if start > 0:
+                lines = lines[1:]  # first line is probably cut short
+            lines = [s.strip() for s in lines if STTY_NOISE not in s]
+            if len(lines) >= n_lines or start == 0:
+                return lines
+            n_bytes *= 2
+
+
+def parse_log_tail(lines):
+    """
+    Extract the outcome of a job from the last lines of its log.
+    :param lines: last few lines of the log (see read_log_tail_lines())
+    :return: dict with keys:
+        - exit_code: int, exit status printed on the last line (None if not found)
+        - success_marker: bool, whether the second to last line reads SUCCESS
+        - runtime: int, runtime in seconds printed before that (None if not found)
+    """
+    rv = {"exit_code": None, "success_marker": False, "runtime": None}
+
+    if len(lines) >= 1 and lines[-1].lstrip("-").isdigit():
+        rv["exit_code"] = int(lines[-1])
+    if len(lines) >= 2:
+        rv["success_marker"] = lines[-2] == SUCCESS_MARKER
+    if len(lines) >= 3 and lines[-3].startswith(RUNTIME_PREFIX):
+        runtime = lines[-3][len(RUNTIME_PREFIX) :].strip()
+        if runtime.isdigit():
+            rv["runtime"] = int(runtime)
+
+    return rv
+
+
+def read_log_outcome(path_to_file):
+    """
+    Read the outcome of a job from its log file (see parse_log_tail()).
+    :param path_to_file: path to log file
+    :return: dict, output of parse_log_tail()
+    """
+    return parse_log_tail(read_log_tail_lines(path_to_file))
+
+
+def read_result_record(path_to_file):
+    """
+    Read the result record written for a job by its sbatch wrapper.
+    :param path_to_file: path to record file (<job_id>.tsv)
+    :return: dict with keys exit_code, runtime (seconds), host, max_rss_kb (None
+        if /usr/bin/time was not available), signal and cause (see RECORD_CAUSES;
+        None if the job exited normally), and success_marker (True if the exit code
+        is 0, for compatibility with parse_log_tail()); None if the record is
+        malformed
+    """
+    with open(path_to_file, "r") as f:
+        lines = f.read().splitlines()
+    if len(lines) != 2:
+        return None
+    fields = tuple(lines[0].split("\t"))
+    if fields not in (RECORD_FIELDS, RECORD_FIELDS[:6]):
+        return None
+    record = dict(zip(fields, lines[1].split("\t")))
+    try:
+        exit_code = int(record["exit_code"])
+        runtime = int(record["end"]) - int(record["start"])
+    except (KeyError, ValueError):
+        return None
+    max_rss = record.get("max_rss_kb", "")
+    return {
+        "exit_code": exit_code,
+        "success_marker": exit_code == 0,
+        "runtime": runtime,
+        "host": record.get("host") or None,
+        "max_rss_kb": int(max_rss) if max_rss.isdigit() else None,
+        "signal": record.get("signal") or None,
+        "cause": record.get("cause") or None,
+    }
+
+
+def read_job_outcome(log_path, record_path=None):
+    """
+    Read the outcome of a job, from its result record if there is a valid one, or
+    else from the ending of its log.
+    :param log_path: path to log file
+    :param record_path: path to record file, or None
+    :return: dict with the keys from read_result_record()
+    """
+    if record_path is not None and os.path.isfile(record_path):
+        record = read_result_record(record_path)
+        if record is not None:
+            return record
+        logger.warning(f"Ignoring malformed result record: {record_path}")
+    return {
+        **read_log_outcome(log_path),
+        "host": None,
+        "max_rss_kb": None,
+        "signal": None,
+        "cause": None,
+    }
+
+
+def list_job_logs(log_dir, ext=".txt"):
+    """
+    List the job logs present in a directory (e.g., logs/jobs), with a single scandir.
+    :param log_dir: path to directory with job logs (<job_id>.txt)
+    :param ext: extension of the files to list (e.g., .tsv for result records)
+    :return: dict, mapping job ids (int) to log file paths
+    """
+    rv = dict()
+    if not os.path.isdir(log_dir):
+        return rv
+    with os.scandir(log_dir) as entries:
+        for entry in entries:
+            stem, entry_ext = os.path.splitext(entry.name)
+            if entry_ext == ext and stem.isdigit() and entry.is_file():
+                rv[int(stem)] = entry.path
+    return rv
+
+
+def read_log_status(path_to_file, st=None, record_path=None, record_st=None):
+    """
+    Stat a log file and read the outcome of its job (see read_job_outcome()).
+    :param path_to_file: path to log file
+    :param st: os.stat_result for the file, if already available
+    :param record_path: path to the job's result record, or None
+    :param record_st: os.stat_result for the record, or None if there is no record
+    :return: dict with log_size, log_mtime, record_mtime and the keys from
+        read_job_outcome(); None if the log vanished in the meantime
+    """
+    if record_st is None:
+        record_path = None
+    try:
+        if st is None:
+            st = os.stat(path_to_file)
+        outcome = read_job_outcome(path_to_file, record_path)
+    except FileNotFoundError:
+        return None
+    return {
+        "log_size": st.st_size,
+        "log_mtime": st.st_mtime,
+        "record_mtime": None if record_st is None else record_st.st_mtime,
+        **outcome,
+    }
+
+
+def _stat_or_none(path_to_file):
+    if path_to_file is None:
+        return None
+    try:
+        return os.stat(path_to_file)
+    except FileNotFoundError:
+        return None
+
+
+def _has_changed(known, st, record_st):
+    """
+    Whether a log (or its result record) changed since its status was read.
+    :param known: dict (or pd.Series) with log_size, log_mtime and record_mtime
+    :param st: os.stat_result for the log
+    :param record_st: os.stat_result for the record, or None
+    """
+    known_record = known["record_mtime"]
+    if pd.isna(known_record):
+        known_record = None
+    return (
+        known["log_size"] != st.st_size
+        or known["log_mtime"] != st.st_mtime
+        or known_record != (None if record_st is None else record_st.st_mtime)
+    )
+
+
+def scan_job_logs(log_dir, job_ids, n_workers=N_WORKERS, cache=None, results_dir=None):
+    """
+    Build a status table for a set of jobs from their logs. The log directory is
+    listed only once, and logs are then stat'ed and parsed in a thread pool, since
+    on network filesystems most of the time is spent waiting on I/O.
+
+    If a results directory is provided, jobs' outcomes are read from the result
+    records found there (see read_result_record()) rather than their logs.
+
+    If a cache is provided, only logs whose size or mtime (or whose record) changed
+    since they were last read are read again, and the cache is updated.
+
+    :param log_dir: path to directory with job logs (<job_id>.txt)
+    :param job_ids: list of job ids to report on
+    :param n_workers: number of threads to use
+    :param cache: LogStatusCache object, or None
+    :param results_dir: path to directory with result records (<job_id>.tsv), or None
+    :return: pd.DataFrame indexed by order_id (see status_table())
+    """
+    present = list_job_logs(log_dir)
+    records = list_job_logs(results_dir, ext=".tsv") if results_dir else dict()
+    with_logs = [job for job in job_ids if job in present]
+
+    with ThreadPoolExecutor(max_workers=n_workers) as pool:
+        stats = _stat_jobs(pool, with_logs, present, records)
+        cached = cache.load(stats.keys()) if cache is not None else dict()
+        stale = [
+            job
+            for (job, (st, record_st)) in stats.items()
+            if job not in cached or _has_changed(cached[job], st, record_st)
+        ]
+        logger.info(
+            f"{len(stats)} job logs found; {len(stats) - len(stale)} unchanged "
+            f"since last read, {len(stale)} to (re)read."
+        )
+        fresh = _read_jobs(pool, stale, stats, present, records)
+
+    if cache is not None:
+        cache.store(fresh)
+        cache.discard([job for job in job_ids if job not in stats])
+
+    found = [
+        (job, fresh[job] if job in fresh else cached[job])
+        for job in job_ids
+        if job in fresh or (job in cached and job in stats)
+    ]
+    return status_table(job_ids, found)
+
+
+def _stat_jobs(pool, job_ids, present, records):
+    """
+    Stat the logs (and result records, if any) of the given jobs.
+    :return: dict, mapping job ids to (log stat, record stat or None); jobs whose
+        log vanished are left out
+    """
+    log_stats = pool.map(_stat_or_none, [present[j] for j in job_ids])
+    record_stats = pool.map(_stat_or_none, [records.get(j) for j in job_ids])
+    return {
+        job: (st, record_st)
+        for (job, st, record_st) in zip(job_ids, log_stats, record_stats)
+        if st is not None
+    }
+
+
+def _read_jobs(pool, job_ids, stats, present, records):
+    """
+    Read the status of the given jobs (see read_log_status()).
+    :return: dict, mapping job ids to statuses; jobs whose log vanished are left out
+    """
+    results = pool.map(
+        read_log_status,
+        [present[j] for j in job_ids],
+        [stats[j][0] for j in job_ids],
+        [records.get(j) for j in job_ids],
+        [stats[j][1] for j in job_ids],
+    )
+    return {job: res for (job, res) in zip(job_ids, results) if res is not None}
+
+
+def status_table(job_ids, found):
+    """
+    Assemble a status table (see scan_job_logs()) from job statuses.
+    :param job_ids: list of job ids to report on
+    :param found: list of (job_id, output of read_log_status()) tuples
+    :return: pd.DataFrame indexed by order_id, with columns has_log, log_size,
+        log_mtime, has_record, record_mtime, exit_code, success_marker, runtime
+        (seconds), host, max_rss_kb, signal, cause and success
+    """
+    columns = [
+        "log_size",
+        "log_mtime",
+        "record_mtime",
+        "exit_code",
+        "success_marker",
+        "runtime",
+        "host",
+        "max_rss_kb",
+        "signal",
+        "cause",
+    ]
+    df = pd.DataFrame.from_records(
+        [res for (_, res) in found],
+        index=pd.Index([job for (job, _) in found], name="order_id", dtype="int64"),
+        columns=columns,
+    ).reindex(pd.Index(job_ids, name="order_id", dtype="int64"))
+
+    df.insert(0, "has_log", df["log_size"].notna())
+    df.insert(3, "has_record", df["record_mtime"].notna())
+    df["log_size"] = df["log_size"].astype("Int64")
+    df["log_mtime"] = df["log_mtime"].astype("float64")
+    df["record_mtime"] = df["record_mtime"].astype("float64")
+    df["exit_code"] = df["exit_code"].astype("Int64")
+    df["success_marker"] = df["success_marker"].fillna(False).astype(bool)
+    df["runtime"] = df["runtime"].astype("Int64")
+    df["host"] = df["host"].astype("object")
+    df["max_rss_kb"] = df["max_rss_kb"].astype("Int64")
+    df["signal"] = df["signal"].astype("object")
+    df["cause"] = df["cause"].astype("object")
+    df["success"] = (df["exit_code"] == 0).fillna(False).astype(bool)
+    return df
+
+
+# how many lines from the end of failed logs to look for errors in
+TRIAGE_LINES = 40
+
+# (kind, pattern) pairs identifying error lines, by order of precedence; for
+# tracebacks, the exception type is part of the signature
+_ERROR_PATTERNS = [
+    ("timeout", re.compile(r"DUE TO TIME LIMIT", re.I)),
+    ("out of memory", re.compile(r"oom[-_ ]kill|out of memory|memory limit", re.I)),
+    ("matlab", re.compile(r"^(?:\?\?\? )?(Error using \S+)")),
+    ("python", re.compile(r"^(?:\w+\.)*(\w*(?:Error|Exception|Interrupt|Exit))(?::|$)")),
+    ("matlab", re.compile(r"^(?:\?\?\? )?(Error in \S+)")),
+    ("shell", re.compile(r"command not found|No such file or directory|Permission denied")),
+    ("signal", re.compile(r"Segmentation fault|Killed|Aborted|core dumped|Bus error")),
+    ("error", re.compile(r"\b(?:error|fatal|failed|exception)\b", re.I)),
+]
+_NORMALIZE = [
+    (re.compile(r"(['\"]).*?\1"), "<str>"),
+    (re.compile(r"(?:~|\.{0,2})?/[^\s:,;()'\"]+"), "<path>"),
+    (re.compile(r"\b0x[0-9a-fA-F]+\b"), "<hex>"),
+    (re.compile(r"\d+(?:\.\d+)?"), "<n>"),
+    (re.compile(r"\s+"), " "),
+]
+
+
+def normalize_error_line(line):
+    """
+    Normalize an error line, so that the same error in different jobs reads the same:
+    quoted strings, paths, hex addresses and numbers are replaced by placeholders.
+    :param line: str
+    :return: str
+    """
+    for pattern, placeholder in _NORMALIZE:
+        line = pattern.sub(placeholder, line)
+    return line.strip()[:200]
+
+
+def error_signature(lines):
+    """
+    Extract an error signature from the last lines of a failed job's log: the last
+    line that looks like an error, by order of precedence (see _ERROR_PATTERNS).
+    :param lines: last lines of the log (see read_log_tail_lines())
+    :return: dict with keys kind (e.g., 'python', 'matlab', 'timeout'; 'unknown' if
+        no error line is found), error_type (e.g., the Python exception raised, or
+        MATLAB function that failed; None if n/a) and message (normalized error line)
+    """
+    for kind, pattern in _ERROR_PATTERNS:
+        for line in reversed(lines):
+            match = pattern.search(line)
+            if match:
+                error_type = match.group(1) if pattern.groups > 0 else None
+                if kind == "matlab":
+                    error_type = normalize_error_line(error_type)
+                return {
+                    "kind": kind,
+                    "error_type": error_type,
+                    "message": normalize_error_line(line),
+                }
+    return {"kind": "unknown", "error_type": None, "message": ""}
+
+
+def _read_signature(path_to_file):
+    try:
+        return error_signature(read_log_tail_lines(path_to_file, n_lines=TRIAGE_LINES))
+    except FileNotFoundError:
+        return None
+
+
+def triage_failed_logs(log_dir, job_ids, n_workers=N_WORKERS):
+    """
+    Extract error signatures from the logs of failed jobs, reading only their ends,
+    in parallel.
+    :param log_dir: path to directory with job logs (<job_id>.txt)
+    :param job_ids: list of job ids (with logs) to triage
+    :param n_workers: number of threads to use
+    :return: pd.DataFrame indexed by order_id, with columns kind, error_type and
+        message (see error_signature())
+    """
+    present = list_job_logs(log_dir)
+    job_ids = [job for job in job_ids if job in present]
+    with ThreadPoolExecutor(max_workers=n_workers) as pool:
+        found = pool.map(_read_signature, [present[j] for j in job_ids])
+        found = [(job, sig) for (job, sig) in zip(job_ids, found) if sig is not None]
+    return pd.DataFrame.from_records(
+        [sig for (_, sig) in found],
+        index=pd.Index([job for (job, _) in found], name="order_id", dtype="int64"),
+        columns=["kind", "error_type", "message"],
+    )
+
+
+def group_failures(signatures, exit_codes=None, n_examples=5):
+    """
+    Group failed jobs by error signature.
+    :param signatures: pd.DataFrame, output of triage_failed_logs()
+    :param exit_codes: pd.Series of exit codes indexed by order_id, or None
+    :param n_examples: how many example job ids to list for each signature
+    :return: pd.DataFrame, one row per signature (kind, error_type, message and
+        exit_code), with n_jobs and example_ids, sorted by decreasing n_jobs
+    """
+    df = signatures.copy()
+    df["exit_code"] = (
+        exit_codes.reindex(df.index).astype("object") if exit_codes is not None else None
+    )
+    keys = ["kind", "error_type", "message", "exit_code"]
+    df[keys] = df[keys].fillna("").astype(str)
+    grouped = df.reset_index().groupby(keys, sort=False)["order_id"]
+    rv = pd.concat(
+        [
+            grouped.count().rename("n_jobs"),
+            grouped.agg(
+                lambda ids: " ".join(
+                    "{job:05d}".format(job=job) for job in sorted(ids)[:n_examples]
+                )
+            ).rename("example_ids"),
+        ],
+        axis=1,
+    ).reset_index()
+    return rv.sort_values("n_jobs", ascending=False, kind="mergesort").reset_index(
+        drop=True
+    )
+
+
+class LogStatusCache(StateCache):
+    """
+    Cache of job statuses (see read_log_status()), keyed by job id, kept in the
+    project's state store. Entries record the size and mtime of the log (and the
+    mtime of the result record) they were read from, so that scan_job_logs() only
+    has to re-read logs that changed.
+    """
+
+    NAME = "log_status"
+
+    # bump this if the way logs are parsed changes, to invalidate old caches
+    SCHEMA_VERSION = 3
+
+    FIELDS = (
+        "log_size",
+        "log_mtime",
+        "record_mtime",
+        "exit_code",
+        "success_marker",
+        "runtime",
+        "host",
+        "max_rss_kb",
+        "signal",
+        "cause",
+    )
+
+    TABLES = {
+        "job_status": "order_id INTEGER PRIMARY KEY, log_size INTEGER, "
+        "log_mtime REAL, record_mtime REAL, exit_code INTEGER, success_marker INTEGER, "
+        "runtime INTEGER, host TEXT, max_rss_kb INTEGER, signal TEXT, cause TEXT"
+    }
+
+    def load(self, job_ids):
+        """
+        Retrieve cached statuses.
+        :param job_ids: iterable of job ids
+        :return: dict, mapping job ids to status dicts (for those in the cache)
+        """
+        fields = ", ".join(f"s.{field}" for field in self.FIELDS)
+        with self._transaction() as con:
+            rows = self._select(
+                con,
+                f"SELECT s.order_id, {fields} FROM job_status s "
+                f"JOIN wanted w ON s.order_id = w.value",
+                [int(job) for job in job_ids],
+            ).fetchall()
+        rv = dict()
+        for row in rows:
+            rv[row[0]] = dict(zip(self.FIELDS, row[1:]))
+            rv[row[0]]["success_marker"] = bool(rv[row[0]]["success_marker"])
+        return rv
+
+    def store(self, statuses):
+        """
+        Add or update cached statuses.
+        :param statuses: dict, mapping job ids to status dicts
+        :return:
+        """
+        with self._transaction() as con:
+            con.executemany(
+                f"INSERT OR REPLACE INTO job_status VALUES "
+                f"(?{', ?' * len(self.FIELDS)})",
+                [
+                    (job, *[st[field] for field in self.FIELDS])
+                    for (job, st) in statuses.items()
+                ],
+            )
+
+    def discard(self, job_ids):
+        """
+        Remove cached statuses (e.g., for jobs whose logs were cleaned up).
+        :param job_ids: iterable of job ids
+        :return:
+        """
+        with self._transaction() as con:
+            con.executemany(
+                "DELETE FROM job_status WHERE order_id = ?",
+                [(int(job),) for job in job_ids],
+            )
+
+
+class JobLogWatcher:
+    """
+    Follows the logs of a set of jobs while they run, keeping a status table (see
+    scan_job_logs()) up to date. Each refresh lists the log (and results) directory
+    once, and only re-reads logs that appeared, vanished or changed since the
+    previous refresh. Successful jobs are assumed final and are not stat'ed again.
+    """
+
+    def __init__(
+        self, log_dir, job_ids, n_workers=N_WORKERS, cache=None, results_dir=None
+    ):
+        """
+        Instantiates a JobLogWatcher, scanning all logs once.
+        :param log_dir: path to directory with job logs (<job_id>.txt)
+        :param job_ids: list of job ids to follow
+        :param n_workers: number of threads to use
+        :param cache: LogStatusCache object to keep up to date, or None
+        :param results_dir: path to directory with result records, or None
+        """
+        self.log_dir = log_dir
+        self.results_dir = results_dir
+        self.job_ids = list(job_ids)
+        self.n_workers = n_workers
+        self.cache = cache
+        self.status = scan_job_logs(
+            log_dir, self.job_ids, n_workers, cache, results_dir
+        )
+
+    def __repr__(self):
+        return f"JobLogWatcher on {self.log_dir} ({len(self.job_ids)} jobs)"
+
+    def refresh(self):
+        """
+        Update the status table with whatever changed since the last refresh.
+        :return: list of job ids whose status was updated
+        """
+        present = list_job_logs(self.log_dir)
+        records = (
+            list_job_logs(self.results_dir, ext=".tsv") if self.results_dir else dict()
+        )
+        status = self.status
+
+        gone = [job for job in status.index[status["has_log"]] if job not in present]
+        recheck = [job for job in status.index[~status["success"]] if job in present]
+
+        with ThreadPoolExecutor(max_workers=self.n_workers) as pool:
+            stats = _stat_jobs(pool, recheck, present, records)
+            stale = [
+                job
+                for (job, (st, record_st)) in stats.items()
+                if not status.at[job, "has_log"]
+                or _has_changed(status.loc[job], st, record_st)
+            ]
+            fresh = _read_jobs(pool, stale, stats, present, records)
+
+        gone += [job for job in recheck if job not in fresh and job not in stats]
+        gone += [job for job in stale if job not in fresh]
+        if self.cache is not None:
+            self.cache.store(fresh)
+            self.cache.discard(gone)
+
+        updated = list(fresh) + gone
+        if len(updated) > 0:
+            self.status = pd.concat(
+                [
+                    status.drop(index=updated),
+                    status_table(updated, list(fresh.items())),
+                ]
+            ).reindex(status.index)
+        return updated
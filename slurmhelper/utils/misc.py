@@ -18,68 +18,100 @@ def split_list(alist, wanted_parts=1):
     ]
 
 
-def factors(n):
+def split_list_grouped(alist, keys, wanted_parts=1):
     """
-    Finds all factors for a given number.
-    Copied from https://stackoverflow.com/a/19578818
-    :param n: some integer
-    :return: set with all factors of n
+    Split a list into (at most) a given number of parts, like split_list(), but
+    keeping items that share a key (e.g., jobs reading the same inputs) in the same
+    part whenever that is possible without making any part longer than split_list()
+    would. Groups are placed largest first, each into the part with the most room
+    left; groups too large for that part are split across the roomiest parts.
+    Parts left empty are dropped.
+    :param alist: list o' jobs
+    :param keys: list of (hashable) keys, one for each item in alist
+    :param wanted_parts: how many chunks we want
+    :return: list o' lists, sorted
     """
-    from functools import reduce
-    from math import sqrt
-
-    step = 2 if n % 2 else 1
-    return set(
-        reduce(
-            list.__add__,
-            ([i, n // i] for i in range(1, int(sqrt(n)) + 1, step) if n % i == 0),
-        )
-    )
+    import heapq
+    import math
+
+    groups = dict()
+    for item, key in zip(alist, keys):
+        groups.setdefault(key, []).append(item)
+
+    capacity = math.ceil(len(alist) / wanted_parts)
+    parts = [[] for _ in range(wanted_parts)]
+    room = [(-capacity, i) for i in range(wanted_parts)]  # max-heap on room left
 
+    for group in sorted(groups.values(), key=len, reverse=True):
+        while len(group) > 0:
+            free, i = heapq.heappop(room)
+            taken, group = group[:-free], group[-free:]
+            parts[i] += taken
+            heapq.heappush(room, (free + len(taken), i))
 
-def find_optimal_n_parcels(n: int, p_min: int, par_target=50):
+    return sorted([sorted(p) for p in parts if len(p) > 0])
+
+
+def find_optimal_n_parcels(n: int, config: dict, par_target=50):
     """
-    Algorithm for parcellating jobs.
+    Algorithm for parcellating jobs. Parcels need not be evenly sized (split_list()
+    hands out the remainder one job at a time), so any number of parcels is viable
+    as long as the largest parcel fits within max_job_time.
+
+    Picks the number of parcels p minimizing a weighted sum of queue pressure (number
+    of array elements) and wall time per element, both scaled to [0, 1] over the
+    viable range: par_target weighs wall time, (100 - par_target) weighs queue
+    pressure. Only the fewest parcels giving each possible parcel length need to be
+    considered, so this runs in O(min(n, max jobs per parcel)).
+
     :param n: number of jobs to parcellate
-    :param p_min: constraint; minimum number of parcels (e.g., based on max duration per sbatch array element)
+    :param config: dict generated from reading the .yml spec; needs job_time,
+        job_ramp_up_time and max_job_time
     :param par_target: percent to which to attempt to parallelize (vs. serialize). 100 will lead to one array element per job; 0 will lead to the longest possible serial jobs.
-    :return:
+    :return: int, number of parcels
     """
-    import numpy as np
-    import logging
+    import math
 
-    logger = logging.getLogger("cli")
+    if not (
+        isinstance(n, int) and isinstance(par_target, int) and 0 <= par_target <= 100
+    ):
+        raise ValueError(
+            "n should be an integer, and par_target an integer between 0 and 100."
+        )
+    if n < 1:
+        raise ValueError("Need at least one job to divvy up!")
 
-    if p_min > n:
+    job_time = config["job_time"].total_seconds()
+    ramp_up = config["job_ramp_up_time"].total_seconds()
+    max_time = config["max_job_time"].total_seconds()
+
+    # longest parcel (in jobs) that fits within max_job_time
+    k_max = min(n, int((max_time - ramp_up) // job_time))
+    if k_max < 1:
         raise ValueError(
-            "Minimum number of parcels cannot be greater than number of jobs to divvy up!"
+            "A single job (plus ramp up time) does not fit within max_job_time!"
         )
 
-    if (
-        not isinstance(n, int)
-        and isinstance(p_min, int)
-        and isinstance(par_target, int)
-    ):
-        raise ValueError("All values supplied should be integers!")
-
-    if par_target == 100:  # avoid computation; just return n_jobs.
-        rv = n
-    else:
-        fac = {f for f in factors(n) if f >= p_min}  # determine viable factors
-        if len(fac) == 1 and list(fac)[0] == n:
-            logger.warning(
-                "There is no way to evenly serialize jobs across an sbatch array given the maximum sbatch "
-                "duration and number of jobs specified. Defaulting to full parallelization."
-            )
-            rv = n
-        else:
-            logger.info(
-                f"Jobs can be evenly divided into sbatch array elements that serialize: {fac} jobs"
-            )
-            print(sorted(list(fac)))
-            rv = np.percentile(sorted(list(fac)), par_target, interpolation="nearest")
-
-    return rv
+    p_min = math.ceil(n / k_max)
+    if p_min == n:
+        return n
+
+    wall_min = ramp_up + job_time  # one job per parcel
+    wall_max = ramp_up + math.ceil(n / p_min) * job_time
+    w = par_target / 100
+
+    best_p, best_cost = None, None
+    # fewest parcels first, so ties are broken in favor of less queue pressure
+    for k in range(k_max, 0, -1):
+        p = math.ceil(n / k)
+        wall = ramp_up + math.ceil(n / p) * job_time
+        cost = (1 - w) * (p - p_min) / (n - p_min) + w * (wall - wall_min) / (
+            wall_max - wall_min
+        )
+        if best_cost is None or cost < best_cost:
+            best_p, best_cost = p, cost
+
+    return best_p
 
 
 def unique(l):
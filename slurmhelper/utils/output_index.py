@@ -0,0 +1,183 @@
+"""
+Index of the output directories of a set of jobs (file names, sizes and mtimes),
+kept in the project's state store so checks do not walk the outputs tree every time:
+only directories whose mtime changed since they were last listed are listed again.
+"""
+
+import logging
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from ..db import StateCache
+from .logs import N_WORKERS
+
+logger = logging.getLogger("cli")
+
+# directories modified this close (seconds) to when they were listed are listed
+# again next time, as they may have changed while (or right after) being listed
+# within the filesystem's mtime granularity
+UNSETTLED_SECONDS = 2
+
+IndexedFile = namedtuple("IndexedFile", ["name", "size", "mtime"])
+
+
+class OutputIndex(StateCache):
+    """
+    Index of directory listings, kept in the project's state store: for each
+    directory, its mtime and when it was listed, and the name, size and mtime of each
+    of its entries.
+    """
+
+    NAME = "output_index"
+
+    TABLES = {
+        "output_dirs": "path TEXT PRIMARY KEY, mtime REAL, listed_at REAL",
+        "output_files": "dir TEXT, name TEXT, size INTEGER, mtime REAL, "
+        "PRIMARY KEY (dir, name)",
+    }
+
+    def load_dirs(self, paths):
+        """
+        Retrieve the mtime of a set of directories, and when they were listed.
+        :param paths: list of directory paths
+        :return: dict, mapping paths to (mtime, listed_at) tuples
+        """
+        with self._transaction() as con:
+            rows = self._select(
+                con,
+                "SELECT d.path, d.mtime, d.listed_at FROM output_dirs d "
+                "JOIN wanted w ON d.path = w.value",
+                paths,
+            )
+            return {row[0]: (row[1], row[2]) for row in rows}
+
+    def load_files(self, paths):
+        """
+        Retrieve the entries of a set of directories.
+        :param paths: list of directory paths
+        :return: dict, mapping paths to lists of IndexedFile tuples, sorted by name
+        """
+        rv = {p: [] for p in paths}
+        with self._transaction() as con:
+            rows = self._select(
+                con,
+                "SELECT f.dir, f.name, f.size, f.mtime FROM output_files f "
+                "JOIN wanted w ON f.dir = w.value ORDER BY f.dir, f.name",
+                paths,
+            )
+            for row in rows:
+                rv[row[0]].append(IndexedFile(*row[1:]))
+        return rv
+
+    def store(self, listings):
+        """
+        Replace the entries of a set of directories.
+        :param listings: dict, mapping paths to (mtime, listed_at, list of
+            IndexedFile tuples) tuples
+        :return:
+        """
+        with self._transaction() as con:
+            con.executemany(
+                "DELETE FROM output_files WHERE dir = ?", [(p,) for p in listings]
+            )
+            con.executemany(
+                "INSERT OR REPLACE INTO output_dirs VALUES (?, ?, ?)",
+                [(p, mtime, at) for (p, (mtime, at, _)) in listings.items()],
+            )
+            con.executemany(
+                "INSERT INTO output_files VALUES (?, ?, ?, ?)",
+                [
+                    (p, f.name, f.size, f.mtime)
+                    for (p, (_, _, files)) in listings.items()
+                    for f in files
+                ],
+            )
+
+    def discard(self, paths):
+        """
+        Forget a set of directories, e.g. because they no longer exist.
+        :param paths: list of directory paths
+        :return:
+        """
+        with self._transaction() as con:
+            con.executemany(
+                "DELETE FROM output_files WHERE dir = ?", [(p,) for p in paths]
+            )
+            con.executemany(
+                "DELETE FROM output_dirs WHERE path = ?", [(p,) for p in paths]
+            )
+
+
+def _dir_mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+
+
+def _list_with_stats(path):
+    listed_at = time.time()
+    files = []
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    # e.g., a broken symbolic link
+                    st = entry.stat(follow_symlinks=False)
+                files.append(IndexedFile(entry.name, st.st_size, st.st_mtime))
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+    return listed_at, sorted(files)
+
+
+def refresh_output_index(index, paths, n_workers=N_WORKERS, force=False):
+    """
+    Bring the index up to date for a set of directories, and return their entries.
+    Directories are stat'ed in parallel, and only those that are new to the index,
+    or whose mtime changed since they were listed, are listed again. Note that
+    changes to files that do not touch their directory (e.g., rewriting a file in
+    place) are only picked up with force.
+    :param index: OutputIndex object
+    :param paths: iterable of directory paths (duplicates are considered once)
+    :param n_workers: number of threads to use
+    :param force: if True, list all directories again
+    :return: dict, mapping paths to lists of IndexedFile tuples sorted by name (None
+        if the directory does not exist)
+    """
+    paths = list(dict.fromkeys(paths))
+    known = dict() if force else index.load_dirs(paths)
+
+    with ThreadPoolExecutor(max_workers=n_workers) as pool:
+        mtimes = dict(zip(paths, pool.map(_dir_mtime, paths)))
+        stale = [
+            p
+            for p in paths
+            if mtimes[p] is not None
+            and (
+                p not in known
+                or known[p][0] != mtimes[p]
+                or mtimes[p] >= known[p][1] - UNSETTLED_SECONDS
+            )
+        ]
+        listed = dict(zip(stale, pool.map(_list_with_stats, stale)))
+
+    missing = [p for p in paths if mtimes[p] is None or listed.get(p, 0) is None]
+    fresh = {p: listed[p] for p in stale if listed[p] is not None}
+    logger.info(
+        f"Output index: {len(paths)} directories, {len(fresh)} (re)listed, "
+        f"{len(paths) - len(fresh) - len(missing)} unchanged, {len(missing)} missing."
+    )
+
+    index.discard(missing)
+    index.store(
+        {p: (mtimes[p], listed_at, files) for (p, (listed_at, files)) in fresh.items()}
+    )
+
+    rv = {p: None for p in missing}
+    rv.update({p: files for (p, (_, files)) in fresh.items()})
+    rv.update(index.load_files([p for p in paths if p not in rv]))
+    return rv
@@ -0,0 +1,202 @@
+"""
+Simulate different ways of laying out jobs into sbatch arrays, to pick a good one
+before actually submitting anything.
+"""
+
+import heapq
+import logging
+
+import pandas as pd
+
+from .misc import find_optimal_n_parcels, split_list
+from .slurm import parse_slurm_duration
+from .time import calculate_wall_time
+
+logger = logging.getLogger("cli")
+
+PACKING_STRATEGIES = ("even", "balanced")
+
+
+def estimate_job_durations(job_list, config, history=None):
+    """
+    Estimate how long each job will take (in seconds). Jobs that already have a runtime
+    on record use it; other jobs use the median runtime on record, or the spec's
+    job_time if there is no runtime history at all.
+    :param job_list: list of job ids
+    :param config: dict generated from reading the .yml spec
+    :param history: pd.Series of runtimes (timedelta) indexed by order_id, or None
+    :return: list of estimated durations (seconds), in the same order as job_list
+    """
+    default = config["job_time"].total_seconds()
+    if history is None or len(history) == 0:
+        return [default] * len(job_list)
+
+    seconds = history.dt.total_seconds()
+    default = seconds.median()
+    return [float(seconds.get(job, default)) for job in job_list]
+
+
+def pack_parcels(job_list, durations, n_parcels, strategy="even"):
+    """
+    Divvy up jobs into parcels.
+    :param job_list: list of job ids
+    :param durations: list of estimated job durations (seconds), matching job_list
+    :param n_parcels: number of parcels wanted
+    :param strategy: str, one of PACKING_STRATEGIES:
+        - even: contiguous chunks with the same number of jobs (what prep-array does)
+        - balanced: longest jobs first, each into the currently shortest parcel
+    :return: list o' lists of job ids
+    """
+    if strategy == "even":
+        return split_list(job_list, wanted_parts=n_parcels)
+    elif strategy == "balanced":
+        parcels = [[] for _ in range(n_parcels)]
+        heap = [(0.0, i) for i in range(n_parcels)]
+        order = sorted(range(len(job_list)), key=lambda i: -durations[i])
+        for i in order:
+            load, p = heapq.heappop(heap)
+            parcels[p].append(job_list[i])
+            heapq.heappush(heap, (load + durations[i], p))
+        return [sorted(p) for p in parcels]
+    else:
+        raise ValueError(
+            f"Invalid packing strategy: {strategy}. "
+            f"Should be one of: {' '.join(PACKING_STRATEGIES)}"
+        )
+
+
+def simulate_array_makespan(element_durations, rate_limit=None):
+    """
+    Simulate running an array, with elements launched in index order as soon as one
+    of rate_limit slots frees up. Assumes the cluster itself has room for all of them.
+    :param element_durations: list of durations (seconds) for each array element
+    :param rate_limit: max number of concurrently running elements (None: no limit)
+    :return: makespan, in seconds
+    """
+    if len(element_durations) == 0:
+        return 0.0
+    slots = len(element_durations) if rate_limit is None else rate_limit
+    running = []
+    makespan = 0.0
+    for d in element_durations:
+        start = heapq.heappop(running) if len(running) >= slots else 0.0
+        heapq.heappush(running, start + d)
+        makespan = max(makespan, start + d)
+    return makespan
+
+
+def simulate_layout(
+    job_list, config, n_parcels, rate_limit=None, strategy="even", durations=None
+):
+    """
+    Simulate a given array layout for a list of jobs.
+    :param job_list: list of job ids
+    :param config: dict generated from reading the .yml spec
+    :param n_parcels: number of parcels (array elements)
+    :param rate_limit: max number of concurrently running elements (None: no limit)
+    :param strategy: packing strategy (see pack_parcels())
+    :param durations: estimated job durations (see estimate_job_durations())
+    :return: dict with the layout and its expected cost
+    """
+    if durations is None:
+        durations = estimate_job_durations(job_list, config)
+    duration_of = dict(zip(job_list, durations))
+
+    ramp_up = config["job_ramp_up_time"].total_seconds()
+    parcels = pack_parcels(job_list, durations, n_parcels, strategy)
+    expected = [ramp_up + sum(duration_of[j] for j in p) for p in parcels]
+
+    # wall time is requested per array, based on the longest parcel (as in prep-array)
+    max_len = max(len(p) for p in parcels)
+    wall_time = pd.Timedelta(
+        seconds=parse_slurm_duration(calculate_wall_time(max_len, config))
+    )
+    requested = wall_time.total_seconds() * n_parcels
+
+    return {
+        "strategy": strategy,
+        "n_parcels": n_parcels,
+        "rate_limit": rate_limit,
+        "max_jobs_per_parcel": max_len,
+        "wall_time": wall_time,
+        "makespan": pd.Timedelta(
+            seconds=simulate_array_makespan(expected, rate_limit)
+        ),
+        "node_hours": requested / 3600,
+        "wasted_hours": sum(max(0.0, wall_time.total_seconds() - e) for e in expected)
+        / 3600,
+        "timeouts_expected": sum(e > wall_time.total_seconds() for e in expected),
+        "exceeds_max_job_time": wall_time > config["max_job_time"],
+    }
+
+
+def candidate_n_parcels(n_jobs, config):
+    """
+    Come up with a few sensible numbers of parcels to try, ranging from the most
+    serial layout allowed by max_job_time to full parallelization.
+    :param n_jobs: number of jobs to parcellate
+    :param config: dict generated from reading the .yml spec
+    :return: sorted list of ints
+    """
+    return sorted(
+        {
+            find_optimal_n_parcels(n_jobs, config, par_target)
+            for par_target in (0, 25, 50, 75, 100)
+        }
+    )
+
+
+def plan_layouts(
+    job_list,
+    config,
+    n_parcels_list=None,
+    rate_limits=None,
+    strategies=PACKING_STRATEGIES,
+    history=None,
+):
+    """
+    Simulate all combinations of the given layout parameters.
+    :param job_list: list of job ids
+    :param config: dict generated from reading the .yml spec
+    :param n_parcels_list: numbers of parcels to try (None: see candidate_n_parcels())
+    :param rate_limits: rate limits to try (None: no rate limit)
+    :param strategies: packing strategies to try
+    :param history: pd.Series of runtimes (timedelta) indexed by order_id, or None
+    :return: pd.DataFrame, one row per layout, with a 'recommended' column (only
+        even layouts are recommended, as prep-array only builds those); empty if
+        none of the numbers of parcels fits the jobs
+    """
+    if n_parcels_list is None:
+        n_parcels_list = candidate_n_parcels(len(job_list), config)
+    if rate_limits is None:
+        rate_limits = [None]
+
+    durations = estimate_job_durations(job_list, config, history)
+
+    rows = [
+        simulate_layout(job_list, config, n, rate, strategy, durations)
+        for n in n_parcels_list
+        if 0 < n <= len(job_list)
+        for rate in rate_limits
+        for strategy in strategies
+    ]
+    df = pd.DataFrame.from_records(rows)
+    df["recommended"] = False
+    if len(df) == 0:
+        return df
+
+    # recommend the cheapest layout prep-array can build, among the feasible ones
+    # whose makespan is within 10% of the best one
+    buildable = df[df["strategy"] == "even"]
+    if len(buildable) == 0:
+        return df
+    feasible = buildable[
+        ~buildable["exceeds_max_job_time"] & (buildable["timeouts_expected"] == 0)
+    ]
+    if len(feasible) == 0:
+        logger.warning("None of the layouts simulated fit within your time limits!")
+        feasible = buildable
+    fast = feasible[feasible["makespan"] <= feasible["makespan"].min() * 1.1]
+    df.loc[fast.sort_values(["node_hours", "makespan"]).index[0], "recommended"] = True
+
+    return df.sort_values(["makespan", "node_hours"]).reset_index(drop=True)
@@ -0,0 +1,138 @@
+"""
+Snapshots of the Slurm queue (from squeue), cached for a short while so repeated
+checks do not hit slurmctld, and mapped back to sbatch ids and job ids.
+"""
+
+import json
+import logging
+import os
+import time
+
+import pandas as pd
+
+from .events import record_queue_events
+from .slurm import attach_job_ids, expand_by_job, read_squeue, wrapper_jobs
+
+logger = logging.getLogger("cli")
+
+# last queue snapshot, kept in the working directory
+QUEUE_SNAPSHOT_FILE = "queue_snapshot.json"
+
+# how long (seconds) a queue snapshot is reused for, by default
+DEFAULT_QUEUE_TTL = 60
+
+QUEUE_COLUMNS = (
+    "slurm_id",
+    "slurm_job_id",
+    "array_task",
+    "job_name",
+    "state",
+    "time_used",
+    "time_limit",
+    "nodes",
+    "reason",
+)
+
+
+def get_queue_snapshot(dirs, ttl=DEFAULT_QUEUE_TTL, user=None):
+    """
+    Get the user's jobs in the Slurm queue, reusing the last snapshot taken from
+    this working directory if it is recent enough. New snapshots feed the event
+    log with the jobs that started pending or running, and those that left the
+    queue (see ..utils.events:record_queue_events()).
+    :param dirs: output of ..utils.io:calculate_directories()
+    :param ttl: max age (seconds) of a snapshot to reuse; 0 to always query squeue
+    :param user: user name; defaults to $USER
+    :return: tuple, (list of dicts from ..utils.slurm:parse_squeue(), time the
+        snapshot was taken, in seconds since the epoch)
+    """
+    if user is None:
+        user = os.environ["USER"]
+    path = os.path.join(dirs["base"], QUEUE_SNAPSHOT_FILE)
+
+    if ttl > 0 and os.path.exists(path):
+        try:
+            with open(path, "r") as f:
+                snapshot = json.load(f)
+            age = time.time() - snapshot["taken_at"]
+            if snapshot["user"] == user and 0 <= age < ttl:
+                logger.info(f"Using queue snapshot from {age:.0f} seconds ago.")
+                return snapshot["jobs"], snapshot["taken_at"]
+        except (ValueError, KeyError) as err:
+            logger.warning(f"Ignoring unreadable queue snapshot {path}: {err}")
+
+    taken_at = time.time()
+    jobs = read_squeue(user)
+
+    # write atomically, in case other slurmhelper calls read it concurrently
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"user": user, "taken_at": taken_at, "jobs": jobs}, f)
+    os.replace(tmp_path, path)
+
+    record_queue_events(dirs, queue_table(dirs, jobs), taken_at)
+
+    return jobs, taken_at
+
+
+def queue_table(dirs, jobs):
+    """
+    Tabulate a queue snapshot, mapped back to sbatch ids and job ids.
+    :param dirs: output of ..utils.io:calculate_directories()
+    :param jobs: list of dicts, from get_queue_snapshot()
+    :return: pd.DataFrame, one row per Slurm job (or array task), with the columns
+        in QUEUE_COLUMNS plus sbatch_id, is_relay and order_ids (see
+        ..utils.slurm:attach_job_ids())
+    """
+    df = pd.DataFrame.from_records(jobs, columns=QUEUE_COLUMNS)
+    df = attach_job_ids(df, dirs)
+    return df.sort_values(["sbatch_id", "slurm_job_id", "array_task"]).reset_index(
+        drop=True
+    )
+
+
+def summarize_queue(df):
+    """
+    Count jobs in the queue by sbatch id and state.
+    :param df: pd.DataFrame, output of queue_table()
+    :return: pd.DataFrame, one row per sbatch id (or Slurm job name, for jobs not
+        submitted by slurmhelper), with counts of Slurm jobs by state, and the
+        number of job ids they run
+    """
+    label = df["job_name"].where(df["sbatch_id"].isna(), df["job_name"].str[:7])
+    counts = pd.crosstab(label.rename("sbatch"), df["state"])
+    n_jobs = df.groupby(label.rename("sbatch"))["order_ids"].agg(
+        lambda ids: sum(len(i) for i in ids)
+    )
+    return counts.join(n_jobs.rename("n_job_ids"))
+
+
+def queued_jobs(dirs, ttl=DEFAULT_QUEUE_TTL):
+    """
+    Find which jobs are still in the queue: run by a Slurm job (or array task) that
+    is pending or running, or by an array yet to be submitted by a queued relay job
+    (see ..jobs.cli_helpers:prep_job_array()), counted as pending.
+    :param dirs: output of ..utils.io:calculate_directories()
+    :param ttl: max age (seconds) of a queue snapshot to reuse
+    :return: pd.Series of squeue states (e.g., PENDING or RUNNING), indexed by
+        order_id
+    """
+    jobs, _ = get_queue_snapshot(dirs, ttl)
+    df = queue_table(dirs, jobs)
+
+    # a relay job submits the next array in its chain, which submits the next one...
+    chained = []
+    for sb_id in df.loc[df["is_relay"], "sbatch_id"].dropna().unique():
+        next_id = int(sb_id) + 1
+        while True:
+            for task_jobs in wrapper_jobs(dirs, next_id).values():
+                chained += task_jobs
+            relay = os.path.join(dirs["slurm_scripts"], f"sb-{next_id:04d}-relay.sh")
+            if not os.path.exists(relay):
+                break
+            next_id += 1
+
+    chained = pd.Series("PENDING", index=pd.Index(chained, dtype="int64"))
+    states = pd.concat([chained.astype("object"), expand_by_job(df)["state"]])
+    states = states[~states.index.duplicated(keep="last")].sort_index()
+    return states.rename("state").rename_axis("order_id")
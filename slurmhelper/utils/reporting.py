@@ -2,19 +2,67 @@
 Functions used to aid in reporting information to the user about runs, jobs, etc.
 """
 
+import datetime
 import glob
 import logging
 import os
 import re
-import time
 import subprocess
+import sys
+import time
 from pathlib import Path
-from io import StringIO
-from pprint import pprint
 
 import pandas as pd
 
+from ..db import SlurmhelperDB
 from ..jobs.utils import build_job_objects
+from .analytics import (
+    NEAR_LIMIT,
+    build_runtime_table,
+    export_runtimes,
+    suggest_time_settings,
+    summarize_runtimes,
+)
+from .checksums import available_algorithms, update_manifests
+from .events import (
+    JOB_EVENTS,
+    job_timeline,
+    read_events,
+    record_log_events,
+    throughput,
+)
+from .io import export_table, load_db
+from .job_tests import (
+    JobTestCache,
+    parse_job_tests,
+    stat_job_outputs,
+)
+from .logs import (
+    N_WORKERS,
+    STTY_NOISE,
+    JobLogWatcher,
+    LogStatusCache,
+    group_failures,
+    scan_job_logs,
+    triage_failed_logs,
+)
+from .output_index import OutputIndex
+from .queue_status import (
+    DEFAULT_QUEUE_TTL,
+    get_queue_snapshot,
+    queue_table,
+    queued_jobs,
+    summarize_queue,
+)
+from .slurm import expand_by_job
+from .usage import MEMORY_HEADROOM, read_usage, suggest_resources, summarize_usage
+from .validation import (
+    build_status_table,
+    list_output_dirs,
+    match_outputs,
+    output_locations,
+    validate_jobs,
+)
 
 logger = logging.getLogger("cli")
 
@@ -86,14 +134,40 @@ def list_slurm(dirs):
     return
 
 
-def check_queue():
-    # assumes slurm
-    out = subprocess.check_output(
-        ["squeue", "-u", os.environ["USER"]], encoding="UTF-8"
-    )
-    df = pd.read_fwf(StringIO(out))
-    # TODO: merge this with info on sbatch thingys, then do some magic to make it more informative!
-    pprint(df)
+def check_queue(dirs, ttl=DEFAULT_QUEUE_TTL, show_jobs=False):
+    """
+    Print the user's jobs in the Slurm queue, by sbatch id and state, and details on
+    running sbatch jobs (see ..utils.queue_status).
+    :param dirs: output of ..utils.io:calculate_directories()
+    :param ttl: max age (seconds) of a cached queue snapshot to reuse
+    :param show_jobs: bool, whether to list the job ids run by each running element
+    :return:
+    """
+    jobs, taken_at = get_queue_snapshot(dirs, ttl)
+    taken_at = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(taken_at))
+    print(f"queue as of {taken_at}")
+    if len(jobs) == 0:
+        print("No jobs in the queue.")
+        return
+
+    df = queue_table(dirs, jobs)
+    with pd.option_context("display.max_columns", None, "display.width", 200):
+        print(summarize_queue(df))
+
+    running = df[df["state"] == "RUNNING"].copy()
+    if len(running) > 0:
+        for col in ("time_used", "time_limit"):
+            running[col] = running[col].map(_format_seconds)
+        columns = ["slurm_id", "job_name", "array_task", "time_used", "time_limit"]
+        columns += ["reason"]
+        if show_jobs:
+            running["job_ids"] = running["order_ids"].map(
+                lambda ids: " ".join("{job:05d}".format(job=job) for job in ids)
+            )
+            columns += ["job_ids"]
+        print("\nrunning:")
+        with pd.option_context("display.max_rows", None, "display.width", 200):
+            print(running[columns].to_string(index=False))
 
 
 def read_log_file_lines(path_to_file):
@@ -104,13 +178,7 @@ def read_log_file_lines(path_to_file):
             lines = [s.strip() for s in log.readlines()]
 
         # remove this for my sanity
-        lines = list(
-            filter(
-                lambda s: "stty: standard input: Inappropriate ioctl "
-                "for device" not in s,
-                lines,
-            )
-        )
+        lines = list(filter(lambda s: STTY_NOISE not in s, lines))
 
         # strip newlines for Now
         lines = [s.strip() for s in lines]
@@ -162,6 +230,12 @@ def pretty_print_sbatch_log(path_to_file, head, tail, full):
     pretty_print_log(path_to_file, head=head, tail=tail, full=full, header="sbatch")
 
 
+def _format_seconds(seconds):
+    if pd.isna(seconds):
+        return ""
+    return str(datetime.timedelta(seconds=round(seconds)))
+
+
 def pretty_print_job_ids(ids_list, n_cols=5):
     chunks = [ids_list[x : x + n_cols] for x in range(0, len(ids_list), n_cols)]
     print("\n".join(["\t".join([str(cell) for cell in row]) for row in chunks]))
@@ -220,26 +294,212 @@ def check_log(id, type, dirs, config, head=None, tail=None, full=False):
                 # TODO: implement something here?
 
 
+def get_job_status(dirs, job_list=None, n_workers=N_WORKERS, rescan=False):
+    """
+    Build a status table for a set of jobs, from their result records and logs (see
+    ..utils.logs:scan_job_logs()). Statuses are cached in the working
+    directory, so only logs that changed since the last call are read again. Jobs
+    found to have finished are added to the event log (see ..utils.events).
+    :param dirs: output of ..utils.io:calculate_directories()
+    :param job_list: list of job ids to consider; if None, all jobs are considered
+    :param n_workers: number of threads used to read logs
+    :param rescan: if True, re-parse all logs regardless of the cache
+    :return: pd.DataFrame indexed by order_id
+    """
+    job_list, cache = _status_scan_args(dirs, job_list, rescan)
+    status = scan_job_logs(
+        dirs["job_logs"],
+        job_list,
+        n_workers=n_workers,
+        cache=cache,
+        results_dir=dirs.get("job_results"),
+    )
+    record_log_events(dirs, status)
+    return status
+
+
+def _status_scan_args(dirs, job_list, rescan):
+    if job_list is None:
+        logger.warning("no job range provided, so looking at ALL the jobs.")
+        job_list = load_db(os.path.join(dirs["base"], "db.csv"))["order_id"].tolist()
+
+    cache = LogStatusCache(dirs)
+    if rescan:
+        cache.discard(job_list)
+
+    return job_list, cache
+
+
+def summarize_progress(status, now=None, window=3600, queued=None):
+    """
+    Tally up a status table (see get_job_status()) for progress reporting. Given
+    the jobs in the queue, jobs whose log does not end in an exit code yet are
+    running (or pending, if they have no log yet) while they are queued, and lost
+    (e.g., killed for running out of time) or not queued (e.g., never submitted)
+    once they are not. Without it, such jobs are counted as running if they have a
+    log, and as pending otherwise.
+    :param status: pd.DataFrame, output of get_job_status()
+    :param now: timestamp (seconds since the epoch) to compute throughput at;
+        defaults to the current time
+    :param window: period (seconds) over which to measure throughput
+    :param queued: pd.Series indexed by the job ids in the queue (see
+        ..utils.queue_status:queued_jobs()), or None if unknown
+    :return: dict with counts of jobs completed, failed, running, pending, lost and
+        not_queued (None if queued is None), and throughput (jobs finished per hour
+        over the window) and eta (pd.Timedelta, or None if nothing finished within
+        the window)
+    """
+    if now is None:
+        now = time.time()
+
+    finished = status["exit_code"].notna()
+    completed = int(status["success"].sum())
+    failed = int(finished.sum()) - completed
+    if queued is None:
+        in_queue = ~finished
+        lost, not_queued = None, None
+    else:
+        in_queue = ~finished & status.index.isin(queued.index)
+        lost = int((~finished & ~in_queue & status["has_log"]).sum())
+        not_queued = int((~finished & ~in_queue & ~status["has_log"]).sum())
+    running = int((in_queue & status["has_log"]).sum())
+    pending = int((in_queue & ~status["has_log"]).sum())
+
+    recent = int((finished & (status["log_mtime"] >= now - window)).sum())
+    throughput = recent * 3600 / window
+    remaining = running + pending
+    eta = None
+    if throughput > 0:
+        eta = pd.Timedelta(hours=remaining / throughput).round("s")
+    elif remaining == 0:
+        eta = pd.Timedelta(0)
+
+    return {
+        "total": len(status),
+        "completed": completed,
+        "failed": failed,
+        "running": running,
+        "pending": pending,
+        "lost": lost,
+        "not_queued": not_queued,
+        "throughput": throughput,
+        "eta": eta,
+    }
+
+
+def format_progress(progress):
+    """
+    One-line rendering of the output of summarize_progress().
+    """
+    total = max(progress["total"], 1)
+    eta = "--" if progress["eta"] is None else str(progress["eta"].to_pytimedelta())
+    unfinished = ""
+    if progress["lost"] is not None:
+        unfinished = (
+            f"lost: {progress['lost']} | not queued: {progress['not_queued']} | "
+        )
+    return (
+        f"[{time.strftime('%H:%M:%S')}] "
+        f"completed: {progress['completed']}/{progress['total']} "
+        f"({progress['completed'] * 100 / total:.1f}%) | "
+        f"failed: {progress['failed']} | running: {progress['running']} | "
+        f"pending: {progress['pending']} | {unfinished}"
+        f"{progress['throughput']:.1f} jobs/h | ETA: {eta}"
+    )
+
+
+def watch_completed(
+    dirs,
+    config,
+    job_list=None,
+    interval=30,
+    failed_report=False,
+    rescan=False,
+    n_workers=N_WORKERS,
+    triage=False,
+):
+    """
+    Follow job completion continuously, printing progress (updated in place when
+    writing to a terminal) every interval seconds, until none of the jobs is left
+    in the queue or the user hits Ctrl+C. Logs are re-read incrementally (see
+    ..utils.logs:JobLogWatcher). Prints the usual check_completed() report at the end.
+    :param dirs: output of ..utils.io:calculate_directories()
+    :param config: dict generated from reading the .yml spec
+    :param job_list: list of job ids to consider; if None, all jobs are considered
+    :param interval: seconds to wait between refreshes
+    :param failed_report: bool, whether to print the logs of failed jobs at the end
+    :param rescan: if True, re-parse all logs regardless of the cache
+    :param n_workers: number of threads used to read logs
+    :param triage: bool, whether to group failed jobs by error at the end
+    :return:
+    """
+    job_list, cache = _status_scan_args(dirs, job_list, rescan)
+    watcher = JobLogWatcher(
+        dirs["job_logs"], job_list, n_workers, cache, dirs.get("job_results")
+    )
+
+    in_place = sys.stdout.isatty()
+    use_queue = True
+    try:
+        while True:
+            queued = None
+            if use_queue:
+                try:
+                    queued = queued_jobs(dirs, ttl=min(interval, DEFAULT_QUEUE_TTL))
+                except (OSError, KeyError, subprocess.CalledProcessError) as err:
+                    logger.warning(
+                        f"Could not query squeue ({err}); jobs with no exit code "
+                        f"will be counted as running until they write one."
+                    )
+                    use_queue = False
+            progress = summarize_progress(watcher.status, queued=queued)
+            line = format_progress(progress)
+            if in_place:
+                print(f"\r\033[K{line}", end="", flush=True)
+            else:
+                print(line, flush=True)
+            if progress["running"] + progress["pending"] == 0:
+                break
+            time.sleep(interval)
+            updated = watcher.refresh()
+            if len(updated) > 0:
+                record_log_events(dirs, watcher.status.loc[updated])
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if in_place:
+            print()
+
+    check_completed(
+        dirs, config, job_list=job_list, failed_report=failed_report, triage=triage
+    )
+
+
 def check_completed(
-    dirs, config, job_list=None, return_completed_list=False, failed_report=False
+    dirs,
+    config,
+    job_list=None,
+    return_completed_list=False,
+    failed_report=False,
+    rescan=False,
+    triage=False,
 ):
     # if job list is none, assume all of them are the ones we care about...
-    # basically copypaste from check_runtimes
 
-    logger.info(f"Building job objects...")
-    job_obj_list = build_job_objects(dirs, config, job_list)
+    logger.info(f"Scanning job logs...")
+    status = get_job_status(dirs, job_list, rescan=rescan)
 
-    with_logs = list(filter(lambda x: x.has_job_log, job_obj_list))
+    with_logs = status.index[status["has_log"]].tolist()
 
-    if return_completed_list and len(with_logs) < len(job_obj_list):
+    if return_completed_list and len(with_logs) < len(status):
         logger.warning(
-            f"Of the {len(job_obj_list)} total job ids considered,"
+            f"Of the {len(status)} total job ids considered,"
             f"only {len(with_logs)} of those have valid log files."
         )
 
-    with_success = list(filter(lambda x: x.ran_successfully, with_logs))
+    with_success = status.index[status["success"]].tolist()
 
-    if return_completed_list and len(with_logs) < len(job_list):
+    if return_completed_list and len(with_success) < len(with_logs):
         logger.warning(
             f"Of the {len(with_logs)} jobs with logs, only "
             f"{len(with_success)} appear to have completed successfully."
@@ -248,29 +508,30 @@ def check_completed(
     # Now print stuff nicely.
 
     if return_completed_list:
-        rv = with_success
+        rv = build_job_objects(dirs, config, with_success)
     else:
         rv = None
-        no_logs_ids = list(
-            set([str(job) for job in job_obj_list])
-            - set([str(job) for job in with_logs])
-        )
-        failed_job_ids = list(
-            set([str(job) for job in with_logs])
-            - set([str(job) for job in with_success])
-        )
+        no_logs_ids = [
+            "{job:05d}".format(job=job)
+            for job in status.index[~status["has_log"]].tolist()
+        ]
+        failed_job_ids = [
+            "{job:05d}".format(job=job)
+            for job in status.index[status["has_log"] & ~status["success"]].tolist()
+        ]
         print("\n~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~")
         print("~ slurmhelper check completed: results ~~~~~~~~")
         print("~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~\n")
-        print(f"jobs considered: {len(job_obj_list)}")
+        print(f"jobs considered: {len(status)}")
         print(
-            f"logs exist in logs/jobs/<order_id>.txt: {len(with_logs)} ({len(with_logs)*100/len(job_obj_list)}% of considered)"
+            f"logs exist in logs/jobs/<order_id>.txt: {len(with_logs)} ({len(with_logs)*100/len(status)}% of considered)"
         )
         print(f"logs indicate success: {len(with_success)}")
-        print(f"    ({len(with_success)*100/len(job_obj_list)}% of considered);")
-        print(
-            f"    ({len(with_success)*100/len(with_logs)}% of considered w/ existing logs);"
-        )
+        print(f"    ({len(with_success)*100/len(status)}% of considered);")
+        if len(with_logs) > 0:
+            print(
+                f"    ({len(with_success)*100/len(with_logs)}% of considered w/ existing logs);"
+            )
         if len(no_logs_ids) > 0:
             print(f"\njobs without logfiles (n = {len(no_logs_ids)})")
             pretty_print_job_ids(sorted(no_logs_ids))
@@ -278,6 +539,11 @@ def check_completed(
             print(f"\nfailed jobs (n = {len(failed_job_ids)}):")
             pretty_print_job_ids(sorted(failed_job_ids))
 
+            if triage:
+                print_failure_triage(
+                    dirs, [int(job) for job in failed_job_ids], status["exit_code"]
+                )
+
             if failed_report:
                 print(
                     pretty_cli_header(
@@ -285,56 +551,436 @@ def check_completed(
                     )
                 )
 
-                failed_jobs = list(
-                    filter(lambda x: str(x) in failed_job_ids, with_logs)
+                failed_jobs = build_job_objects(
+                    dirs, config, [int(job) for job in failed_job_ids]
                 )
 
                 for job in sorted(failed_jobs):
                     job.print_job_log()
                     print(" ")
-            else:
+            elif not triage:
                 print(
-                    "\nTip: rerun with --show-failed-logs flag to print out job logs available for failed jobs\n"
+                    "\nTip: rerun with --show-failed-logs flag to print out job logs available for failed jobs,"
+                    "\nor with --triage to group failures by error\n"
                 )
 
     return rv
 
 
-def check_runtimes(dirs, config, job_list=None):
-    # assumptions about runtime: formatting, position
-    # runtime_unit = seconds
+def print_failure_triage(dirs, job_list, exit_codes=None, n_workers=N_WORKERS):
+    """
+    Print failed jobs grouped by error signature (see ..utils.logs:error_signature()),
+    most common first.
+    :param dirs: output of ..utils.io:calculate_directories()
+    :param job_list: list of failed job ids
+    :param exit_codes: pd.Series of exit codes indexed by order_id, or None
+    :param n_workers: number of threads used to read logs
+    :return: pd.DataFrame, output of ..utils.logs:group_failures()
+    """
+    signatures = triage_failed_logs(dirs["job_logs"], job_list, n_workers=n_workers)
+    groups = group_failures(signatures, exit_codes)
+
+    print(
+        pretty_cli_header(
+            f"failures by error ({len(groups)} distinct)",
+            "*",
+            n_cols=60,
+            start_newline=True,
+            end_newline=True,
+        )
+    )
+    for _, group in groups.iterrows():
+        error = group["message"] if group["message"] != "" else "(no error line found)"
+        print(
+            f"\n[{group['n_jobs']} job(s)] {group['kind']}"
+            f"{', exit code ' + group['exit_code'] if group['exit_code'] else ''}"
+        )
+        print(f"    {error}")
+        print(f"    e.g.: {group['example_ids']}")
+    print("")
+    return groups
+
+
+def read_job_runtimes(dirs, job_list=None, rescan=False):
+    """
+    Read runtimes of successfully completed jobs, from their result records (or, for
+    jobs run by older wrappers, as reported at the end of their logs).
+    :param dirs: output of ..utils.io:calculate_directories()
+    :param job_list: list of job ids to consider; if None, all jobs are considered
+    :param rescan: if True, re-parse all logs regardless of the status cache
+    :return: pd.Series of runtimes (timedelta), indexed by order_id
+    """
+    # runtimes are in seconds (see ..utils.logs)
     runtime_unit = "seconds"
-    runtime_line_position = -3
-    runtime_strip_str = "runtime: "
 
-    with_success = check_completed(
-        dirs, config, job_list, failed_report=False, return_completed_list=True
+    status = get_job_status(dirs, job_list, rescan=rescan)
+    runtimes = status.loc[status["success"] & status["runtime"].notna(), "runtime"]
+
+    return pd.to_timedelta(runtimes.astype("int64"), unit=runtime_unit).rename(
+        "runtime"
     )
 
-    runtimes = []
-    for job in with_success:
-        lines = job.read_job_log_lines()
-        rt = int(lines[runtime_line_position].strip(runtime_strip_str))
-        runtimes.append(rt)
 
-    runtime_df = pd.DataFrame(
-        pd.to_timedelta(runtimes, unit=runtime_unit), columns=["runtime"]
-    )
+def check_runtimes(
+    dirs,
+    config,
+    job_list=None,
+    rescan=False,
+    group_by=None,
+    near_limit=NEAR_LIMIT,
+    export=None,
+):
+    """
+    Print runtime statistics for successfully completed jobs, overall or by groups
+    of jobs, flag jobs that came close to the wall time limit, and suggest time
+    settings for the spec (see ..utils.analytics).
+    :param dirs: output of ..utils.io:calculate_directories()
+    :param config: dict generated from reading the .yml spec
+    :param job_list: list of job ids to consider; if None, all jobs are considered
+    :param rescan: if True, re-parse all logs regardless of the status cache
+    :param group_by: list of db.csv columns to group jobs by, or None
+    :param near_limit: fraction of max_job_time above which to flag runtimes
+    :param export: None, or format (csv or parquet) to save the results in, to the
+        checks directory
+    :return:
+    """
+    db = load_db(os.path.join(dirs["base"], "db.csv"))
+    missing = [col for col in (group_by or []) if col not in db.columns]
+    if len(missing) > 0:
+        raise ValueError(f"Columns not found in your database: {' '.join(missing)}")
+
+    status = get_job_status(dirs, job_list, rescan=rescan)
+    df = build_runtime_table(status, db, config, group_by, near_limit)
+    if len(df) == 0:
+        print("No successfully completed jobs with runtimes found.")
+        return
+
+    summary = summarize_runtimes(df, group_by)
+
     # print out descriptive stats! :)
-    print(runtime_df.describe(percentiles=[0.25, 0.5, 0.75, 0.90, 0.95]))
+    printable = summary.copy()
+    stats = [c for c in printable.columns if c in ("mean", "min", "max") or c[0] == "p"]
+    for col in stats:
+        printable[col] = printable[col].map(_format_seconds)
+    with pd.option_context("display.max_columns", None, "display.width", 200):
+        print(printable)
+
+    near = df.index[df["near_wall_time"]].tolist()
+    if len(near) > 0:
+        print(
+            f"\njobs within {(1 - near_limit) * 100:.0f}% of max_job_time "
+            f"({config['max_job_time']}) (n = {len(near)}):"
+        )
+        pretty_print_job_ids(["{job:05d}".format(job=job) for job in near])
+    outliers = df.index[df["outlier"]].tolist()
+    if len(outliers) > 0:
+        print(f"\njobs with outlying runtimes (n = {len(outliers)}):")
+        pretty_print_job_ids(["{job:05d}".format(job=job) for job in outliers])
+
+    suggested = suggest_time_settings(df, config)
+    print(
+        f"\njob_time in spec: {config['job_time']}; "
+        f"suggested (90th percentile): {suggested['job_time'].to_pytimedelta()}"
+    )
+    print(
+        f"max_job_time in spec: {config['max_job_time']}; "
+        f"should be at least: {suggested['min_max_job_time'].to_pytimedelta()}"
+    )
+
+    if export is not None:
+        paths = export_runtimes(df, summary, dirs["checks"], export)
+        print(f"\nFull results saved to {' and '.join(paths)}")
+
+
+def check_usage(dirs, sbatch_ids=None, slurm_ids=None, since_days=30, refresh=False):
+    """
+    Print resource usage (from sacct) for a set of sbatch jobs, and suggest memory
+    and task requests for future submissions (see ..utils.usage).
+    :param dirs: output of ..utils.io:calculate_directories()
+    :param sbatch_ids: list of sbatch ids to report on
+    :param slurm_ids: list of Slurm job ids to report on instead
+    :param since_days: how many days back to look for jobs, when looking up by name
+    :param refresh: if True, query sacct even for jobs whose usage was cached
+    :return:
+    """
+    usage = read_usage(dirs, sbatch_ids, slurm_ids, since_days, refresh)
+    if len(usage) == 0:
+        print("No accounting records found for these jobs.")
+        return
+
+    summary = summarize_usage(usage)
+    for col in ("elapsed_p50", "elapsed_max"):
+        summary[col] = summary[col].map(_format_seconds)
+    for col in ("max_rss_kb_p50", "max_rss_kb_max", "req_mem_kb"):
+        summary[col.replace("_kb", "_mb")] = (summary.pop(col) / 1024).round()
+    summary["cpu_efficiency_p50"] = summary["cpu_efficiency_p50"].round(2)
+    with pd.option_context("display.max_columns", None, "display.width", 200):
+        print(summary)
+
+    by_job = expand_by_job(usage)
+    print(f"\njobs covered by these records: {len(by_job)}")
+
+    suggested = suggest_resources(usage)
+    if suggested["memory"] is not None:
+        print(
+            f"\nsuggested --memory: {suggested['memory']} "
+            f"(peak use across completed elements, plus "
+            f"{(MEMORY_HEADROOM - 1) * 100:.0f}%)"
+        )
+    if suggested["n_tasks"] is not None:
+        print(
+            f"suggested --n-tasks: {suggested['n_tasks']} "
+            f"(most CPUs kept busy on average by a completed element)"
+        )
+
+
+def check_crosswalk(dirs, job_list=None, slurm_id=None):
+    """
+    Print which Slurm jobs (and array tasks) ran which jobs, from the crosswalk
+    recorded in the state database at submission time, including that of arrays
+    submitted by relay jobs (see ..jobs.submit).
+    :param dirs: output of ..utils.io:calculate_directories()
+    :param job_list: list of job ids to look up; if None (and no slurm_id is given),
+        all jobs are listed
+    :param slurm_id: str, a Slurm job id (e.g., 18334739), or array task
+        (18334739_117), whose jobs to list instead
+    :return: pd.DataFrame of records printed
+    """
+    from ..jobs.submit import import_relay_submissions
+
+    import_relay_submissions(dirs)
+    state_db = SlurmhelperDB(dirs)
+    if slurm_id is not None:
+        job, _, task = slurm_id.partition("_")
+        records = state_db.crosswalk(
+            slurm_job_id=int(job), array_task=int(task) if task else None
+        )
+    else:
+        records = state_db.crosswalk(order_ids=job_list)
+
+    df = pd.DataFrame(
+        records,
+        columns=[
+            "order_id",
+            "sbatch_id",
+            "array_task",
+            "slurm_job_id",
+            "spec_version",
+            "submitted_at",
+        ],
+    )
+    if len(df) == 0:
+        print("No submissions recorded for these jobs.")
+        return df
+
+    for col in ("array_task", "slurm_job_id"):
+        df[col] = df[col].astype("float").astype("Int64")
+    df["slurm_id"] = [
+        pd.NA
+        if pd.isna(job)
+        else (f"{job}" if pd.isna(task) else f"{job}_{task}")
+        for (job, task) in zip(df["slurm_job_id"], df["array_task"])
+    ]
+    df["submitted_at"] = pd.to_datetime(df["submitted_at"], unit="s").dt.floor("s")
+    df = df.drop(columns=["slurm_job_id"]).set_index("order_id")
+    with pd.option_context("display.max_rows", None, "display.width", 200):
+        print(df)
+
+    if job_list is not None:
+        missing = sorted(set(job_list) - set(df.index))
+        if len(missing) > 0:
+            print(f"\nno sbatch job recorded for: {' '.join(map(str, missing))}")
+    n_unsubmitted = df["slurm_id"].isna().sum()
+    if n_unsubmitted > 0:
+        print(
+            f"\n{n_unsubmitted} records belong to sbatch jobs with no recorded "
+            f"submission (not submitted yet, or submitted by a relay job)."
+        )
+    return df
+
+
+def check_events(dirs, job_list=None, freq="60min", export=None):
+    """
+    Summarize the event log (see ..utils.events): how many jobs went through each
+    lifecycle event, how long attempts waited in the queue and ran for, and how
+    many jobs finished over time.
+    :param dirs: output of ..utils.io:calculate_directories()
+    :param job_list: list of job ids to consider; if None, all jobs are considered
+    :param freq: pandas frequency string of the throughput time bins (e.g., 60min)
+    :param export: format (csv or parquet) to save the per-attempt timeline in, or
+        None to only print the summary
+    :return: pd.DataFrame, output of ..utils.events:job_timeline()
+    """
+    from ..jobs.submit import import_relay_submissions
+
+    import_relay_submissions(dirs)
+    events = read_events(dirs, job_list)
+    if len(events) == 0:
+        print("No events recorded for these jobs.")
+        return job_timeline(events)
+
+    print("Jobs by event (and by last event):")
+    jobs = events[events["order_id"].notna()]
+    last = jobs.groupby("order_id")["event"].last()
+    counts = pd.DataFrame(
+        {
+            "n_jobs": jobs.groupby("event")["order_id"].nunique(),
+            "n_last": last.value_counts(),
+        }
+    )
+    counts = counts.reindex([e for e in JOB_EVENTS if e in counts.index])
+    print(counts.fillna(0).astype("int64").to_string())
+
+    timeline = job_timeline(events)
+    print(f"\nAttempts: {len(timeline)}, over {timeline.index.unique(0).size} jobs")
+    durations = timeline[["queue_wait", "run_time"]].describe().drop(index="count")
+    durations = durations.apply(lambda col: pd.to_timedelta(col).dt.round("s"))
+    with pd.option_context("display.width", 200):
+        print(durations.to_string())
+
+    finished = throughput(events, freq)
+    if len(finished) > 0:
+        print(f"\nJobs finished, per {freq} (UTC):")
+        with pd.option_context("display.max_rows", None):
+            print(finished.to_string())
+
+    if export is not None:
+        path = export_table(timeline, dirs["checks"], "timeline", export)
+        print(f"\nPer-attempt timeline saved to {path}")
+    return timeline
+
+
+def check_status(dirs, config, job_list=None, rescan=False, export="csv"):
+    """
+    Build a per-job status table (log, success, runtime, output count, leftover
+    inputs and work directories; see ..utils.validation:build_status_table()), print
+    counts, and save it to the checks directory for use by other tools.
+    :param dirs: output of ..utils.io:calculate_directories()
+    :param config: dict generated from reading the .yml spec
+    :param job_list: list of job ids to consider; if None, all jobs are considered
+    :param rescan: if True, re-parse all logs regardless of the status cache, and
+        list all output directories again regardless of the output index
+    :param export: format (csv or parquet) to save the table in
+    :return: path written
+    """
+    db = load_db(os.path.join(dirs["base"], "db.csv"))
+    status = get_job_status(dirs, job_list, rescan=rescan)
+    index = OutputIndex(dirs)
+    df = build_status_table(status, db, config, dirs, index=index, force=rescan)
+
+    print(f"jobs considered: {len(df)}")
+    for col in ("has_log", "success", "outputs_ok", "has_inputs_dir", "has_work_dir"):
+        print(f"    {col}: {int(df[col].sum())}")
+
+    path = export_table(df, dirs["checks"], "status", export)
+    print(f"\nFull status table saved to {path}")
+    return path
+
+
+def update_output_index(dirs, config, job_list=None, rebuild=False):
+    """
+    Bring the index of the jobs' output directories up to date (see
+    ..utils.output_index), e.g. ahead of checks, and print what it holds.
+    :param dirs: output of ..utils.io:calculate_directories()
+    :param config: dict generated from reading the .yml spec
+    :param job_list: list of job ids to consider; if None, all jobs are considered
+    :param rebuild: if True, list all output directories again
+    :return:
+    """
+    db = load_db(os.path.join(dirs["base"], "db.csv"))
+    if job_list is None:
+        logger.warning("no job range provided, so looking at ALL the jobs.")
+    else:
+        db = db[db["order_id"].isin(job_list)]
+
+    locations = output_locations(db, config)
+    if locations is None:
+        raise ValueError("Your spec does not define an output_path to index.")
+
+    start = time.time()
+    index = OutputIndex(dirs)
+    _, entries = list_output_dirs(locations["output_dir"], index=index, force=rebuild)
+    present = [files for files in entries.values() if files is not None]
+
+    print(f"output directories: {len(entries)} ({len(present)} exist)")
+    print(f"files indexed: {sum(len(files) for files in present)}")
+    print(f"index up to date in {_format_seconds(time.time() - start)} ({index.db_file})")
+
+
+def check_checksums(
+    dirs, config, job_list=None, algorithm=None, verify=False, n_workers=None
+):
+    """
+    Update the checksum manifests of the jobs' output files (see
+    ..utils.checksums), kept in checks/checksums/<order_id>.tsv, and print a summary.
+    Only files that are new or whose size or mtime changed are hashed, unless verify.
+    :param dirs: output of ..utils.io:calculate_directories()
+    :param config: dict generated from reading the .yml spec
+    :param job_list: list of job ids to consider; if None, all jobs are considered
+    :param algorithm: hash algorithm; defaults to the fastest one available
+    :param verify: if True, hash all files again and report any whose contents
+        changed without their size or mtime changing
+    :param n_workers: number of processes used to hash files
+    :return: pd.DataFrame, output of ..utils.checksums:update_manifests()
+    """
+    if algorithm is None:
+        algorithm = available_algorithms()[0]
+
+    db = load_db(os.path.join(dirs["base"], "db.csv"))
+    if job_list is None:
+        logger.warning("no job range provided, so looking at ALL the jobs.")
+    else:
+        db = db[db["order_id"].isin(job_list)]
+
+    locations = output_locations(db, config)
+    if locations is None:
+        raise ValueError("Your spec does not define an output_path to check.")
+
+    # files are stat'ed rather than taken from the index, to see in-place changes
+    index = OutputIndex(dirs)
+    listings, _ = list_output_dirs(locations["output_dir"], index=index, force=verify)
+    files = stat_job_outputs(match_outputs(locations, listings))
+
+    start = time.time()
+    df = update_manifests(dirs["checksums"], files, algorithm, n_workers, verify)
+    print(f"jobs considered: {len(df)}")
+    print(f"output files: {df['n_files'].sum()}")
+    print(
+        f"files hashed ({algorithm}): {df['n_hashed'].sum()} "
+        f"in {_format_seconds(time.time() - start)}; "
+        f"others unchanged since last hashed"
+    )
+    print(f"files changed since last hashed: {df['n_changed'].sum()}")
+    print(f"files removed since last hashed: {df['n_removed'].sum()}")
+
+    for col, label in (
+        ("n_files", "jobs without output files"),
+        ("n_unreadable", "jobs with unreadable output files"),
+        ("n_corrupt", "jobs with files whose contents changed but not size or mtime"),
+    ):
+        ids = df.index[df[col] == 0] if col == "n_files" else df.index[df[col] > 0]
+        if len(ids) > 0:
+            print(f"\n{label} (n = {len(ids)}):")
+            pretty_print_job_ids(["{job:05d}".format(job=job) for job in ids])
+
+    print(f"\nManifests saved to {dirs['checksums']}")
+    return df
 
 
 def check_runs(job_list, dirs, args, config):
     """
     Conducts various checks on a given set of jobs, as defined in the
-    job class.
+    job class (run for all jobs at once; see ..utils.validation:validate_jobs()),
+    plus any tests declared in the spec (see ..utils.job_tests).
     :param job_list: list of jobs to check
     :param dirs: directory dictionary, as produced by .io:compute_directories()
     :param args: args from the arg parser
     :param config: config parameter dictionary
     :return:
     """
-    from ..jobs.classes import TestableJob
+    if job_list is None:
+        logger.warning("no job range provided, so looking at ALL the jobs.")
+        job_list = load_db(os.path.join(dirs["base"], "db.csv"))["order_id"].tolist()
 
     if len(job_list) < 1:
         raise ValueError("Job list length should be greater than 0")
@@ -347,28 +993,32 @@ def check_runs(job_list, dirs, args, config):
     if db_filepath.exists():
         db = pd.read_csv(db_filepath)
     else:
-        raise (
-            FileNotFoundError,
-            "Database file db.csv is missing from your working directory!",
+        raise FileNotFoundError(
+            "Database file db.csv is missing from your working directory!"
         )
-    db.sort_values("order_id")  # ensure they're sorted properly
 
-    # calculate a globbing expression to check for outputs
-    sfmt_glob = config["output_path_subject_expr"].format
-    db["glob_output_expr"] = db.apply(lambda x: sfmt_glob(**x), 1)
-
-    sfmt_dir = os.path.join(
-        config["output_path"], *config["output_path_subject"]
-    ).format
-    db["output_dir"] = db.apply(lambda x: sfmt_dir(**x), 1)
-
-    job_tests = [TestableJob(db, dirs, job, config) for job in job_list]
-    rows = [job_test.get_results_dict() for job_test in job_tests]
-    out_db = pd.DataFrame.from_records(rows)
-    out_db.sort_values("order_id")
+    rescan = getattr(args, "rescan", False)
+    tests = parse_job_tests(config)
+    test_cache = JobTestCache(dirs)
+    if rescan:
+        test_cache.discard(job_list)
+
+    status = get_job_status(dirs, sorted(job_list), rescan=rescan)
+    index = OutputIndex(dirs)
+    out_db, timings = validate_jobs(
+        db,
+        config,
+        dirs,
+        status,
+        tests=tests,
+        test_cache=test_cache,
+        index=index,
+        force=rescan,
+    )
+    out_db = out_db.reset_index()
 
     valid = out_db.loc[out_db["valid"], "order_id"].values.tolist()
-    not_valid = out_db.loc[out_db["valid"] is False, "order_id"].values.tolist()
+    not_valid = out_db.loc[~out_db["valid"], "order_id"].values.tolist()
 
     if len(valid) > 0:
         print("{num} valid jobs found.".format(num=len(valid)))
@@ -385,6 +1035,10 @@ def check_runs(job_list, dirs, args, config):
     else:
         print("No flagged/invalid jobs! YAY :)")
 
+    if timings is not None and args.verbose:
+        print("\nspec-declared tests:")
+        print(timings.to_string(index=False))
+
     filename = "check_{timestamp}.csv".format(timestamp=time.strftime("%Y%m%d-%H%M%S"))
     out_file_path = os.path.join(dirs["checks"], filename)
     out_db.to_csv(out_file_path, index=False)
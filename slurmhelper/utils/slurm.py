@@ -0,0 +1,455 @@
+"""
+Helpers for talking to (and working around the limits of) the SLURM scheduler itself.
+"""
+
+import glob
+import logging
+import math
+import os
+import re
+import subprocess
+
+import pandas as pd
+
+logger = logging.getLogger("cli")
+
+# Slurm's documented default for MaxArraySize, used if nothing else is known.
+DEFAULT_MAX_ARRAY_SIZE = 1001
+
+# prep-array numbers array elements starting at this index (sb-####-100.sh, ...)
+ARRAY_START_INDEX = 100
+
+# job names given to sbatch jobs (sb-####) and to the relay jobs chaining arrays
+# (sb-####-relay); see ..jobs.cli_helpers
+SBATCH_JOB_NAME = re.compile(r"^sb-(\d{4})(?:-relay)?$")
+_JOB_SCRIPT = re.compile(r"(\d+)_run\.sh")
+# array element scripts, sb-<sbatch id>-<array task>.sh; tasks past 999 get 4 digits
+_ELEMENT_SCRIPT = re.compile(r"^sb-\d{4}-(\d{3,})\.sh$")
+
+
+def parse_scontrol_config(text):
+    """
+    Parse the output of ``scontrol show config`` into a dictionary.
+    :param text: str, raw output of ``scontrol show config``
+    :return: dict, mapping each parameter name to its (string) value
+    """
+    rv = dict()
+    for line in text.splitlines():
+        if "=" not in line:
+            continue  # header lines, e.g. 'Configuration data as of ...'
+        key, value = line.split("=", 1)
+        rv[key.strip()] = value.strip()
+    return rv
+
+
+def read_scheduler_limits():
+    """
+    Read scheduler limits relevant to array sizing from ``scontrol show config``.
+
+    NB: MaxSubmitJobs is a QOS/association limit, and is not reported by scontrol;
+    please set it in your spec (scheduler_limits: max_submit_jobs) if it applies to you.
+
+    :return: dict with the limits that could be determined (possibly empty)
+    """
+    try:
+        out = subprocess.check_output(
+            ["scontrol", "show", "config"], encoding="UTF-8"
+        )
+    except (OSError, subprocess.CalledProcessError) as err:
+        logger.warning(f"Could not read scheduler limits from scontrol: {err}")
+        return dict()
+
+    conf = parse_scontrol_config(out)
+    rv = dict()
+    if conf.get("MaxArraySize", "").isdigit():
+        rv["max_array_size"] = int(conf["MaxArraySize"])
+    return rv
+
+
+def get_scheduler_limits(config, auto=False):
+    """
+    Compile the scheduler limits to respect when sizing arrays. Limits are read
+    from the ``scheduler_limits`` section of your spec, if any, and (optionally)
+    overridden by values read from ``scontrol show config``.
+    :param config: dict, output of load_job_spec()
+    :param auto: bool, whether to query scontrol for limits
+    :return: dict with keys max_array_size (int) and max_submit_jobs (int or None)
+    """
+    limits = {"max_array_size": DEFAULT_MAX_ARRAY_SIZE, "max_submit_jobs": None}
+    limits.update(config.get("scheduler_limits", dict()) or dict())
+    if auto:
+        limits.update(read_scheduler_limits())
+
+    if limits["max_array_size"] <= ARRAY_START_INDEX:
+        raise ValueError(
+            f"MaxArraySize ({limits['max_array_size']}) is too small for arrays indexed "
+            f"from {ARRAY_START_INDEX}."
+        )
+    if limits["max_submit_jobs"] is not None and limits["max_submit_jobs"] < 3:
+        raise ValueError(
+            "max_submit_jobs should allow at least 3 jobs in the queue at a time."
+        )
+
+    logger.info(f"Scheduler limits in use: {limits}")
+    return limits
+
+
+def plan_array_chunks(n_parcels, limits, rate_limit=None):
+    """
+    Figure out how to split a set of parcels into one or more sbatch arrays that
+    respect the scheduler limits.
+
+    Arrays are indexed from ARRAY_START_INDEX, so a single array can hold at most
+    (MaxArraySize - ARRAY_START_INDEX) elements. If all parcels fit in the queue at
+    once (i.e., MaxSubmitJobs is not binding), chunks are independent and can run
+    concurrently, and the rate limit (if any) is shared between them. Otherwise,
+    chunks are chained: each one is submitted by a small relay job once the previous
+    one is done, so they should leave room for 2 extra jobs in the queue. Chunks are
+    chained too if the rate limit is too low to be shared between them.
+
+    Chunks are balanced in size, to keep the critical path (and thus makespan) short.
+
+    :param n_parcels: int, total number of array elements wanted
+    :param limits: dict, output of get_scheduler_limits()
+    :param rate_limit: int or None, max number of concurrently running elements
+    :return: dict with keys 'sizes' (list of chunk sizes), 'chained' (bool) and
+             'throttle' (int or None, the % throttle to apply to each chunk)
+    """
+    cap = limits["max_array_size"] - ARRAY_START_INDEX
+    max_submit = limits["max_submit_jobs"]
+
+    chained = max_submit is not None and n_parcels > max_submit
+    if chained:
+        cap = min(cap, max_submit - 2)  # leave room for the relay jobs
+
+    n_chunks = math.ceil(n_parcels / cap)
+    sizes = [
+        (i + 1) * n_parcels // n_chunks - i * n_parcels // n_chunks
+        for i in range(n_chunks)
+    ]
+
+    throttle = rate_limit
+    if rate_limit is not None and not chained and n_chunks > 1:
+        if rate_limit < n_chunks:
+            # running even one element per chunk at once would exceed the limit, so
+            # run the chunks one after the other, each with the full rate limit
+            chained = True
+        else:
+            # concurrent chunks share the rate limit
+            throttle = rate_limit // n_chunks
+
+    return {"sizes": sizes, "chained": chained, "throttle": throttle}
+
+
+# fields requested from sacct, in this order (see read_sacct())
+SACCT_FIELDS = (
+    "JobID",
+    "JobName",
+    "State",
+    "ExitCode",
+    "Elapsed",
+    "TotalCPU",
+    "MaxRSS",
+    "ReqMem",
+    "AllocCPUS",
+    "NodeList",
+)
+
+# job states that are final, i.e., accounting info will not change anymore
+TERMINAL_STATES = {
+    "BOOT_FAIL",
+    "CANCELLED",
+    "COMPLETED",
+    "DEADLINE",
+    "FAILED",
+    "NODE_FAIL",
+    "OUT_OF_MEMORY",
+    "PREEMPTED",
+    "TIMEOUT",
+}
+
+_MEMORY_UNITS = {"": 1 / 1024, "K": 1, "M": 1024, "G": 1024**2, "T": 1024**3}
+
+
+def parse_slurm_duration(text):
+    """
+    Parse a duration as formatted by Slurm ([DD-[HH:]]MM:SS[.mmm]).
+    :param text: str, e.g. '1-02:03:04', '02:03:04' or '03:04.567'
+    :return: float, seconds (None if empty or not a duration, e.g. 'UNLIMITED')
+    """
+    text = text.strip()
+    days = 0
+    if "-" in text:
+        days, text = text.split("-", 1)
+        if not days.isdigit():
+            return None
+        days = int(days)
+    try:
+        parts = [float(p) for p in text.split(":")]
+    except ValueError:
+        return None
+    if not 2 <= len(parts) <= 3:
+        return None
+    seconds = 0.0
+    for p in parts:
+        seconds = seconds * 60 + p
+    return days * 86400 + seconds
+
+
+def parse_slurm_memory(text):
+    """
+    Parse an amount of memory as formatted by Slurm (e.g., MaxRSS or ReqMem).
+    Numbers without a unit are taken to be bytes. The per-cpu/per-node suffixes
+    used for ReqMem by older Slurm versions (e.g., 4000Mc) are ignored.
+    :param text: str, e.g. '123456K', '1.50G', '4000Mn'
+    :return: int, KB (None if empty)
+    """
+    text = text.strip().rstrip("cn")
+    if text == "":
+        return None
+    unit = text[-1].upper() if text[-1].isalpha() else ""
+    if unit not in _MEMORY_UNITS:
+        return None
+    try:
+        return int(round(float(text[: len(text) - len(unit)]) * _MEMORY_UNITS[unit]))
+    except ValueError:
+        return None
+
+
+def _max_or_none(*values):
+    values = [v for v in values if v is not None]
+    return max(values) if len(values) > 0 else None
+
+
+def parse_sacct(text):
+    """
+    Parse the output of ``sacct --parsable2 --format=<SACCT_FIELDS>`` (with its
+    header). Job steps (e.g., 123_101.batch) are folded into the allocation they
+    belong to: MaxRSS is the largest over steps; other fields are taken from the
+    allocation itself. Array ranges still pending (e.g., 123_[105-200]) are skipped.
+    :param text: str, raw output of sacct
+    :return: list of dicts, one for each allocation, with keys slurm_id (str, e.g.
+        '123_101'), slurm_job_id (int, e.g. 123), array_task (int or None),
+        job_name, state, exit_code, elapsed and total_cpu (seconds), max_rss_kb,
+        req_mem_kb, alloc_cpus and node_list
+    """
+    lines = text.splitlines()
+    if len(lines) == 0:
+        return []
+    fields = lines[0].split("|")
+
+    rv = dict()
+    for line in lines[1:]:
+        if line.strip() == "":
+            continue
+        row = dict(zip(fields, line.split("|")))
+        slurm_id, _, step = row["JobID"].partition(".")
+        base, _, task = slurm_id.partition("_")
+        if not base.isdigit() or (task != "" and not task.isdigit()):
+            continue
+        max_rss = parse_slurm_memory(row.get("MaxRSS", ""))
+
+        if step != "":  # a step of an allocation listed earlier
+            if slurm_id in rv:
+                rv[slurm_id]["max_rss_kb"] = _max_or_none(
+                    rv[slurm_id]["max_rss_kb"], max_rss
+                )
+            continue
+
+        exit_code = row.get("ExitCode", "").split(":")[0]
+        alloc_cpus = row.get("AllocCPUS", "")
+        rv[slurm_id] = {
+            "slurm_id": slurm_id,
+            "slurm_job_id": int(base),
+            "array_task": int(task) if task != "" else None,
+            "job_name": row.get("JobName", ""),
+            "state": row.get("State", "").split(" ")[0],
+            "exit_code": int(exit_code) if exit_code.isdigit() else None,
+            "elapsed": parse_slurm_duration(row.get("Elapsed", "")),
+            "total_cpu": parse_slurm_duration(row.get("TotalCPU", "")),
+            "max_rss_kb": max_rss,
+            "req_mem_kb": parse_slurm_memory(row.get("ReqMem", "")),
+            "alloc_cpus": int(alloc_cpus) if alloc_cpus.isdigit() else None,
+            "node_list": row.get("NodeList", ""),
+        }
+
+    return list(rv.values())
+
+
+def read_sacct(slurm_ids=None, job_names=None, start_time=None):
+    """
+    Query sacct, in a single call, for accounting info on a set of Slurm jobs.
+    :param slurm_ids: list of Slurm job ids to query (e.g., 18334739)
+    :param job_names: list of job names to query (e.g., sb-0001), used if slurm_ids
+        is None
+    :param start_time: str, only consider jobs since then (e.g. 2022-03-01); sacct
+        defaults to the start of the current day when querying by name
+    :return: list of dicts, output of parse_sacct()
+    """
+    cmd = ["sacct", "--parsable2", f"--format={','.join(SACCT_FIELDS)}"]
+    if slurm_ids is not None:
+        cmd.append(f"--jobs={','.join(str(i) for i in slurm_ids)}")
+    elif job_names is not None:
+        cmd.append(f"--name={','.join(job_names)}")
+    else:
+        raise ValueError("Please provide either Slurm job ids or job names to query.")
+    if start_time is not None:
+        cmd.append(f"--starttime={start_time}")
+
+    logger.debug(f"Running: {' '.join(cmd)}")
+    out = subprocess.check_output(cmd, encoding="UTF-8")
+    return parse_sacct(out)
+
+
+# fields requested from squeue, in this order (see read_squeue()); the reason goes
+# last, since it is free text
+SQUEUE_FIELDS = (
+    ("slurm_id", "%i"),
+    ("array_job_id", "%F"),
+    ("array_task", "%K"),
+    ("job_name", "%j"),
+    ("state", "%T"),
+    ("time_used", "%M"),
+    ("time_limit", "%l"),
+    ("nodes", "%D"),
+    ("reason", "%R"),
+)
+SQUEUE_DELIMITER = "|"
+
+
+def parse_squeue(text):
+    """
+    Parse the output of ``squeue --noheader --array --format=<SQUEUE_FIELDS>``.
+    Lines that do not look like a job (e.g., a header or warning) are skipped.
+    :param text: str, raw output of squeue
+    :return: list of dicts, one for each job (or array task), with keys slurm_id
+        (str, e.g. '123_101'), slurm_job_id (int, e.g. 123), array_task (int or
+        None), job_name, state, time_used and time_limit (seconds, or None), nodes
+        (int) and reason (or node list, for running jobs)
+    """
+    n_fields = len(SQUEUE_FIELDS)
+    rv = []
+    for line in text.splitlines():
+        values = line.split(SQUEUE_DELIMITER, n_fields - 1)
+        if len(values) != n_fields:
+            continue
+        row = dict(zip([name for (name, _) in SQUEUE_FIELDS], values))
+        array_job_id = row["array_job_id"].strip()
+        if not array_job_id.isdigit():
+            logger.debug(f"Skipping unexpected squeue line: {line}")
+            continue
+        task = row["array_task"].strip()
+        nodes = row["nodes"].strip()
+        rv.append(
+            {
+                "slurm_id": row["slurm_id"].strip(),
+                "slurm_job_id": int(array_job_id),
+                "array_task": int(task) if task.isdigit() else None,
+                "job_name": row["job_name"].strip(),
+                "state": row["state"].strip(),
+                "time_used": parse_slurm_duration(row["time_used"]),
+                "time_limit": parse_slurm_duration(row["time_limit"]),
+                "nodes": int(nodes) if nodes.isdigit() else None,
+                "reason": row["reason"].strip(),
+            }
+        )
+    return rv
+
+
+def read_squeue(user=None):
+    """
+    Query squeue, in a single call, for all jobs of a user (array tasks listed one
+    per line).
+    :param user: user name; defaults to $USER
+    :return: list of dicts, output of parse_squeue()
+    """
+    if user is None:
+        user = os.environ["USER"]
+    fmt = SQUEUE_DELIMITER.join([code for (_, code) in SQUEUE_FIELDS])
+    cmd = ["squeue", "--noheader", "--array", f"--user={user}", f"--format={fmt}"]
+
+    logger.debug(f"Running: {' '.join(cmd)}")
+    out = subprocess.check_output(cmd, encoding="UTF-8")
+    return parse_squeue(out)
+
+
+def jobs_in_wrapper(script_path):
+    """
+    List the jobs run by an sbatch wrapper (or array element) script.
+    :param script_path: path to sb-####.sh or sb-####-###.sh
+    :return: list of job ids (ints), in the order they are run
+    """
+    with open(script_path, "r") as f:
+        found = _JOB_SCRIPT.findall(f.read())
+    return list(dict.fromkeys(int(job) for job in found))
+
+
+def wrapper_jobs(dirs, sbatch_id):
+    """
+    Map the elements of an sbatch job to the jobs they run.
+    :param dirs: output of ..utils.io:calculate_directories()
+    :param sbatch_id: int
+    :return: dict, mapping array task ids (None for a non-array sbatch job) to lists
+        of job ids; empty if the sbatch scripts are not found
+    """
+    pattern = os.path.join(dirs["slurm_scripts"], f"sb-{sbatch_id:04d}-*.sh")
+    elements = dict()
+    for path in glob.glob(pattern):
+        match = _ELEMENT_SCRIPT.match(os.path.basename(path))
+        if match:
+            elements[int(match.group(1))] = path
+    if len(elements) > 0:
+        return {task: jobs_in_wrapper(elements[task]) for task in sorted(elements)}
+    script = os.path.join(dirs["slurm_scripts"], f"sb-{sbatch_id:04d}.sh")
+    if os.path.exists(script):
+        return {None: jobs_in_wrapper(script)}
+    return dict()
+
+
+def attach_job_ids(df, dirs):
+    """
+    Map Slurm jobs back to our sbatch ids and job ids, using their job names and the
+    sbatch scripts in the working directory (see wrapper_jobs()).
+    :param df: pd.DataFrame with job_name and array_task columns (e.g., from
+        parse_sacct() or parse_squeue() records)
+    :param dirs: output of ..utils.io:calculate_directories()
+    :return: copy of df, with array_task as Int64, and added columns sbatch_id
+        (Int64; NA for jobs not submitted by slurmhelper), is_relay (bool) and
+        order_ids (list of job ids run by each Slurm job)
+    """
+    df = df.copy()
+    df["array_task"] = df["array_task"].astype("float").astype("Int64")
+    df["sbatch_id"] = (
+        df["job_name"]
+        .str.extract(SBATCH_JOB_NAME.pattern, expand=False)
+        .astype("float")
+        .astype("Int64")
+    )
+    df["is_relay"] = df["job_name"].str.endswith("-relay")
+
+    jobs = {
+        sb_id: wrapper_jobs(dirs, int(sb_id))
+        for sb_id in df["sbatch_id"].dropna().unique()
+    }
+    df["order_ids"] = [
+        []
+        if pd.isna(sb_id) or relay
+        else jobs[sb_id].get(None if pd.isna(task) else int(task), [])
+        for (sb_id, task, relay) in zip(
+            df["sbatch_id"], df["array_task"], df["is_relay"]
+        )
+    ]
+    return df
+
+
+def expand_by_job(df):
+    """
+    Expand a table of Slurm jobs (see attach_job_ids()) to one row per job id. Jobs
+    run by the same Slurm job (or array task) share its row.
+    :param df: pd.DataFrame with an order_ids column
+    :return: pd.DataFrame indexed by order_id
+    """
+    df = df.explode("order_ids").rename(columns={"order_ids": "order_id"})
+    df = df[df["order_id"].notna()].copy()
+    df["order_id"] = df["order_id"].astype("int64")
+    return df.set_index("order_id").sort_index()
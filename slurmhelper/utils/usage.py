@@ -0,0 +1,227 @@
+"""
+Resource usage of submitted sbatch jobs, from Slurm's accounting (sacct), mapped back
+to sbatch ids and job ids, to help right-size memory and task requests.
+"""
+
+import datetime
+import logging
+import math
+
+import pandas as pd
+
+from ..db import StateCache
+from .slurm import (
+    SBATCH_JOB_NAME,
+    TERMINAL_STATES,
+    attach_job_ids,
+    read_sacct,
+    wrapper_jobs,
+)
+
+logger = logging.getLogger("cli")
+
+# extra room to leave on top of the peak memory use observed, when suggesting --memory
+MEMORY_HEADROOM = 1.2
+
+class UsageCache(StateCache):
+    """
+    Cache of sacct records (see ..utils.slurm:parse_sacct()), keyed by Slurm id,
+    kept in the project's state store. Only records of finished jobs are stored, as
+    they will not change.
+    """
+
+    NAME = "sacct_usage"
+
+    FIELDS = (
+        "slurm_id",
+        "slurm_job_id",
+        "array_task",
+        "job_name",
+        "state",
+        "exit_code",
+        "elapsed",
+        "total_cpu",
+        "max_rss_kb",
+        "req_mem_kb",
+        "alloc_cpus",
+        "node_list",
+    )
+
+    TABLES = {
+        "sacct_usage": "slurm_id TEXT PRIMARY KEY, slurm_job_id INTEGER, "
+        "array_task INTEGER, job_name TEXT, state TEXT, exit_code INTEGER, "
+        "elapsed REAL, total_cpu REAL, max_rss_kb INTEGER, req_mem_kb INTEGER, "
+        "alloc_cpus INTEGER, node_list TEXT"
+    }
+
+    def load(self, job_names=None, slurm_job_ids=None):
+        """
+        Retrieve cached records, by job name or Slurm job id.
+        :param job_names: list of job names (e.g., sb-0001), or None
+        :param slurm_job_ids: list of Slurm job ids, or None
+        :return: list of dicts
+        """
+        fields = ", ".join(f"u.{field}" for field in self.FIELDS)
+        with self._transaction() as con:
+            if job_names is not None:
+                rows = self._select(
+                    con,
+                    f"SELECT {fields} FROM sacct_usage u "
+                    f"JOIN wanted w ON u.job_name = w.value",
+                    job_names,
+                )
+            else:
+                rows = con.execute(f"SELECT {fields} FROM sacct_usage u")
+            rows = [dict(zip(self.FIELDS, row)) for row in rows]
+        if slurm_job_ids is not None:
+            slurm_job_ids = set(slurm_job_ids)
+            rows = [r for r in rows if r["slurm_job_id"] in slurm_job_ids]
+        return rows
+
+    def store(self, records):
+        """
+        Add or update records of finished jobs; other records are ignored.
+        :param records: list of dicts, output of ..utils.slurm:parse_sacct()
+        :return:
+        """
+        with self._transaction() as con:
+            con.executemany(
+                f"INSERT OR REPLACE INTO sacct_usage VALUES "
+                f"(?{', ?' * (len(self.FIELDS) - 1)})",
+                [
+                    tuple(r[field] for field in self.FIELDS)
+                    for r in records
+                    if r["state"] in TERMINAL_STATES
+                ],
+            )
+
+
+def _is_complete(records, tasks):
+    """
+    Whether cached records cover all elements of an sbatch job, and are final.
+    """
+    done = {r["array_task"] for r in records if r["state"] in TERMINAL_STATES}
+    return len(tasks) > 0 and set(tasks).issubset(done)
+
+
+def read_usage(dirs, sbatch_ids=None, slurm_ids=None, since_days=30, refresh=False):
+    """
+    Gather resource usage for a set of sbatch jobs from sacct, in a single call.
+    Records of finished jobs are cached in the state store, so that sbatch
+    jobs whose elements are all finished are not queried again.
+    :param dirs: output of ..utils.io:calculate_directories()
+    :param sbatch_ids: list of sbatch ids to look up, by job name (sb-####)
+    :param slurm_ids: list of Slurm job ids to look up instead
+    :param since_days: how many days back to look for jobs, when looking up by name
+    :param refresh: if True, ignore the cache
+    :return: pd.DataFrame with one row per Slurm allocation (see
+        ..utils.slurm:parse_sacct()), plus sbatch_id and order_ids (list of job ids
+        run by that allocation) columns; if an sbatch job (element) was submitted
+        more than once, only its latest submission is kept
+    """
+    cache = UsageCache(dirs)
+
+    if sbatch_ids is not None:
+        names = [f"sb-{sb_id:04d}" for sb_id in sbatch_ids]
+        cached = [] if refresh else cache.load(job_names=names)
+        complete = [
+            name
+            for (name, sb_id) in zip(names, sbatch_ids)
+            if _is_complete(
+                [r for r in cached if r["job_name"] == name], wrapper_jobs(dirs, sb_id)
+            )
+        ]
+        wanted = [name for name in names if name not in complete]
+        records = [r for r in cached if r["job_name"] in complete]
+        if len(wanted) > 0:
+            since = datetime.date.today() - datetime.timedelta(days=since_days)
+            records += read_sacct(job_names=wanted, start_time=since.isoformat())
+    elif slurm_ids is not None:
+        cached = [] if refresh else cache.load(slurm_job_ids=slurm_ids)
+        complete = {
+            r["slurm_job_id"]
+            for r in cached
+            if r["array_task"] is None and r["state"] in TERMINAL_STATES
+        }
+        # arrays may have elements that are not cached yet; only trust complete ones
+        for slurm_id in {r["slurm_job_id"] for r in cached} - complete:
+            records = [r for r in cached if r["slurm_job_id"] == slurm_id]
+            match = SBATCH_JOB_NAME.match(records[0]["job_name"])
+            if match and _is_complete(records, wrapper_jobs(dirs, int(match.group(1)))):
+                complete.add(slurm_id)
+        wanted = [i for i in slurm_ids if i not in complete]
+        records = [r for r in cached if r["slurm_job_id"] in complete]
+        if len(wanted) > 0:
+            records += read_sacct(slurm_ids=wanted)
+    else:
+        raise ValueError("Please provide either sbatch ids or Slurm job ids.")
+
+    logger.info(
+        f"{len(records)} sacct records found "
+        f"({len(wanted)} {'sbatch' if sbatch_ids is not None else 'Slurm'} "
+        f"job(s) queried, others cached)."
+    )
+    cache.store(records)
+
+    df = pd.DataFrame.from_records(records, columns=UsageCache.FIELDS)
+    for col in ("exit_code", "max_rss_kb", "req_mem_kb", "alloc_cpus"):
+        df[col] = df[col].astype("float").astype("Int64")
+
+    # keep the latest submission of each sbatch job (element)
+    df = df.sort_values("slurm_job_id").drop_duplicates(
+        ["job_name", "array_task"], keep="last"
+    )
+    df = attach_job_ids(df, dirs)
+    return df.sort_values(["sbatch_id", "array_task"]).reset_index(drop=True)
+
+
+def summarize_usage(usage):
+    """
+    Summarize a usage table (see read_usage()) by sbatch id.
+    :param usage: pd.DataFrame, output of read_usage()
+    :return: pd.DataFrame, one row per sbatch id, with counts of elements by state,
+        elapsed time (seconds), peak memory (KB) and CPU efficiency (TotalCPU over
+        Elapsed times AllocCPUS) statistics
+    """
+    df = usage.copy()
+    df["cpu_efficiency"] = df["total_cpu"] / (
+        df["elapsed"] * df["alloc_cpus"].astype("float")
+    )
+    grouped = df.groupby("job_name")
+    states = pd.crosstab(df["job_name"], df["state"])
+    return pd.concat(
+        [
+            grouped["slurm_id"].count().rename("n_elements"),
+            states,
+            grouped["elapsed"].median().rename("elapsed_p50"),
+            grouped["elapsed"].max().rename("elapsed_max"),
+            grouped["max_rss_kb"].median().rename("max_rss_kb_p50"),
+            grouped["max_rss_kb"].max().rename("max_rss_kb_max"),
+            grouped["req_mem_kb"].max().rename("req_mem_kb"),
+            grouped["cpu_efficiency"].median().rename("cpu_efficiency_p50"),
+        ],
+        axis=1,
+    )
+
+
+def suggest_resources(usage, headroom=MEMORY_HEADROOM):
+    """
+    Suggest --memory and --n-tasks values for prep / prep-array, from the peak
+    memory and CPU use of completed allocations.
+    :param usage: pd.DataFrame, output of read_usage()
+    :param headroom: factor to apply on top of the peak memory use observed
+    :return: dict with memory (int, MB; None if unknown) and n_tasks (int; None if
+        unknown)
+    """
+    done = usage[usage["state"] == "COMPLETED"]
+    rv = {"memory": None, "n_tasks": None}
+
+    peak = done["max_rss_kb"].max()
+    if not pd.isna(peak):
+        rv["memory"] = math.ceil(peak * headroom / 1024)
+
+    busy = (done["total_cpu"] / done["elapsed"]).replace(float("inf"), float("nan"))
+    if busy.notna().any():
+        rv["n_tasks"] = max(1, math.ceil(busy.max()))
+
+    return rv
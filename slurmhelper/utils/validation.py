@@ -0,0 +1,402 @@
+"""
+Batch checks on job outputs and leftovers (inputs, work dirs), done in one pass over
+the filesystem rather than one glob per job.
+"""
+
+import bisect
+import fnmatch
+import functools
+import logging
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from string import Formatter
+
+import numpy as np
+import pandas as pd
+
+from .job_tests import OutputFile, run_job_tests
+from .logs import N_WORKERS
+from .output_index import refresh_output_index
+
+logger = logging.getLogger("cli")
+
+_WILDCARDS = re.compile(r"[*?\[]")
+
+
+def _format_all(template, db):
+    """
+    Fill in a str.format template for each row of a table, using only the columns it
+    needs.
+    """
+    fields = list({f[1] for f in Formatter().parse(template) if f[1]})
+    if len(fields) == 0:
+        return [template] * len(db)
+    fmt = template.format
+    columns = [db[field].tolist() for field in fields]
+    return [fmt(**dict(zip(fields, values))) for values in zip(*columns)]
+
+
+def output_locations(db, config):
+    """
+    Compute where each job's outputs should be, from the output_path,
+    output_path_subject and output_path_subject_expr entries of the spec.
+    :param db: pd.DataFrame, job database (db.csv)
+    :param config: dict generated from reading the .yml spec
+    :return: pd.DataFrame indexed by order_id, with columns output_dir and
+        output_expr (file name pattern; '*' if the spec has no
+        output_path_subject_expr); None if the spec has no output_path
+    """
+    if "output_path" not in config:
+        return None
+
+    base = os.path.expanduser(config["output_path"])
+    if "output_path_subject" in config:
+        subdir = os.path.join(*config["output_path_subject"])
+        output_dir = [os.path.join(base, d) for d in _format_all(subdir, db)]
+    else:
+        output_dir = [base] * len(db)
+
+    if "output_path_subject_expr" in config:
+        output_expr = _format_all(config["output_path_subject_expr"], db)
+    else:
+        output_expr = ["*"] * len(db)
+
+    return pd.DataFrame(
+        {"output_dir": output_dir, "output_expr": output_expr},
+        index=pd.Index(db["order_id"], name="order_id", dtype="int64"),
+    )
+
+
+def _sorted_listdir(path):
+    try:
+        with os.scandir(path) as entries:
+            return sorted(entry.name for entry in entries)
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+
+
+def list_dirs(paths, n_workers=N_WORKERS):
+    """
+    List the contents of a set of directories, each once, in parallel.
+    :param paths: iterable of directory paths (duplicates are listed once)
+    :param n_workers: number of threads to use
+    :return: dict, mapping each path to a sorted list of names (None if the
+        directory does not exist)
+    """
+    paths = list(dict.fromkeys(paths))
+    with ThreadPoolExecutor(max_workers=n_workers) as pool:
+        return dict(zip(paths, pool.map(_sorted_listdir, paths)))
+
+
+def list_output_dirs(paths, n_workers=N_WORKERS, index=None, force=False):
+    """
+    List output directories, through an index of their contents if provided (see
+    ..utils.output_index), or directly otherwise.
+    :param paths: iterable of directory paths
+    :param n_workers: number of threads to use
+    :param index: ..utils.output_index:OutputIndex object, or None
+    :param force: if True, list all directories again rather than trust the index
+    :return: tuple, (output of list_dirs(); dict mapping paths to lists of
+        ..utils.output_index:IndexedFile tuples, or None if no index was used)
+    """
+    if index is None:
+        listings = list_dirs(paths, n_workers)
+        logger.info(f"Listed {len(listings)} output directories.")
+        return listings, None
+
+    entries = refresh_output_index(index, paths, n_workers, force=force)
+    listings = {
+        d: None if files is None else [f.name for f in files]
+        for (d, files) in entries.items()
+    }
+    return listings, entries
+
+
+@functools.lru_cache(maxsize=1024)
+def _compile_pattern(pattern):
+    return re.compile(fnmatch.translate(pattern)).match
+
+
+def match_names(names, pattern):
+    """
+    Find the names matching a shell-style pattern (as in glob; hidden files only
+    match patterns starting with a dot). Only names sharing the pattern's literal
+    prefix are tested, found by bisection since names are sorted; the rest of the
+    pattern (e.g., *.nii.gz), usually the same for all jobs, is compiled once.
+    :param names: sorted list of file names
+    :param pattern: shell-style pattern (e.g., sub-01_ses-1_*)
+    :return: list of matching names
+    """
+    prefix = _WILDCARDS.split(pattern, 1)[0]
+    lo = bisect.bisect_left(names, prefix)
+    hi = bisect.bisect_left(names, prefix + "\U0010ffff", lo)
+    if prefix == pattern:
+        return [pattern] if lo < hi and names[lo] == pattern else []
+
+    match = _compile_pattern(pattern[len(prefix) :])
+    n = len(prefix)
+    hidden_ok = pattern.startswith(".")
+    return [
+        name
+        for name in names[lo:hi]
+        if match(name[n:]) and (hidden_ok or not name.startswith("."))
+    ]
+
+
+def count_matches(names, pattern):
+    """
+    Count the names matching a shell-style pattern (see match_names()).
+    :param names: sorted list of file names
+    :param pattern: shell-style pattern (e.g., sub-01_ses-1_*)
+    :return: int
+    """
+    return len(match_names(names, pattern))
+
+
+def count_outputs(locations, n_workers=N_WORKERS, listings=None):
+    """
+    Count the output files of each job (see output_locations()), listing each
+    distinct output directory once.
+    :param locations: pd.DataFrame, output of output_locations()
+    :param n_workers: number of threads to use
+    :param listings: output of list_dirs() for the output directories, if already
+        listed
+    :return: pd.DataFrame indexed by order_id, with columns output_dir_exists (bool)
+        and n_outputs (Int64; NA if the output directory does not exist)
+    """
+    if listings is None:
+        listings = list_dirs(locations["output_dir"], n_workers)
+        logger.info(f"Listed {len(listings)} output directories.")
+
+    exists = [listings[d] is not None for d in locations["output_dir"]]
+    counts = [
+        count_matches(listings[d], expr) if listings[d] is not None else None
+        for (d, expr) in zip(locations["output_dir"], locations["output_expr"])
+    ]
+    return pd.DataFrame(
+        {
+            "output_dir_exists": exists,
+            "n_outputs": pd.array(counts, dtype="Int64"),
+        },
+        index=locations.index,
+    )
+
+
+def match_outputs(locations, listings, entries=None):
+    """
+    Find the output files of each job (see output_locations()).
+    :param locations: pd.DataFrame, output of output_locations()
+    :param listings: output of list_dirs() for the output directories
+    :param entries: dict mapping output directories to their indexed entries (see
+        list_output_dirs()), or None
+    :return: dict, mapping job ids to lists of paths, or of
+        ..utils.job_tests:OutputFile tuples if entries were provided
+    """
+    rv = dict()
+    by_dir = dict()
+    for (job, d, expr) in zip(
+        locations.index, locations["output_dir"], locations["output_expr"]
+    ):
+        names = match_names(listings[d] or [], expr)
+        if entries is None:
+            rv[job] = [os.path.join(d, name) for name in names]
+        else:
+            if d not in by_dir:
+                by_dir[d] = {f.name: f for f in entries[d] or []}
+            by_name = by_dir[d]
+            rv[job] = [
+                OutputFile(os.path.join(d, f.name), f.size, f.mtime)
+                for f in (by_name[name] for name in names)
+            ]
+    return rv
+
+
+def job_dirs_present(parent, job_ids):
+    """
+    Check which jobs have a directory (<job_id>) under a parent directory (e.g.,
+    inputs or work), with a single listing.
+    :param parent: path to parent directory
+    :param job_ids: list of job ids
+    :return: pd.Series of bools, indexed by order_id
+    """
+    names = set(_sorted_listdir(parent) or [])
+    return pd.Series(
+        ["{job:05d}".format(job=job) in names for job in job_ids],
+        index=pd.Index(job_ids, name="order_id", dtype="int64"),
+        dtype=bool,
+    )
+
+
+STATUS_EXPORT_COLUMNS = (
+    "has_log",
+    "success",
+    "exit_code",
+    "runtime",
+    "host",
+    "max_rss_kb",
+    "cause",
+    "output_dir_exists",
+    "n_outputs",
+    "outputs_ok",
+    "has_inputs_dir",
+    "has_work_dir",
+)
+
+
+def build_status_table(
+    status, db, config, dirs, n_workers=N_WORKERS, index=None, force=False
+):
+    """
+    Combine job log statuses with output counts and leftover job directories into a
+    single per-job table.
+    :param status: pd.DataFrame, output of ..utils.reporting:get_job_status()
+    :param db: pd.DataFrame, job database (db.csv)
+    :param config: dict generated from reading the .yml spec
+    :param dirs: output of ..utils.io:calculate_directories()
+    :param n_workers: number of threads used to list output directories
+    :param index: ..utils.output_index:OutputIndex object to list output directories
+        through, or None
+    :param force: if True, list all output directories again rather than trust the
+        index
+    :return: pd.DataFrame indexed by order_id, with the columns in
+        STATUS_EXPORT_COLUMNS; outputs_ok is whether n_outputs matches
+        expected_n_files in the spec (NA if either is unknown)
+    """
+    df = status.reindex(columns=STATUS_EXPORT_COLUMNS[:7])
+    job_ids = df.index.tolist()
+
+    locations = output_locations(db[db["order_id"].isin(job_ids)], config)
+    if locations is not None:
+        listings, _ = list_output_dirs(
+            locations["output_dir"], n_workers, index=index, force=force
+        )
+        df = df.join(count_outputs(locations, listings=listings))
+    else:
+        df["output_dir_exists"] = pd.NA
+        df["n_outputs"] = pd.array([None] * len(df), dtype="Int64")
+
+    if "expected_n_files" in config:
+        df["outputs_ok"] = (df["n_outputs"] == config["expected_n_files"]).astype(
+            "boolean"
+        )
+    else:
+        df["outputs_ok"] = pd.array([None] * len(df), dtype="boolean")
+
+    df["has_inputs_dir"] = job_dirs_present(dirs["job_inputs"], job_ids)
+    df["has_work_dir"] = job_dirs_present(dirs["job_work"], job_ids)
+    return df
+
+
+def _job_paths(parent, job_ids, ext=""):
+    return pd.Series(
+        [os.path.join(parent, f"{job:05d}{ext}") for job in job_ids],
+        index=pd.Index(job_ids, name="order_id", dtype="int64"),
+    )
+
+
+def validate_jobs(
+    db,
+    config,
+    dirs,
+    status,
+    n_workers=N_WORKERS,
+    tests=None,
+    test_cache=None,
+    index=None,
+    force=False,
+):
+    """
+    Run the job checks (outputs, inputs, work and log; see
+    ..jobs.classes:TestableJob) on a set of jobs at once: each output directory is
+    listed once, and inputs and work directories are checked with a single listing
+    of their parent directories. Tests declared in the spec are then run on the
+    jobs' output files (see ..utils.job_tests:run_job_tests()).
+    :param db: pd.DataFrame, job database (db.csv)
+    :param config: dict generated from reading the .yml spec
+    :param dirs: output of ..utils.io:calculate_directories()
+    :param status: pd.DataFrame, output of ..utils.reporting:get_job_status() for
+        the jobs to check
+    :param n_workers: number of threads used to list output directories and run tests
+    :param tests: list of spec-declared tests (see ..utils.job_tests:parse_job_tests())
+    :param test_cache: ..utils.job_tests:JobTestCache object, or None
+    :param index: ..utils.output_index:OutputIndex object to list output directories
+        through, or None
+    :param force: if True, list all output directories again rather than trust the
+        index
+    :return: tuple, (pd.DataFrame indexed by order_id, with the db columns,
+        glob_output_expr, output_dir, valid, and result_<test> and log_<test> columns
+        for each test; pd.DataFrame with timings of spec-declared tests, see
+        ..utils.job_tests:run_job_tests())
+    """
+    job_ids = status.index.tolist()
+    jobs = db[db["order_id"].isin(job_ids)]
+    locations = output_locations(jobs, config)
+    if locations is None:
+        raise ValueError("Your spec does not define an output_path to check.")
+
+    df = jobs.set_index("order_id").reindex(status.index)
+    df["glob_output_expr"] = locations["output_expr"]
+    df["output_dir"] = locations["output_dir"]
+    df["valid"] = True  # set below, once all tests are done
+
+    # outputs: as many files as expected in the job's output directory
+    listings, entries = list_output_dirs(
+        locations["output_dir"], n_workers, index=index, force=force
+    )
+    outputs = count_outputs(locations, listings=listings).reindex(status.index)
+    exists = outputs["output_dir_exists"].fillna(False).astype(bool)
+    ok = (outputs["n_outputs"] == config["expected_n_files"]).fillna(False)
+    mismatch = (
+        f"Number of files found does not match expectation; "
+        f"expected = {config['expected_n_files']:d}, found = "
+    ) + outputs["n_outputs"].astype(str)
+    df["result_check_outputs"] = ok.astype(bool)
+    df["log_check_outputs"] = mismatch.where(~ok, "").where(
+        exists, "Output directory does not exist."
+    )
+
+    # inputs and work: directories should have been cleaned up
+    for test, label, key in (
+        ("check_inputs", "Input", "job_inputs"),
+        ("check_work", "Work", "job_work"),
+    ):
+        present = job_dirs_present(dirs[key], job_ids)
+        df[f"result_{test}"] = ~present
+        df[f"log_{test}"] = (
+            f"{label} directory exists at " + _job_paths(dirs[key], job_ids)
+        ).where(present, "")
+
+    # log: exists, and the job succeeded (as per its record or log ending)
+    log_paths = _job_paths(dirs["job_logs"], job_ids, ".txt")
+    record_paths = _job_paths(dirs["job_results"], job_ids, ".tsv")
+    has_log = status["has_log"]
+    failed_record = status["has_record"] & ~status["success"]
+    df["result_check_log"] = has_log & status["success"]
+    df["log_check_log"] = np.select(
+        [~has_log, failed_record, ~status["success"]],
+        [
+            "Job log file NOT found at " + log_paths,
+            "Job exited with status "
+            + status["exit_code"].astype(str)
+            + " (see "
+            + record_paths
+            + ")",
+            "Log ending is not as expected (see " + log_paths + ")",
+        ],
+        default="",
+    )
+
+    timings = None
+    if tests:
+        results, timings = run_job_tests(
+            df[[c for c in db.columns if c != "order_id"] + ["output_dir"]],
+            match_outputs(locations, listings, entries),
+            tests,
+            cache=test_cache,
+            n_workers=n_workers,
+        )
+        df = df.join(results)
+
+    df["valid"] = df[[c for c in df.columns if c.startswith("result_")]].all(axis=1)
+    return df, timings
@@ -0,0 +1,90 @@
+import datetime
+
+import pandas as pd
+import pytest
+
+from slurmhelper.utils.analytics import (
+    build_runtime_table,
+    flag_outliers,
+    summarize_runtimes,
+    suggest_time_settings,
+)
+
+CONFIG = {
+    "job_time": datetime.timedelta(minutes=10),
+    "job_ramp_up_time": datetime.timedelta(minutes=1),
+    "max_job_time": datetime.timedelta(minutes=20),
+}
+
+
+def status_table(runtimes, success=None):
+    jobs = range(1, len(runtimes) + 1)
+    return pd.DataFrame(
+        {
+            "success": success or [True] * len(runtimes),
+            "runtime": pd.array(runtimes, dtype="Int64"),
+            "host": "n1",
+            "max_rss_kb": pd.array([None] * len(runtimes), dtype="Int64"),
+        },
+        index=pd.Index(jobs, name="order_id"),
+    )
+
+
+def test_build_runtime_table():
+    # minutes: 5, 9, 11, 18 (18 + 1 of ramp up is over 90% of 20), then 2 failures
+    status = status_table(
+        [300, 540, 660, 1080, 60, None],
+        success=[True, True, True, True, False, True],
+    )
+    db = pd.DataFrame({"order_id": range(1, 7), "subject": list("aabbcc")})
+    df = build_runtime_table(status, db, CONFIG)
+
+    assert df.index.tolist() == [1, 2, 3, 4]
+    assert df["subject"].tolist() == list("aabb")
+    assert df["frac_job_time"].tolist() == pytest.approx([0.5, 0.9, 1.1, 1.8])
+    assert df["over_job_time"].tolist() == [False, False, True, True]
+    assert df["near_wall_time"].tolist() == [False, False, False, True]
+    assert df.loc[4, "frac_max_job_time"] == pytest.approx(0.95)
+
+
+@pytest.mark.parametrize(
+    "runtimes, group_by, outliers",
+    [
+        # too few jobs to tell
+        ([10, 10, 1000], None, []),
+        ([10, 11, 12, 13, 1000], None, [5]),
+        ([10, 11, 12, 13, 14], None, []),
+        # 1000 is typical of group b, but an outlier in a
+        ([10, 11, 12, 1000, 1000, 1001, 1002, 1003], ["group"], [4]),
+        ([10, 11, 12, 1000, 1000, 1001, 1002, 1003], None, []),
+    ],
+)
+def test_flag_outliers(runtimes, group_by, outliers):
+    df = pd.DataFrame(
+        {"runtime": [float(r) for r in runtimes]},
+        index=range(1, len(runtimes) + 1),
+    )
+    df["group"] = ["a" if job <= 4 else "b" for job in df.index]
+    flags = flag_outliers(df, group_by)
+    assert flags[flags].index.tolist() == outliers
+
+
+def test_summarize_and_suggest():
+    status = status_table([60 * m for m in range(1, 11)])
+    db = pd.DataFrame({"order_id": range(1, 11), "subject": ["a"] * 5 + ["b"] * 5})
+    df = build_runtime_table(status, db, CONFIG, group_by=["subject"])
+
+    summary = summarize_runtimes(df, percentiles=(0.5, 0.9))
+    assert summary.index.tolist() == ["all jobs"]
+    assert summary.loc["all jobs", "n_jobs"] == 10
+    assert summary.loc["all jobs", "p50"] == pytest.approx(330)
+    assert summary.loc["all jobs", "p90"] == pytest.approx(546)
+    assert summary.loc["all jobs", "max"] == 600
+
+    by_subject = summarize_runtimes(df, group_by=["subject"])
+    assert by_subject["n_jobs"].to_dict() == {"a": 5, "b": 5}
+    assert by_subject["mean"].to_dict() == {"a": 180, "b": 480}
+
+    suggested = suggest_time_settings(df, CONFIG)
+    assert suggested["job_time"] == pd.Timedelta(seconds=546)
+    assert suggested["min_max_job_time"] == pd.Timedelta(minutes=11)
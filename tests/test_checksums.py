@@ -0,0 +1,77 @@
+import os
+
+import pytest
+
+from slurmhelper.utils.checksums import (
+    available_algorithms,
+    hash_file,
+    manifest_path,
+    read_manifest,
+    update_manifests,
+)
+from slurmhelper.utils.job_tests import stat_output_files
+
+
+@pytest.fixture
+def outputs(tmp_path):
+    paths = [tmp_path / "out" / name for name in ("a.nii", "b.nii")]
+    paths[0].parent.mkdir()
+    for path in paths:
+        path.write_text(path.name)
+    return [str(p) for p in paths]
+
+
+def counts(df, job=1):
+    return df.loc[job, ["n_files", "n_hashed", "n_changed", "n_removed"]].tolist()
+
+
+def test_available_algorithms():
+    assert "sha256" in available_algorithms()
+
+
+def test_update_manifests(tmp_path, outputs):
+    checksums_dir = str(tmp_path / "checksums")
+
+    def update(paths, **kwargs):
+        files = {1: stat_output_files(paths)}
+        return update_manifests(checksums_dir, files, "sha256", n_workers=1, **kwargs)
+
+    assert counts(update(outputs)) == [2, 2, 0, 0]
+    algorithm, recorded = read_manifest(manifest_path(checksums_dir, 1))
+    assert algorithm == "sha256"
+    assert recorded[outputs[0]][2] == hash_file(outputs[0], "sha256")
+
+    # unchanged files are not hashed again
+    assert counts(update(outputs)) == [2, 0, 0, 0]
+
+    # a changed file is hashed again
+    with open(outputs[0], "w") as f:
+        f.write("changed")
+    assert counts(update(outputs)) == [2, 1, 1, 0]
+    _, recorded = read_manifest(manifest_path(checksums_dir, 1))
+    assert recorded[outputs[0]][2] == hash_file(outputs[0], "sha256")
+
+    # a removed file is dropped from the manifest
+    os.remove(outputs[1])
+    assert counts(update(outputs[:1])) == [1, 0, 0, 1]
+    assert list(read_manifest(manifest_path(checksums_dir, 1))[1]) == outputs[:1]
+
+
+def test_update_manifests_verify(tmp_path, outputs):
+    checksums_dir = str(tmp_path / "checksums")
+
+    def update(**kwargs):
+        files = {1: stat_output_files(outputs)}
+        return update_manifests(checksums_dir, files, "sha256", n_workers=1, **kwargs)
+
+    update()
+
+    # same size and mtime, different contents: only caught with verify
+    st = os.stat(outputs[0])
+    with open(outputs[0], "w") as f:
+        f.write("A.nii")
+    os.utime(outputs[0], ns=(st.st_atime_ns, st.st_mtime_ns))
+    assert update()[["n_hashed", "n_corrupt"]].loc[1].tolist() == [0, 0]
+
+    df = update(verify=True)
+    assert df.loc[1, ["n_hashed", "n_changed", "n_corrupt"]].tolist() == [2, 0, 1]
@@ -0,0 +1,112 @@
+import sqlite3
+from contextlib import closing
+
+import pytest
+
+from slurmhelper.db import SlurmhelperDB, StateCache
+from slurmhelper.db.classes import STATE_DB_FILE, _fill_wanted
+from slurmhelper.utils.io import calculate_directories
+
+
+@pytest.fixture
+def dirs(tmp_path):
+    (tmp_path / "project").mkdir()
+    return calculate_directories(str(tmp_path), "project")
+
+
+class ToyCache(StateCache):
+    NAME = "toy"
+    TABLES = {"toy_values": "key TEXT PRIMARY KEY, value INTEGER"}
+
+    def store(self, values):
+        (table,) = self.TABLES
+        with self._transaction() as con:
+            con.executemany(f"INSERT INTO {table} VALUES (?, ?)", values.items())
+
+    def load(self, keys):
+        (table,) = self.TABLES
+        with self._transaction() as con:
+            rows = self._select(
+                con,
+                f"SELECT t.key, t.value FROM {table} t "
+                "JOIN wanted w ON t.key = w.value",
+                keys,
+            ).fetchall()
+        return dict(rows)
+
+
+class OtherCache(ToyCache):
+    NAME = "other"
+    TABLES = {"other_values": "key TEXT PRIMARY KEY, value INTEGER"}
+
+
+def test_schema(dirs):
+    db = SlurmhelperDB(dirs)
+    assert db.db_file.name == STATE_DB_FILE
+    assert not db.is_initialized
+
+    with closing(sqlite3.connect(db.db_file)) as con:
+        assert con.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        version = con.execute("PRAGMA user_version").fetchone()[0]
+        assert version == SlurmhelperDB.SCHEMA_VERSION
+        tables = {
+            row[0]
+            for row in con.execute("SELECT name FROM sqlite_master WHERE type='table'")
+        }
+    assert {"meta", "jobs", "sbatch_jobs", "array_elements", "submissions"} <= tables
+    assert "events" in tables
+
+    db.initialize(dirs, [{"order_id": 1, "subject": "s1"}], {"spec_name": "toy"})
+    db.set_job_states({1: "completed"})
+
+    # reopening keeps the contents
+    db = SlurmhelperDB(dirs)
+    assert db.is_initialized
+    assert db.get_meta("job_spec") == {"spec_name": "toy"}
+    job = db.get_user_job(1)
+    assert job["record"] == {"order_id": 1, "subject": "s1"}
+    assert job["state"] == "completed"
+    with pytest.raises(FileExistsError):
+        db.initialize(dirs, [], {})
+
+
+def test_fill_wanted():
+    with closing(sqlite3.connect(":memory:")) as con:
+        _fill_wanted(con, [3, 1, 3])
+        assert con.execute("SELECT value FROM wanted ORDER BY value").fetchall() == [
+            (1,),
+            (3,),
+        ]
+
+        # refilled from scratch, past SQLite's limit on query parameters
+        _fill_wanted(con, range(100000))
+        assert con.execute("SELECT COUNT(*), MIN(value) FROM wanted").fetchone() == (
+            100000,
+            0,
+        )
+
+        _fill_wanted(con, [])
+        assert con.execute("SELECT COUNT(*) FROM wanted").fetchone() == (0,)
+
+
+def test_state_cache(dirs):
+    db = SlurmhelperDB(dirs)
+    db.add_user_jobs([{"order_id": 1}])
+    ToyCache(dirs).store({"a": 1, "b": 2})
+    OtherCache(dirs).store({"a": 3})
+
+    assert ToyCache(dirs).load(["a", "c"]) == {"a": 1}
+    assert db.get_meta("toy_schema_version") == 1
+
+    # a schema version bump drops the cache's rows, and only those
+    class ToyCacheV2(ToyCache):
+        SCHEMA_VERSION = 2
+
+    cache = ToyCacheV2(dirs)
+    assert cache.load(["a", "b"]) == dict()
+    assert db.get_meta("toy_schema_version") == 2
+    assert OtherCache(dirs).load(["a"]) == {"a": 3}
+    assert db.get_user_job(1) is not None
+
+    cache.store({"a": 4})
+    assert ToyCacheV2(dirs).load(["a"]) == {"a": 4}
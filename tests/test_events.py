@@ -0,0 +1,85 @@
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from slurmhelper.db import SlurmhelperDB
+from slurmhelper.utils import events
+from slurmhelper.utils.events import (
+    LOST_DETAIL,
+    job_timeline,
+    read_events,
+    record_events,
+    record_lost_jobs,
+)
+from slurmhelper.utils.io import calculate_directories
+from slurmhelper.utils.logs import RECORD_FIELDS
+
+
+@pytest.fixture
+def dirs(tmp_path):
+    (tmp_path / "project").mkdir()
+    return calculate_directories(str(tmp_path), "project")
+
+
+def test_record_lost_jobs(dirs, monkeypatch):
+    SlurmhelperDB(dirs).add_user_jobs([{"order_id": job} for job in (1, 2, 3, 4)])
+    slurm_ids = {1: "500_100", 2: "500_101", 3: "500_102", 4: "600"}
+    record_events(
+        dirs,
+        [
+            {"order_id": job, "slurm_id": slurm_id, "event": "running", "at": 100}
+            for (job, slurm_id) in slurm_ids.items()
+        ],
+    )
+
+    # job 2 finished normally; the others left no exit code
+    logs, results = Path(dirs["job_logs"]), Path(dirs["job_results"])
+    logs.mkdir(parents=True)
+    results.mkdir(parents=True)
+    for job in (1, 2):
+        (logs / f"{job:05d}.txt").write_text("...")
+    values = ["2", "100", "160", "0", "n1", "", "", ""]
+    (results / "00002.tsv").write_text(
+        "\t".join(RECORD_FIELDS) + "\n" + "\t".join(values) + "\n"
+    )
+
+    queried = []
+
+    def read_usage(dirs, slurm_ids=None):
+        queried.append(slurm_ids)
+        return pd.DataFrame({"slurm_id": ["500_100"], "state": ["TIMEOUT"]})
+
+    monkeypatch.setattr(events, "read_usage", read_usage)
+
+    # job 3 is still in the queue
+    assert record_lost_jobs(dirs, [3], taken_at=200) == 3
+    assert queried == [[500, 600]]
+
+    df = read_events(dirs).set_index("order_id")
+    outcomes = df[df["event"].isin(["completed", "failed"])]
+    assert outcomes["event"].to_dict() == {1: "failed", 2: "completed", 4: "failed"}
+    assert outcomes.loc[1, "detail"] == "TIMEOUT"
+    assert outcomes.loc[4, "detail"] == LOST_DETAIL
+    assert outcomes.loc[4, "at"] == 200
+
+    timeline = job_timeline(read_events(dirs))
+    assert timeline["outcome"].tolist() == ["failed", "completed", None, "failed"]
+
+    # recorded once only
+    assert record_lost_jobs(dirs, [3], taken_at=300) == 0
+
+
+def test_record_lost_jobs_without_sacct(dirs, monkeypatch):
+    SlurmhelperDB(dirs).add_user_jobs([{"order_id": 1}])
+    record_events(
+        dirs, [{"order_id": 1, "slurm_id": "500", "event": "running", "at": 100}]
+    )
+
+    def read_usage(dirs, slurm_ids=None):
+        raise FileNotFoundError("sacct")
+
+    monkeypatch.setattr(events, "read_usage", read_usage)
+
+    assert record_lost_jobs(dirs, [], taken_at=200) == 1
+    assert read_events(dirs)["detail"].iloc[-1] == LOST_DETAIL
@@ -0,0 +1,88 @@
+import os
+
+import pandas as pd
+import pytest
+
+from slurmhelper.utils import job_tests
+from slurmhelper.utils.io import calculate_directories
+from slurmhelper.utils.job_tests import (
+    JobTestCache,
+    fingerprint,
+    parse_job_tests,
+    run_job_tests,
+    stat_output_files,
+)
+
+
+@pytest.fixture
+def dirs(tmp_path):
+    (tmp_path / "project").mkdir()
+    return calculate_directories(str(tmp_path), "project")
+
+
+def test_fingerprint(tmp_path):
+    path = tmp_path / "out.nii"
+    path.write_text("abc")
+    test = {"name": "count", "type": "file_count", "params": {"expected": 1}}
+    files = stat_output_files([str(path)])
+
+    assert fingerprint(test, files) == fingerprint(dict(test), list(files))
+    assert fingerprint(test, files) != fingerprint(test, [])
+    other = dict(test, params={"expected": 2})
+    assert fingerprint(test, files) != fingerprint(other, files)
+
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    assert fingerprint(test, files) != fingerprint(test, stat_output_files([path]))
+
+
+def test_run_job_tests_with_cache(dirs, tmp_path, monkeypatch):
+    calls = []
+
+    def counting(job, files, min_files=1):
+        calls.append(job["order_id"])
+        return len(files) >= min_files, []
+
+    monkeypatch.setitem(job_tests.JOB_TESTS, "counting", counting)
+    tests = parse_job_tests({"job_tests": [{"type": "counting", "min_files": 1}]})
+
+    outputs = {1: [tmp_path / "a.nii"], 2: [tmp_path / "b.nii"]}
+    for paths in outputs.values():
+        paths[0].write_text("x")
+    output_files = {job: [str(p) for p in paths] for (job, paths) in outputs.items()}
+    jobs = pd.DataFrame(
+        {"output_dir": str(tmp_path)}, index=pd.Index([1, 2], name="order_id")
+    )
+
+    def run():
+        calls.clear()
+        return run_job_tests(
+            jobs, output_files, tests, cache=JobTestCache(dirs), n_workers=2
+        )
+
+    results, timings = run()
+    assert sorted(calls) == [1, 2]
+    assert results["result_counting"].tolist() == [True, True]
+    assert timings.loc[0, ["n_run", "n_cached"]].tolist() == [2, 0]
+
+    # unchanged outputs: results are reused
+    cached, timings = run()
+    assert calls == []
+    assert timings.loc[0, ["n_run", "n_cached"]].tolist() == [0, 2]
+    pd.testing.assert_frame_equal(cached, results)
+
+    # a changed output file: only that job is tested again
+    outputs[1][0].write_text("longer")
+    run()
+    assert calls == [1]
+
+    # changed settings: all jobs are tested again
+    tests = parse_job_tests({"job_tests": [{"type": "counting", "min_files": 2}]})
+    results, _ = run()
+    assert sorted(calls) == [1, 2]
+    assert results["result_counting"].tolist() == [False, False]
+
+    # discarded jobs are tested again
+    JobTestCache(dirs).discard([2])
+    run()
+    assert calls == [2]
@@ -0,0 +1,175 @@
+import os
+import subprocess
+import time
+
+import pytest
+
+import slurmhelper
+from slurmhelper.utils import local_slurm
+from slurmhelper.utils.local_slurm import (
+    STATE_DIR_ENV,
+    WORKERS_ENV,
+    install,
+    parse_array,
+    parse_dependency,
+    parse_time_limit,
+)
+
+ARRAY_SCRIPT = """#!/bin/bash
+#SBATCH --array=1-3%2
+#SBATCH --output=logs/array-%A_%a.out
+while [ ! -e go ]; do sleep 0.1; done
+echo "task $SLURM_ARRAY_TASK_ID"
+[ "$SLURM_ARRAY_TASK_ID" != 3 ]
+"""
+
+RELAY_SCRIPT = """#!/bin/bash
+#SBATCH --output=logs/relay-%j.out
+echo relay
+"""
+
+
+@pytest.fixture
+def emulator(tmp_path, monkeypatch):
+    """
+    Install the emulator's commands in a directory first in PATH, keeping its jobs
+    under tmp_path.
+    """
+    bin_dir = tmp_path / "bin"
+    install(str(bin_dir))
+    root = os.path.dirname(os.path.dirname(slurmhelper.__file__))
+    path = os.environ.get("PYTHONPATH")
+    monkeypatch.setenv("PYTHONPATH", root if not path else f"{root}{os.pathsep}{path}")
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setenv(STATE_DIR_ENV, str(tmp_path / "state"))
+    monkeypatch.setenv(WORKERS_ENV, "4")
+    (tmp_path / "logs").mkdir()
+    return tmp_path
+
+
+def run(args, cwd):
+    return subprocess.run(
+        args, cwd=cwd, check=True, encoding="UTF-8", stdout=subprocess.PIPE
+    ).stdout
+
+
+def squeue(cwd):
+    lines = run(["squeue", "--noheader", "--format=%i %T %R"], cwd).splitlines()
+    return {line.split()[0]: tuple(line.split()[1:]) for line in lines}
+
+
+def sacct(cwd):
+    lines = run(
+        ["sacct", "--parsable2", "--noheader", "--format=JobID,State,ExitCode"], cwd
+    ).splitlines()
+    return {
+        slurm_id: (state, code)
+        for (slurm_id, state, code) in (line.split("|") for line in lines)
+        if not slurm_id.endswith(".batch")
+    }
+
+
+def wait_for(condition, timeout=30):
+    start = time.time()
+    while True:
+        rv = condition()
+        if rv:
+            return rv
+        if time.time() - start > timeout:
+            raise TimeoutError
+        time.sleep(0.1)
+
+
+def test_parsing():
+    assert parse_array("100-103%2") == ([100, 101, 102, 103], 2)
+    assert parse_array("1,3,5-9:2") == ([1, 3, 5, 7, 9], None)
+    with pytest.raises(ValueError):
+        parse_array("1-x")
+    assert parse_dependency("afterany:12:13,afterok:14") == [
+        ("afterany", 12),
+        ("afterany", 13),
+        ("afterok", 14),
+    ]
+    assert parse_time_limit("1-02:03:04") == 93784
+    assert parse_time_limit("90") == 5400
+    assert parse_time_limit("UNLIMITED") is None
+
+
+def test_array_with_throttle_and_dependency(emulator):
+    (emulator / "array.sh").write_text(ARRAY_SCRIPT)
+    (emulator / "relay.sh").write_text(RELAY_SCRIPT)
+    array_id = run(["sbatch", "--parsable", "array.sh"], emulator).strip()
+    output = run(["sbatch", f"--dependency=afterany:{array_id}", "relay.sh"], emulator)
+    relay_id = output.strip().replace("Submitted batch job ", "")
+    assert relay_id.isdigit()
+
+    # two tasks run at once, the third waits for one of them, the relay for all
+    tasks = [f"{array_id}_{task}" for task in (1, 2, 3)]
+
+    def throttled():
+        queue = squeue(emulator)
+        states = [queue.get(task, ("",))[0] for task in tasks]
+        return queue if states == ["RUNNING", "RUNNING", "PENDING"] else None
+
+    queue = wait_for(throttled)
+    assert queue[tasks[2]] == ("PENDING", "(JobArrayTaskLimit)")
+    assert queue[relay_id] == ("PENDING", "(Dependency)")
+    assert sacct(emulator)[relay_id] == ("PENDING", "0:0")
+
+    (emulator / "go").touch()
+    wait_for(lambda: squeue(emulator) == dict())
+    assert sacct(emulator) == {
+        tasks[0]: ("COMPLETED", "0:0"),
+        tasks[1]: ("COMPLETED", "0:0"),
+        tasks[2]: ("FAILED", "1:0"),
+        relay_id: ("COMPLETED", "0:0"),
+    }
+
+    # output lands at the #SBATCH --output path
+    logs = emulator / "logs"
+    assert (logs / f"array-{array_id}_1.out").read_text() == "task 1\n"
+    assert (logs / f"array-{array_id}_3.out").read_text() == "task 3\n"
+    assert (logs / f"relay-{relay_id}.out").read_text() == "relay\n"
+
+
+def test_launch_failure(emulator, monkeypatch, capsys):
+    # run the scheduler's passes here, rather than in the background
+    monkeypatch.setattr(local_slurm, "ensure_scheduler", lambda: None)
+    (emulator / "array.sh").write_text(
+        "#!/bin/bash\n#SBATCH --array=1-3\n#SBATCH --output=logs/%a.out\necho ok\n"
+    )
+    monkeypatch.chdir(emulator)
+    assert local_slurm.main(["sbatch", "--parsable", "array.sh"]) == 0
+    job_id = capsys.readouterr().out.strip()
+
+    popen = subprocess.Popen
+
+    def failing_popen(args, **kwargs):
+        if kwargs.get("env", dict()).get("SLURM_ARRAY_TASK_ID") == "2":
+            raise PermissionError(13, "Permission denied")
+        return popen(args, **kwargs)
+
+    monkeypatch.setattr(local_slurm.subprocess, "Popen", failing_popen)
+    running = []
+    con = local_slurm.connect()
+    with con:
+        assert local_slurm._schedule(con, running, 4) == 2
+    while len(running) > 0:
+        for task in list(running):
+            outcome = task.poll()
+            if outcome is not None:
+                with con:
+                    local_slurm._finish(con, task, *outcome)
+                running.remove(task)
+        time.sleep(0.05)
+    con.close()
+
+    local_slurm.main(["sacct", "-j", job_id, "-Pn", "--format=JobID,State,ExitCode"])
+    lines = capsys.readouterr().out.splitlines()
+    assert [line for line in lines if ".batch" not in line] == [
+        f"{job_id}_1|COMPLETED|0:0",
+        f"{job_id}_2|FAILED|1:0",
+        f"{job_id}_3|COMPLETED|0:0",
+    ]
+    assert (emulator / "logs" / "1.out").read_text() == "ok\n"
+    assert "execve(): array.sh" in (emulator / "logs" / "2.out").read_text()
@@ -0,0 +1,274 @@
+import os
+import subprocess
+
+import pandas as pd
+import pytest
+
+from slurmhelper.jobs.cli_helpers import build_job_runner
+from slurmhelper.utils import logs
+from slurmhelper.utils.io import calculate_directories
+from slurmhelper.utils.logs import (
+    RECORD_FIELDS,
+    STTY_NOISE,
+    LogStatusCache,
+    error_signature,
+    group_failures,
+    parse_log_tail,
+    read_log_tail_lines,
+    read_result_record,
+    scan_job_logs,
+    triage_failed_logs,
+)
+
+
+def run_wrapper(tmp_path, scripts, env=None):
+    paths = {"job_logs": str(tmp_path), "job_results": str(tmp_path / "results")}
+    calls = []
+    for job, body in enumerate(scripts, start=1):
+        script = tmp_path / f"{job:05d}_run.sh"
+        script.write_text(body)
+        calls.append(f"run_job {job:05d} {script}")
+    wrapper = tmp_path / "wrapper.sh"
+    wrapper.write_text(
+        "\n\n".join(["#!/bin/bash -e", build_job_runner(paths), *calls, "exit"])
+    )
+    subprocess.run(
+        ["bash", str(wrapper)],
+        env=env,
+        start_new_session=True,
+        stdout=subprocess.DEVNULL,
+    )
+    return {
+        job: read_result_record(tmp_path / "results" / f"{job:05d}.tsv")
+        if (tmp_path / "results" / f"{job:05d}.tsv").exists()
+        else None
+        for job in range(1, len(scripts) + 1)
+    }
+
+
+def test_records_of_finished_jobs(tmp_path):
+    records = run_wrapper(tmp_path, ["echo hi", "exit 3", "kill -KILL $$"])
+    assert records[1]["exit_code"] == 0 and records[1]["success_marker"]
+    assert records[1]["cause"] is None and records[1]["signal"] is None
+    assert records[2]["exit_code"] == 3 and records[2]["cause"] is None
+    assert records[3]["exit_code"] == 137
+    assert (records[3]["signal"], records[3]["cause"]) == ("KILL", "KILLED")
+
+
+def test_record_of_job_killed_with_its_wrapper(tmp_path):
+    # SIGTERM to the whole process group, as Slurm does at the time limit
+    records = run_wrapper(tmp_path, ["kill -TERM 0; sleep 5", "echo never run"])
+    assert records[1]["exit_code"] == 143
+    assert (records[1]["signal"], records[1]["cause"]) == ("TERM", "CANCELLED")
+    assert records[2] is None
+
+
+def test_killed_at_time_limit(tmp_path):
+    env = dict(os.environ, SLURM_JOB_END_TIME="0")
+    records = run_wrapper(tmp_path, ["kill -TERM 0; sleep 5"], env=env)
+    assert (records[1]["signal"], records[1]["cause"]) == ("TERM", "TIMEOUT")
+
+
+def test_records_without_signal_and_cause(tmp_path):
+    path = tmp_path / "00001.tsv"
+    values = ["1", "10", "25", "0", "n1", "512"]
+    path.write_text("\t".join(RECORD_FIELDS[:6]) + "\n" + "\t".join(values))
+    record = read_result_record(path)
+    assert record["runtime"] == 15 and record["max_rss_kb"] == 512
+    assert record["cause"] is None
+
+    path.write_text("order_id\tend\n1\t25\n")
+    assert read_result_record(path) is None
+
+
+TAIL = "runtime: 12\nSUCCESS\n0\n"
+
+
+@pytest.mark.parametrize(
+    "text, lines",
+    [
+        # shorter than the tail window
+        ("hello\n" + TAIL, ["hello", "runtime: 12", "SUCCESS", "0"]),
+        # no newline at the end
+        ("hello\n" + TAIL.rstrip("\n"), ["hello", "runtime: 12", "SUCCESS", "0"]),
+        (f"  hello  \n{STTY_NOISE}\n{TAIL}", ["hello", "runtime: 12", "SUCCESS", "0"]),
+        ("", []),
+        ("\n", [""]),
+    ],
+)
+def test_read_log_tail_lines(tmp_path, text, lines):
+    path = tmp_path / "00001.txt"
+    path.write_text(text)
+    assert read_log_tail_lines(path) == lines
+
+
+def test_read_log_tail_lines_from_window(tmp_path):
+    path = tmp_path / "00001.txt"
+    accents = "\u00e9" * 20  # 2 bytes each in UTF-8
+    path.write_text("x" * 10 + "\n" + accents + "\n" + TAIL, encoding="utf-8")
+
+    # the window starts in the middle of a character, on a line that is dropped
+    n_bytes = len(TAIL) + len(accents.encode()) + 1 - 3
+    lines = read_log_tail_lines(path, n_lines=3, n_bytes=n_bytes)
+    assert lines == ["runtime: 12", "SUCCESS", "0"]
+
+    # the window is doubled until it has enough whole lines
+    whole = ["x" * 10, accents, "runtime: 12", "SUCCESS", "0"]
+    assert read_log_tail_lines(path, n_lines=4, n_bytes=n_bytes) == whole
+    assert read_log_tail_lines(path, n_lines=10, n_bytes=8) == whole
+
+
+@pytest.mark.parametrize(
+    "lines, outcome",
+    [
+        (["runtime: 12", "SUCCESS", "0"], (0, True, 12)),
+        (["FAILURE", "-1"], (-1, False, None)),
+        (["runtime: ?", "SUCCESS", "0"], (0, True, None)),
+        (["still running..."], (None, False, None)),
+        ([], (None, False, None)),
+    ],
+)
+def test_parse_log_tail(lines, outcome):
+    rv = parse_log_tail(lines)
+    assert (rv["exit_code"], rv["success_marker"], rv["runtime"]) == outcome
+
+
+def test_scan_job_logs_with_cache(tmp_path, monkeypatch):
+    (tmp_path / "project").mkdir()
+    dirs = calculate_directories(str(tmp_path), "project")
+    log_dir, results_dir = tmp_path / "logs", tmp_path / "results"
+    log_dir.mkdir()
+    results_dir.mkdir()
+    for job, text in ((1, TAIL), (2, "FAILURE\n1\n"), (3, "running\n")):
+        (log_dir / f"{job:05d}.txt").write_text(text)
+
+    opened = []
+    read_job_outcome = logs.read_job_outcome
+
+    def counting(log_path, record_path=None):
+        opened.append(int(os.path.basename(log_path)[:5]))
+        return read_job_outcome(log_path, record_path)
+
+    monkeypatch.setattr(logs, "read_job_outcome", counting)
+
+    def scan():
+        opened.clear()
+        return scan_job_logs(
+            str(log_dir),
+            [1, 2, 3, 4],
+            n_workers=2,
+            cache=LogStatusCache(dirs),
+            results_dir=str(results_dir),
+        )
+
+    status = scan()
+    assert sorted(opened) == [1, 2, 3]
+    assert status.loc[[1, 2], "exit_code"].tolist() == [0, 1]
+    assert status.loc[[3, 4], "exit_code"].isna().all()
+    assert status["has_log"].tolist() == [True, True, True, False]
+
+    # unchanged logs are served from the cache
+    cached = scan()
+    assert opened == []
+    pd.testing.assert_frame_equal(cached, status)
+
+    # a rewritten log (new size) and a touched one (same size, new mtime) are read
+    # again, as is a log whose result record appeared
+    (log_dir / "00003.txt").write_text("runtime: 5\nSUCCESS\n0\n")
+    st = os.stat(log_dir / "00002.txt")
+    os.utime(log_dir / "00002.txt", ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    values = ["1", "100", "160", "3", "n1", "", "", ""]
+    (results_dir / "00001.tsv").write_text(
+        "\t".join(RECORD_FIELDS) + "\n" + "\t".join(values) + "\n"
+    )
+    status = scan()
+    assert sorted(opened) == [1, 2, 3]
+    assert status.loc[1, "exit_code"] == 3 and status.loc[1, "runtime"] == 60
+    assert status.loc[3, "exit_code"] == 0
+
+    # removed logs drop out of the cache
+    (log_dir / "00003.txt").unlink()
+    status = scan()
+    assert opened == [] and not status.loc[3, "has_log"]
+    assert sorted(LogStatusCache(dirs).load([1, 2, 3])) == [1, 2]
+
+
+TIME_LIMIT = (
+    "slurmstepd: error: *** JOB 1234 ON n1 CANCELLED AT 2022-03-01T10:00:00 DUE TO "
+    "TIME LIMIT ***"
+)
+OOM = (
+    "slurmstepd: error: Detected 1 oom-kill event(s) in StepId=1234.batch. Some of "
+    "your processes may have been killed by the cgroup out-of-memory handler."
+)
+TRACEBACK = [
+    "Traceback (most recent call last):",
+    '  File "/home/u/run.py", line 3, in <module>',
+]
+
+
+@pytest.mark.parametrize(
+    "lines, kind, error_type, message",
+    [
+        ([TIME_LIMIT, "FAILURE", "143"], "timeout", None, "DUE TO TIME LIMIT ***"),
+        (["Killed", OOM], "out of memory", None, "oom-kill event(s) in StepId=<n>."),
+        (
+            TRACEBACK + ["FileNotFoundError: [Errno 2] No such file: '/d/s01.nii'"],
+            "python",
+            "FileNotFoundError",
+            "FileNotFoundError: [Errno <n>] No such file: <str>",
+        ),
+        (
+            TRACEBACK + ["numpy.core._exceptions.MemoryError: Unable to allocate 3GiB"],
+            "python",
+            "MemoryError",
+            "MemoryError: Unable to allocate <n>GiB",
+        ),
+        (
+            ["/jobs/00001_run.sh: line 4: /opt/bin/bet: No such file or directory"],
+            "shell",
+            None,
+            "<path>: line <n>: <path>: No such file or directory",
+        ),
+        (
+            ["Error using load", "Unable to read file 's01.mat'.", "Error in run_job"],
+            "matlab",
+            "Error using load",
+            "Error using load",
+        ),
+        (["line 8: 4242 Killed  python run.py"], "signal", None, "<n> Killed python"),
+        (["Fatal: could not open input"], "error", None, "Fatal: could not open"),
+        (["all good", "FAILURE", "1"], "unknown", None, ""),
+    ],
+)
+def test_error_signature(lines, kind, error_type, message):
+    signature = error_signature(lines)
+    assert (signature["kind"], signature["error_type"]) == (kind, error_type)
+    assert message in signature["message"]
+
+
+def test_group_failures(tmp_path):
+    logs = {
+        1: TRACEBACK + ["FileNotFoundError: [Errno 2] No such file: '/d/s01.nii'"],
+        2: TRACEBACK + ["FileNotFoundError: [Errno 2] No such file: '/d/s02.nii'"],
+        3: [TIME_LIMIT],
+        4: TRACEBACK + ["FileNotFoundError: [Errno 2] No such file: '/d/s04.nii'"],
+        5: ["FAILURE", "1"],
+    }
+    for job, lines in logs.items():
+        (tmp_path / f"{job:05d}.txt").write_text("\n".join(lines) + "\n")
+
+    signatures = triage_failed_logs(str(tmp_path), [1, 2, 3, 4, 5, 6], n_workers=2)
+    assert signatures.index.tolist() == [1, 2, 3, 4, 5]  # 6 has no log
+
+    groups = group_failures(signatures, n_examples=2)
+    assert groups["kind"].tolist() == ["python", "timeout", "unknown"]
+    assert groups["n_jobs"].tolist() == [3, 1, 1]
+    assert groups.loc[0, "example_ids"] == "00001 00002"
+
+    # the same error with different exit codes is told apart
+    exit_codes = pd.Series([1, 1, 143, 2, 1], index=[1, 2, 3, 4, 5])
+    groups = group_failures(signatures, exit_codes)
+    assert groups["n_jobs"].tolist() == [2, 1, 1, 1]
+    assert groups["exit_code"].tolist() == ["1", "143", "2", "1"]
+    assert groups.loc[0, "example_ids"] == "00001 00002"
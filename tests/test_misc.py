@@ -0,0 +1,129 @@
+import argparse
+import datetime
+import math
+import time
+
+import pytest
+
+from slurmhelper.jobs.cli_helpers import prep_job_array
+from slurmhelper.utils.misc import (
+    find_optimal_n_parcels,
+    split_list,
+    split_list_grouped,
+)
+
+CONFIG = {
+    "job_time": datetime.timedelta(minutes=30),
+    "job_ramp_up_time": datetime.timedelta(minutes=5),
+    "max_job_time": datetime.timedelta(hours=23),
+}
+
+
+def longest_parcel(n, n_parcels):
+    return max(len(p) for p in split_list(list(range(n)), n_parcels))
+
+
+def fits(n, n_parcels, config=CONFIG):
+    longest = longest_parcel(n, n_parcels)
+    wall = config["job_ramp_up_time"] + longest * config["job_time"]
+    return wall <= config["max_job_time"]
+
+
+@pytest.mark.parametrize("n", [1, 2, 7, 45, 46, 97, 1000, 4099])
+@pytest.mark.parametrize("par_target", [0, 25, 50, 75, 100])
+def test_parcels_fit_within_max_job_time(n, par_target):
+    p = find_optimal_n_parcels(n, CONFIG, par_target)
+    assert isinstance(p, int)
+    assert 1 <= p <= n
+    assert fits(n, p)
+
+
+@pytest.mark.parametrize("n", [1, 45, 97, 4099])
+def test_extremes(n):
+    # par_target 0: fewest parcels that fit, ramp up time included
+    k_max = (23 * 60 - 5) // 30
+    assert find_optimal_n_parcels(n, CONFIG, 0) == math.ceil(n / min(n, k_max))
+    # par_target 100: one job per parcel
+    assert find_optimal_n_parcels(n, CONFIG, 100) == n
+
+
+def test_more_parallel_with_higher_par_target():
+    n = 5000
+    parcels = [find_optimal_n_parcels(n, CONFIG, t) for t in range(0, 101, 10)]
+    assert parcels == sorted(parcels)
+
+
+def test_invalid_arguments():
+    with pytest.raises(ValueError):
+        find_optimal_n_parcels(0, CONFIG, 0)
+    with pytest.raises(ValueError):
+        find_optimal_n_parcels(10, CONFIG, 101)
+    with pytest.raises(ValueError):
+        find_optimal_n_parcels(10, dict(CONFIG, max_job_time=CONFIG["job_time"]), 0)
+
+
+@pytest.mark.parametrize("n", [10 ** e for e in range(1, 7)])
+def test_benchmark(n):
+    # runs in O(min(n, max jobs per parcel)), so even 10^6 jobs are near instant
+    config = dict(CONFIG, job_time=datetime.timedelta(seconds=1))
+    for par_target in (0, 50, 100):
+        start = time.perf_counter()
+        p = find_optimal_n_parcels(n, config, par_target)
+        assert time.perf_counter() - start < 1
+        assert fits(n, p, config)
+
+
+# group sizes, parts wanted, and the groups that should stay in a single part
+@pytest.mark.parametrize(
+    "sizes, wanted_parts, together",
+    [
+        ([2, 2, 2, 2], 4, [0, 1, 2, 3]),
+        ([3, 2, 2, 1], 3, [0, 1, 2, 3]),
+        ([2, 2, 1, 1, 1], 3, [0, 1, 2, 3, 4]),
+        ([3, 3, 2], 3, [0, 1, 2]),
+        ([7, 6, 2, 1, 1], 5, [2, 3, 4]),
+        # groups larger than a part are split, as are those left without room
+        ([3, 3, 2], 4, []),
+        ([4, 4], 4, []),
+        ([12], 5, []),
+        ([1] * 10, 3, list(range(10))),
+    ],
+)
+def test_split_list_grouped(sizes, wanted_parts, together):
+    keys = [k for (k, size) in enumerate(sizes) for _ in range(size)]
+    jobs = list(range(1, len(keys) + 1))
+
+    parts = split_list_grouped(jobs, keys, wanted_parts)
+    assert sorted(j for p in parts for j in p) == jobs
+    assert all(len(p) > 0 for p in parts) and len(parts) <= wanted_parts
+
+    # no part is longer than with split_list()
+    longest = max(len(p) for p in split_list(jobs, wanted_parts))
+    assert max(len(p) for p in parts) <= longest
+
+    for key in together:
+        assert sum(any(keys[j - 1] == key for j in p) for p in parts) == 1
+
+
+def test_split_list_grouped_keeps_groups_together():
+    keys = ["a", "b", "a", "c", "b", "a", "c", "d"]
+    parts = split_list_grouped(list(range(1, 9)), keys, wanted_parts=3)
+    assert parts == [[1, 3, 6], [2, 5, 8], [4, 7]]
+
+    # empty parts are dropped
+    assert split_list_grouped([1, 2, 3, 4], ["a"] * 4, wanted_parts=4) == [
+        [1],
+        [2],
+        [3],
+        [4],
+    ]
+    assert split_list_grouped([1, 2], ["a", "b"], wanted_parts=4) == [[1], [2]]
+
+
+def test_group_by_single_column(tmp_path):
+    (tmp_path / "db.csv").write_text("order_id,session\n1,a\n2,b\n")
+    args = argparse.Namespace(n_parcels=[2], group_by=None)
+    with pytest.raises(ValueError, match="{'subject'}"):
+        prep_job_array(
+            {"parcel_group_by": "subject"}, [1, 2], {"base": str(tmp_path)}, args
+        )
@@ -0,0 +1,92 @@
+import os
+import time
+
+import pytest
+
+from slurmhelper.utils import output_index
+from slurmhelper.utils.io import calculate_directories
+from slurmhelper.utils.output_index import OutputIndex, refresh_output_index
+
+
+@pytest.fixture
+def dirs(tmp_path):
+    (tmp_path / "project").mkdir()
+    return calculate_directories(str(tmp_path), "project")
+
+
+def settle(path, age=100):
+    # backdate a directory, so its listing is not considered unsettled
+    mtime = time.time() - age
+    os.utime(path, (mtime, mtime))
+
+
+def test_refresh_output_index(dirs, tmp_path, monkeypatch):
+    listed = []
+    list_with_stats = output_index._list_with_stats
+
+    def counting(path):
+        listed.append(path)
+        return list_with_stats(path)
+
+    monkeypatch.setattr(output_index, "_list_with_stats", counting)
+
+    paths = [str(tmp_path / name) for name in ("a", "b")]
+    for path in paths:
+        os.mkdir(path)
+        with open(os.path.join(path, "out.nii"), "w") as f:
+            f.write("x")
+        settle(path)
+
+    def refresh(force=False):
+        listed.clear()
+        return refresh_output_index(OutputIndex(dirs), paths, n_workers=2, force=force)
+
+    entries = refresh()
+    assert sorted(listed) == paths
+    assert [f.name for f in entries[paths[0]]] == ["out.nii"]
+
+    # unchanged directories: their listings are reused
+    assert refresh() == entries
+    assert listed == []
+
+    # a new file changes its directory's mtime: only that directory is listed again
+    with open(os.path.join(paths[0], "new.nii"), "w") as f:
+        f.write("y")
+    settle(paths[0], age=50)
+    entries = refresh()
+    assert listed == [paths[0]]
+    assert [f.name for f in entries[paths[0]]] == ["new.nii", "out.nii"]
+
+    # a file rewritten in place does not touch its directory: only seen with force
+    st = os.stat(paths[1])
+    with open(os.path.join(paths[1], "out.nii"), "w") as f:
+        f.write("longer")
+    os.utime(paths[1], ns=(st.st_atime_ns, st.st_mtime_ns))
+    assert refresh()[paths[1]][0].size == 1
+    assert listed == []
+    assert refresh(force=True)[paths[1]][0].size == 6
+    assert sorted(listed) == paths
+
+    # a removed directory is reported as missing, and dropped from the index
+    for name in os.listdir(paths[1]):
+        os.remove(os.path.join(paths[1], name))
+    os.rmdir(paths[1])
+    assert refresh()[paths[1]] is None
+    assert OutputIndex(dirs).load_dirs(paths).keys() == {paths[0]}
+
+
+def test_refresh_output_index_unsettled(dirs, tmp_path, monkeypatch):
+    listed = []
+    list_with_stats = output_index._list_with_stats
+    monkeypatch.setattr(
+        output_index,
+        "_list_with_stats",
+        lambda path: listed.append(path) or list_with_stats(path),
+    )
+
+    # a directory modified right before being listed is listed again next time
+    path = str(tmp_path / "a")
+    os.mkdir(path)
+    refresh_output_index(OutputIndex(dirs), [path])
+    refresh_output_index(OutputIndex(dirs), [path])
+    assert listed == [path, path]
@@ -0,0 +1,34 @@
+import datetime
+
+import pandas as pd
+
+from slurmhelper.utils.planning import plan_layouts
+
+CONFIG = {
+    "job_time": datetime.timedelta(minutes=30),
+    "job_ramp_up_time": datetime.timedelta(minutes=5),
+    "max_job_time": datetime.timedelta(hours=23),
+}
+
+
+def test_plan_layouts_recommends_even_packing():
+    # a few long jobs at the start make balanced packing much faster
+    jobs = list(range(1, 13))
+    history = pd.to_timedelta(
+        pd.Series([600] * 3 + [10] * 9, index=jobs), unit="minutes"
+    )
+    plans = plan_layouts(jobs, CONFIG, n_parcels_list=[3, 4], history=history)
+    assert len(plans) == 4
+    assert plans.iloc[0]["strategy"] == "balanced"
+    assert plans["recommended"].sum() == 1
+    assert plans.loc[plans["recommended"], "strategy"].item() == "even"
+
+
+def test_plan_layouts_without_even_packing():
+    plans = plan_layouts(list(range(1, 13)), CONFIG, strategies=["balanced"])
+    assert len(plans) > 0 and not plans["recommended"].any()
+
+
+def test_plan_layouts_with_too_many_parcels():
+    plans = plan_layouts([1, 2, 3], CONFIG, n_parcels_list=[4, 10])
+    assert len(plans) == 0 and "recommended" in plans.columns
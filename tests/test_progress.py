@@ -0,0 +1,41 @@
+import pandas as pd
+
+from slurmhelper.utils.reporting import summarize_progress
+
+
+def status_table():
+    # completed, failed, running, killed (log but no exit code), pending, unsubmitted
+    return pd.DataFrame(
+        {
+            "exit_code": pd.array([0, 1, None, None, None, None], dtype="Int64"),
+            "success": [True, False, False, False, False, False],
+            "has_log": [True, True, True, True, False, False],
+            "log_mtime": [100.0, 100.0, 100.0, 50.0, None, None],
+        },
+        index=pd.Index([1, 2, 3, 4, 5, 6], name="order_id"),
+    )
+
+
+def test_progress_with_queue():
+    queued = pd.Series(["RUNNING", "PENDING"], index=[3, 5])
+    progress = summarize_progress(status_table(), now=200, queued=queued)
+    assert progress["completed"] == 1
+    assert progress["failed"] == 1
+    assert progress["running"] == 1
+    assert progress["pending"] == 1
+    assert progress["lost"] == 1
+    assert progress["not_queued"] == 1
+
+
+def test_progress_ends_when_nothing_is_queued():
+    queued = pd.Series([], dtype="object")
+    progress = summarize_progress(status_table(), now=200, queued=queued)
+    assert progress["running"] + progress["pending"] == 0
+    assert progress["eta"] == pd.Timedelta(0)
+
+
+def test_progress_without_queue():
+    progress = summarize_progress(status_table(), now=200)
+    assert progress["running"] == 2
+    assert progress["pending"] == 2
+    assert progress["lost"] is None
@@ -0,0 +1,187 @@
+import argparse
+
+import pandas as pd
+import pytest
+
+from slurmhelper.cli.parser import DEFAULT_MEMORY, DEFAULT_N_TASKS
+from slurmhelper.db import SlurmhelperDB
+from slurmhelper.jobs import retry
+from slurmhelper.jobs.retry import (
+    _last_attempt_states,
+    find_retry_candidates,
+    plan_retry_groups,
+    retry_jobs,
+)
+from slurmhelper.jobs.submit import RELAY_SUBMISSIONS_FILE, record_submission
+from slurmhelper.utils.io import calculate_directories
+from slurmhelper.utils.logs import RECORD_FIELDS
+from slurmhelper.utils.slurm import attach_job_ids
+
+# sbatch jobs: their resources, and the jobs run by each of their array elements
+SBATCH_JOBS = {
+    1: ("--time=01:00:00 --mem=8000 --ntasks-per-node=4", {100: [1, 2], 101: [3]}),
+    # submitted by the relay of sb-0001
+    2: ("--time=01:00:00 --mem=32G", {100: [3]}),
+    # submitted by a relay that could not record it
+    3: ("--time=02:00:00", {100: [4]}),
+    4: ("", {100: [5]}),
+}
+
+# sacct records of these submissions
+SACCT = [
+    (5001, 100, "sb-0001", "FAILED"),
+    (5001, 101, "sb-0001", "TIMEOUT"),
+    (5002, 100, "sb-0002", "OUT_OF_MEMORY"),
+    (5003, 100, "sb-0003", "TIMEOUT"),
+    (5004, 100, "sb-0004", "RUNNING"),
+]
+
+
+@pytest.fixture
+def dirs(tmp_path, monkeypatch):
+    """
+    A project with jobs 1-6: job 1 completed; job 2 failed; job 3 was killed on its
+    first attempt, and left no log on its second (submitted by a relay job); job 4
+    left no log, from an array missing from the state database; job 5 is still in
+    the queue; job 6 was never submitted.
+    """
+    dirs = calculate_directories(str(tmp_path), "project")
+    project = tmp_path / "project"
+    scripts = project / "scripts" / "slurm"
+    scripts.mkdir(parents=True)
+    for sbatch_id, (directives, elements) in SBATCH_JOBS.items():
+        header = "".join(f"#SBATCH {d}\n" for d in directives.split())
+        (scripts / f"sb-{sbatch_id:04d}.sh").write_text(f"#!/bin/bash\n{header}")
+        for task, jobs in elements.items():
+            calls = [f"run_job {job:05d} /jobs/{job:05d}_run.sh" for job in jobs]
+            (scripts / f"sb-{sbatch_id:04d}-{task}.sh").write_text("\n".join(calls))
+
+    SlurmhelperDB(dirs).add_user_jobs([{"order_id": job} for job in range(1, 7)])
+    record_submission(dirs, 1, "5001", "sb-0001")
+    record_submission(dirs, 4, "5004", "sb-0004")
+    (project / RELAY_SUBMISSIONS_FILE).write_text(
+        "2\t5002\tsb-0002\t1000\t\t\n3\t\tsb-0003\t1001\t\t\n"
+    )
+
+    (project / "db.csv").write_text("order_id\n" + "\n".join(map(str, range(1, 7))))
+    logs, results = project / "logs" / "jobs", project / "logs" / "results"
+    for path in (logs, results):
+        path.mkdir(parents=True)
+    for job, exit_code in ((1, "0"), (2, "1"), (3, None)):
+        (logs / f"{job:05d}.txt").write_text("...")
+        if exit_code is not None:
+            values = [str(job), "100", "160", exit_code, "n1", "", "", ""]
+            (results / f"{job:05d}.tsv").write_text(
+                "\t".join(RECORD_FIELDS) + "\n" + "\t".join(values) + "\n"
+            )
+
+    def read_usage(dirs, sbatch_ids=None, **kwargs):
+        names = {f"sb-{sb:04d}" for sb in sbatch_ids}
+        df = pd.DataFrame(
+            [r for r in SACCT if r[2] in names],
+            columns=["slurm_job_id", "array_task", "job_name", "state"],
+        )
+        return attach_job_ids(df, dirs)
+
+    queue = [
+        {
+            "slurm_id": "5004_100",
+            "slurm_job_id": 5004,
+            "array_task": 100,
+            "job_name": "sb-0004",
+            "state": "RUNNING",
+        }
+    ]
+    monkeypatch.setattr(retry, "read_usage", read_usage)
+    monkeypatch.setattr(retry, "get_queue_snapshot", lambda *a, **k: (queue, 0))
+    return dirs
+
+
+def test_find_retry_candidates(dirs):
+    df = find_retry_candidates(dirs)
+    assert df.index.tolist() == [2, 3, 4]
+    assert df["status"].tolist() == ["failed", "missing", "missing"]
+    assert df["attempts"].tolist() == [1, 2, 1]
+    assert df["last_sbatch_id"].tolist() == [1, 2, 3]
+    assert df["cause"].tolist() == ["FAILED", "OUT_OF_MEMORY", "TIMEOUT"]
+
+    assert find_retry_candidates(dirs, job_list=[1, 2, 5, 6]).index.tolist() == [2]
+
+
+def test_last_attempt_states(dirs):
+    df = pd.DataFrame(
+        {"last_sbatch_id": pd.array([1, 2, 1, pd.NA, 4], dtype="Int64")},
+        index=pd.Index([2, 3, 4, 5, 6], name="order_id"),
+    )
+    causes = _last_attempt_states(dirs, df)
+    # job 3's first attempt timed out, but its last one ran out of memory; job 4
+    # has no record of sb-0001, and job 6 none of sb-0004
+    assert causes.tolist() == ["FAILED", "OUT_OF_MEMORY", pd.NA, pd.NA, pd.NA]
+
+    # no sacct lookup for jobs that were never submitted
+    df["last_sbatch_id"] = pd.NA
+    assert _last_attempt_states(dirs, df).isna().all()
+
+
+def test_plan_retry_groups(dirs):
+    candidates = find_retry_candidates(dirs)
+
+    groups = plan_retry_groups(dirs, candidates, bump_time=2, bump_memory=1.5)
+    assert [(g["name"], g["job_list"]) for g in groups] == [
+        ("as-before", [2]),
+        ("memory-bumped", [3]),
+        ("time-bumped", [4]),
+    ]
+    as_before, memory, time = groups
+    assert (as_before["time"], as_before["memory"], as_before["n_tasks"]) == (
+        None,
+        8000,
+        4,
+    )
+    assert as_before["n_parcels"] is None
+    assert (memory["time"], memory["memory"]) == (None, 49152)
+    assert (time["time"], time["memory"], time["n_parcels"]) == (14400, None, 1)
+
+    # without factors, jobs are retried as before
+    groups = plan_retry_groups(dirs, candidates)
+    assert [(g["name"], g["job_list"]) for g in groups] == [("as-before", [2, 3, 4])]
+    assert (groups[0]["time"], groups[0]["memory"]) == (None, 32768)
+
+
+def test_retry_jobs(dirs, monkeypatch, capsys):
+    prepared = []
+
+    def prep_job_array(config, job_list, dirs, args, show_instructions=True):
+        prepared.append((job_list, args, show_instructions))
+        return args.sbatch_id
+
+    monkeypatch.setattr(retry, "prep_job_array", prep_job_array)
+    args = argparse.Namespace(
+        rescan=False,
+        max_attempts=2,
+        bump_time=2,
+        bump_memory=None,
+        time=None,
+        memory=None,
+        n_tasks=None,
+        dry=False,
+        do_reset=False,
+        do_clean=False,
+        do_copy=False,
+        no_submit=True,
+    )
+    assert retry_jobs(dict(), dirs, args) == [2, 4]
+
+    # job 3 reached 2 attempts; the time of job 4 is bumped, other resources are
+    # left to the defaults, as no script tells them
+    assert [(job_list, a.sbatch_id) for (job_list, a, _) in prepared] == [
+        ([2], [5]),
+        ([4], [6]),
+    ]
+    assert [(a.memory, a.n_tasks) for (_, a, _) in prepared] == [
+        ([8000], [4]),
+        ([DEFAULT_MEMORY], [DEFAULT_N_TASKS]),
+    ]
+    assert [a.time for (_, a, _) in prepared] == [None, "4:0:0"]
+    assert not any(show for (_, _, show) in prepared)
+    assert "sbatch ids prepared, to submit: 5 6" in capsys.readouterr().out
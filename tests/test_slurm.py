@@ -0,0 +1,157 @@
+import os
+
+import pytest
+
+from slurmhelper.utils import slurm
+from slurmhelper.utils.slurm import (
+    parse_sacct,
+    parse_slurm_memory,
+    plan_array_chunks,
+    read_sacct,
+)
+
+DATA = os.path.join(os.path.dirname(__file__), "data")
+
+
+def sacct_fixture(name="sacct_array.txt"):
+    with open(os.path.join(DATA, name), "r") as f:
+        return f.read()
+
+
+@pytest.mark.parametrize(
+    "text, kb",
+    [
+        ("3512344K", 3512344),
+        ("4196M", 4196 * 1024),
+        ("2.50G", int(2.5 * 1024**2)),
+        ("1T", 1024**3),
+        ("204800", 200),
+        ("4000Mc", 4000 * 1024),
+        ("4Gn", 4 * 1024**2),
+        ("", None),
+        ("16X", None),
+    ],
+)
+def test_parse_slurm_memory(text, kb):
+    assert parse_slurm_memory(text) == kb
+
+
+def test_parse_sacct_folds_steps_into_allocations():
+    records = {r["slurm_id"]: r for r in parse_sacct(sacct_fixture())}
+    # pending ranges (18334739_[1001-1099%10]) and steps are not listed on their own
+    assert sorted(records) == [
+        "18334739_100",
+        "18334739_1000",
+        "18334739_101",
+        "18334739_102",
+        "18334739_103",
+        "18334801",
+    ]
+
+    done = records["18334739_100"]
+    assert (done["slurm_job_id"], done["array_task"]) == (18334739, 100)
+    assert (done["job_name"], done["state"]) == ("sb-0001", "COMPLETED")
+    assert done["exit_code"] == 0
+    assert done["elapsed"] == 3723 and done["total_cpu"] == pytest.approx(3481.123)
+    assert done["req_mem_kb"] == 4 * 1024**2 and done["alloc_cpus"] == 2
+    assert done["node_list"] == "node042"
+
+    # MaxRSS is the largest over .batch and .extern steps, whatever the unit
+    assert done["max_rss_kb"] == 3512344
+    assert records["18334739_101"]["max_rss_kb"] == int(2.5 * 1024**2)
+    assert records["18334739_102"]["max_rss_kb"] == 4196 * 1024
+    assert records["18334739_1000"]["max_rss_kb"] is None
+    assert records["18334801"]["max_rss_kb"] == 200
+
+
+def test_parse_sacct_states():
+    records = {r["slurm_id"]: r for r in parse_sacct(sacct_fixture())}
+    assert records["18334739_101"]["state"] == "TIMEOUT"
+    assert records["18334739_101"]["elapsed"] == 86412
+    assert records["18334739_102"]["state"] == "OUT_OF_MEMORY"
+    assert records["18334739_103"]["state"] == "CANCELLED"  # "CANCELLED by <uid>"
+    assert records["18334739_1000"]["array_task"] == 1000
+
+    serial = records["18334801"]
+    assert serial["array_task"] is None
+    assert (serial["state"], serial["exit_code"]) == ("FAILED", 2)
+    assert serial["req_mem_kb"] == 4000 * 1024
+
+
+def test_parse_sacct_empty():
+    assert parse_sacct("") == []
+    assert parse_sacct(sacct_fixture().splitlines()[0]) == []
+
+
+def test_read_sacct(monkeypatch):
+    calls = []
+
+    def check_output(cmd, encoding=None):
+        calls.append(cmd)
+        return sacct_fixture()
+
+    monkeypatch.setattr(slurm.subprocess, "check_output", check_output)
+
+    records = read_sacct(job_names=["sb-0001", "sb-0002"], start_time="2022-03-01")
+    assert len(records) == 6
+    assert calls[-1][:2] == ["sacct", "--parsable2"]
+    assert "--name=sb-0001,sb-0002" in calls[-1]
+    assert "--starttime=2022-03-01" in calls[-1]
+
+    read_sacct(slurm_ids=[18334739, 18334801], job_names=["ignored"])
+    assert "--jobs=18334739,18334801" in calls[-1]
+    assert not any(arg.startswith("--name") for arg in calls[-1])
+
+    with pytest.raises(ValueError):
+        read_sacct()
+
+
+def test_parse_squeue_skips_unexpected_lines():
+    text = "\n".join(
+        [
+            "JOBID|ARRAY_JOB_ID|ARRAY_TASK_ID|NAME|STATE|TIME|TIME_LIMIT|NODES|REASON",
+            "123_101|123|101|sb-0001|RUNNING|1:02|1-00:00:00|1|node042",
+            "123_[102-200%10]|123|102-200%10|sb-0001|PENDING|0:00|1-00:00:00|1|"
+            "(JobArrayTaskLimit)",
+            "124|N/A|N/A|sb-0001-relay|PENDING|0:00|5:00|1|(Dependency)",
+            "125|125|N/A|sb-0002|PENDING|0:00|2:00:00|1|(Priority)",
+        ]
+    )
+    jobs = slurm.parse_squeue(text)
+    assert [j["slurm_id"] for j in jobs] == ["123_101", "123_[102-200%10]", "125"]
+    assert jobs[0]["slurm_job_id"] == 123 and jobs[0]["array_task"] == 101
+    assert jobs[0]["time_used"] == 62 and jobs[0]["nodes"] == 1
+    assert jobs[1]["array_task"] is None and jobs[1]["reason"] == "(JobArrayTaskLimit)"
+    assert jobs[2]["time_limit"] == 7200
+
+
+# MaxArraySize of 1001 leaves 901 elements per array (indexed from 100)
+@pytest.mark.parametrize(
+    "n_parcels, max_submit, rate_limit, sizes, chained, throttle",
+    [
+        (901, None, None, [901], False, None),
+        (902, None, None, [451, 451], False, None),
+        (2703, None, None, [901, 901, 901], False, None),
+        (2704, None, None, [676, 676, 676, 676], False, None),
+        # all parcels fit in the queue at once, so max_submit_jobs does not bind
+        (50, 50, None, [50], False, None),
+        # otherwise, chunks are chained and leave room for 2 relay jobs
+        (51, 50, None, [25, 26], True, None),
+        (96, 50, None, [48, 48], True, None),
+        (97, 50, None, [32, 32, 33], True, None),
+        (51, 50, 10, [25, 26], True, 10),
+        # concurrent chunks share the rate limit, unless it is too low to
+        (902, None, 10, [451, 451], False, 5),
+        (902, None, 3, [451, 451], False, 1),
+        (902, None, 2, [451, 451], False, 1),
+        (902, None, 1, [451, 451], True, 1),
+        (901, None, 1, [901], False, 1),
+    ],
+)
+def test_plan_array_chunks(n_parcels, max_submit, rate_limit, sizes, chained, throttle):
+    limits = {"max_array_size": 1001, "max_submit_jobs": max_submit}
+    chunks = plan_array_chunks(n_parcels, limits, rate_limit)
+    assert chunks == {"sizes": sizes, "chained": chained, "throttle": throttle}
+    assert sum(chunks["sizes"]) == n_parcels
+    if chunks["throttle"] is not None and not chunks["chained"]:
+        assert chunks["throttle"] * len(sizes) <= rate_limit
@@ -0,0 +1,231 @@
+import argparse
+import os
+import sqlite3
+import subprocess
+
+import pytest
+
+from slurmhelper.db import SlurmhelperDB
+from slurmhelper.jobs import submit
+from slurmhelper.jobs.cli_helpers import _prep_relay_script
+from slurmhelper.jobs.submit import (
+    RELAY_SUBMISSIONS_FILE,
+    RelayNotSubmitted,
+    SubmissionNotRecorded,
+    import_relay_submissions,
+    run_sbatch,
+    submit_many,
+    submit_sbatch,
+)
+from slurmhelper.utils.events import read_events
+from slurmhelper.utils.io import calculate_directories
+
+
+@pytest.fixture
+def dirs(tmp_path):
+    dirs = calculate_directories(str(tmp_path), "project")
+    scripts = tmp_path / "project" / "scripts" / "slurm"
+    scripts.mkdir(parents=True)
+    # sb-0002, an array of two elements submitted by the relay of sb-0001
+    for task, jobs in ((100, (1, 2)), (101, (3,))):
+        calls = [f"run_job {job:05d} /jobs/{job:05d}_run.sh" for job in jobs]
+        (scripts / f"sb-0002-{task}.sh").write_text("\n".join(calls))
+    (scripts / "sb-0002.sh").write_text("#SBATCH --array=100-101")
+    return dirs
+
+
+def test_import_relay_submissions(dirs, tmp_path):
+    lines = [
+        "2\t5001\tsb-0002\t1000.5\tsmoke\t2022-01-01",
+        "3\t5002\tsb-0002-relay\t1001\t\t",
+        "4\t\tsb-0004\t1002\tsmoke\t2022-01-01",  # the relay failed to submit it
+        "garbage",
+    ]
+    path = tmp_path / "project" / RELAY_SUBMISSIONS_FILE
+    path.write_text("\n".join(lines) + "\n")
+
+    assert import_relay_submissions(dirs) == 2
+    assert import_relay_submissions(dirs) == 0  # already recorded
+
+    state_db = SlurmhelperDB(dirs)
+    submissions = {s["slurm_job_id"]: s for s in state_db.get_submissions()}
+    assert sorted(submissions) == [5001, 5002]
+    assert submissions[5001]["submitted_at"] == 1000.5
+    assert submissions[5001]["spec_version"] == "2022-01-01"
+    assert submissions[5002]["spec_name"] is None
+
+    walk = state_db.crosswalk(order_ids=[1, 2, 3])
+    assert [(r["order_id"], r["array_task"], r["slurm_job_id"]) for r in walk] == [
+        (1, 100, 5001),
+        (2, 100, 5001),
+        (3, 101, 5001),
+    ]
+
+    events = read_events(dirs)
+    assert events["event"].tolist() == ["submitted"] * 3
+    assert events["slurm_id"].tolist() == ["5001_100", "5001_100", "5001_101"]
+    assert (events["at"] == 1000.5).all()
+
+
+def test_submit_many_reports_unrecorded_submissions(
+    dirs, tmp_path, monkeypatch, capsys
+):
+    scripts = tmp_path / "project" / "scripts" / "slurm"
+    for sbatch_id in (5, 6, 7):
+        (scripts / f"sb-{sbatch_id:04d}.sh").write_text("run_job 00001 /x_run.sh")
+    (tmp_path / "project" / "crashes").mkdir()
+
+    outputs = {"sb-0005": "5005", "sb-0006": "5006", "sb-0007": "oops"}
+
+    def run_sbatch(args, cwd, **kwargs):
+        name = args[-1].rsplit("/", 1)[-1][:-3]
+        return f"Submitted batch job {outputs[name]}\n"
+
+    def record_submission(dirs, sbatch_id, slurm_id, job_name, config=None):
+        if sbatch_id == 6:
+            raise sqlite3.OperationalError("database is locked")
+
+    monkeypatch.setattr(submit, "run_sbatch", run_sbatch)
+    monkeypatch.setattr(submit, "record_submission", record_submission)
+
+    results = submit_many([5, 6, 7, 8], dirs)
+    assert results[5] == "5005"
+    assert isinstance(results[6], SubmissionNotRecorded)
+    assert results[6].slurm_id == "5006"
+    assert isinstance(results[7], ValueError)  # no Slurm id in sbatch's output
+    assert isinstance(results[8], FileNotFoundError)
+
+    out = capsys.readouterr().out
+    assert "sbatch jobs submitted: 2/4" in out
+    assert "sb-0006 submitted as Slurm job 5006, not recorded: database is" in out
+    assert "sb-0007 not submitted" in out and "sb-0008 not submitted" in out
+
+
+def test_relay_records_failed_submissions(dirs, tmp_path, caplog):
+    config = {"header": "#!/bin/bash -e", "spec_name": "smoke"}
+    args = argparse.Namespace(dry=False)
+    _prep_relay_script(config, dirs, args, 1, 2, next_has_relay=True)
+
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    (bin_dir / "sbatch").write_text(
+        "#!/bin/sh\necho 'Batch job submission failed' >&2\nexit 1\n"
+    )
+    (bin_dir / "sbatch").chmod(0o755)
+    relay = tmp_path / "project" / "scripts" / "slurm" / "sb-0001-relay.sh"
+    subprocess.run(
+        ["bash", str(relay)],
+        env={"PATH": f"{bin_dir}:/usr/bin:/bin"},
+        check=True,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+    path = tmp_path / "project" / RELAY_SUBMISSIONS_FILE
+    lines = [line.split("\t") for line in path.read_text().splitlines()]
+    assert [line[:3] for line in lines] == [
+        ["2", "", "sb-0002"],
+        ["2", "", "sb-0002-relay"],
+    ]
+    assert import_relay_submissions(dirs) == 0
+    assert "A relay job failed to submit sb-0002." in caplog.text
+
+
+@pytest.fixture
+def fake_sbatch(tmp_path, monkeypatch):
+    """
+    Put an sbatch on PATH that runs a given shell snippet, with $n set to the number
+    of the call (from 1), and its arguments in "$*"; calls are logged to calls.txt.
+    """
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    calls = tmp_path / "calls.txt"
+
+    def install(body):
+        (bin_dir / "sbatch").write_text(
+            "#!/bin/sh\n"
+            f"echo \"$*\" >> {calls}\n"
+            f"n=$(wc -l < {calls})\n" + body
+        )
+        (bin_dir / "sbatch").chmod(0o755)
+        return calls
+
+    return install
+
+
+@pytest.mark.parametrize(
+    "error",
+    [
+        "sbatch: error: Batch job submission failed: Socket timed out on send/recv",
+        "sbatch: error: QOSMaxSubmitJobPerUserLimit",
+    ],
+)
+def test_submit_sbatch_retries_transient_errors(dirs, tmp_path, fake_sbatch, error):
+    (tmp_path / "project" / "crashes").mkdir()
+    calls = fake_sbatch(
+        f'if [ "$n" -eq 1 ]; then echo "{error}" >&2; exit 1; fi\n'
+        "echo 'Submitted batch job 5001'\n"
+    )
+
+    output = submit_sbatch(2, dirs, backoff=0)
+    assert output.strip() == "Submitted batch job 5001"
+    assert len(calls.read_text().splitlines()) == 2
+    submissions = SlurmhelperDB(dirs).get_submissions()
+    assert [s["slurm_job_id"] for s in submissions] == [5001]
+
+
+def test_run_sbatch_gives_up(tmp_path, fake_sbatch):
+    calls = fake_sbatch("echo 'sbatch: error: Invalid account' >&2; exit 1\n")
+    with pytest.raises(subprocess.CalledProcessError) as err:
+        run_sbatch(["x.sh"], cwd=str(tmp_path), backoff=0)
+    assert "Invalid account" in err.value.stderr
+    assert len(calls.read_text().splitlines()) == 1  # not a transient error
+
+    calls.unlink()
+    fake_sbatch("echo 'sbatch: error: Socket timed out' >&2; exit 1\n")
+    with pytest.raises(subprocess.CalledProcessError):
+        run_sbatch(["x.sh"], cwd=str(tmp_path), max_retries=2, backoff=0)
+    assert len(calls.read_text().splitlines()) == 3
+
+
+def test_submit_sbatch_relay_not_submitted(dirs, tmp_path, fake_sbatch, capsys):
+    (tmp_path / "project" / "crashes").mkdir()
+    scripts = tmp_path / "project" / "scripts" / "slurm"
+    (scripts / "sb-0002-relay.sh").write_text("#!/bin/bash")
+    fake_sbatch(
+        'case "$*" in *-relay.sh) echo "sbatch: error: Invalid account" >&2; exit 1;; '
+        "esac\necho 'Submitted batch job 5001'\n"
+    )
+
+    with pytest.raises(RelayNotSubmitted) as err:
+        submit_sbatch(2, dirs, backoff=0)
+    assert err.value.slurm_id == "5001"
+    assert "Array sb-0002 submitted, relay sb-0002-relay.sh not submitted" in (
+        capsys.readouterr().out
+    )
+    # the array itself was recorded
+    submissions = SlurmhelperDB(dirs).get_submissions()
+    assert [s["slurm_job_id"] for s in submissions] == [5001]
+
+    results = submit_many([2], dirs, backoff=0)
+    assert isinstance(results[2], RelayNotSubmitted)
+    out = capsys.readouterr().out
+    assert "sbatch jobs submitted: 1/1" in out
+    assert "sb-0002 submitted as Slurm job 5001, relay not submitted: " in out
+
+
+def test_submit_sbatch_unexpected_relay_output(dirs, tmp_path, fake_sbatch):
+    (tmp_path / "project" / "crashes").mkdir()
+    scripts = tmp_path / "project" / "scripts" / "slurm"
+    (scripts / "sb-0002-relay.sh").write_text("#!/bin/bash")
+    fake_sbatch(
+        'case "$*" in *-relay.sh) echo "sbatch: warning: oops";; '
+        "*) echo 'Submitted batch job 5001';; esac\n"
+    )
+
+    with pytest.raises(SubmissionNotRecorded) as err:
+        submit_sbatch(2, dirs, backoff=0)
+    assert "Unexpected output from sbatch" in str(err.value)
+    submissions = SlurmhelperDB(dirs).get_submissions()
+    assert [s["slurm_job_id"] for s in submissions] == [5001]
@@ -0,0 +1,130 @@
+import glob
+import os
+
+import pandas as pd
+import pytest
+
+from slurmhelper.utils.io import calculate_directories
+from slurmhelper.utils.logs import RECORD_FIELDS, scan_job_logs
+from slurmhelper.utils.validation import (
+    STATUS_EXPORT_COLUMNS,
+    build_status_table,
+    match_names,
+    validate_jobs,
+)
+
+NAMES = [
+    ".hidden",
+    ".sub-01_T1w.nii.gz",
+    "Sub-01_T1w.nii",
+    "a[b",
+    "ab",
+    "sub-01_T1w.nii.gz",
+    "sub-01_[x].txt",
+    "sub-01_bold.nii.gz",
+    "sub-02_T1w.nii",
+    "sub-1",
+    "x.txt",
+]
+
+
+@pytest.mark.parametrize(
+    "pattern",
+    [
+        "*",
+        ".*",
+        "*hidden",
+        "[.]hidden",
+        "?hidden",
+        ".h*",
+        "sub-01_*",
+        "sub-01_*.nii.gz",
+        "sub-0[12]_T1w*",
+        "sub-0[!1]_*",
+        "?ub-01*",
+        "sub-01_[[]x].txt",
+        "a[b",
+        "a[b]",
+        "sub-01_T1w.nii.gz",  # no wildcard
+        ".hidden",
+        "missing",
+        "sub-*",
+    ],
+)
+def test_match_names_as_glob(tmp_path, pattern):
+    for name in NAMES:
+        (tmp_path / name).write_text("")
+    names = sorted(os.listdir(tmp_path))
+    paths = glob.glob(os.path.join(glob.escape(str(tmp_path)), pattern))
+    expected = sorted(os.path.basename(p) for p in paths)
+    assert match_names(names, pattern) == expected
+
+
+@pytest.fixture
+def project(tmp_path):
+    """
+    Four jobs: 1 is fine, 2 left no outputs, 3 left one output (of two) and its
+    inputs and work dirs, 4 has its outputs but exited with status 3.
+    """
+    (tmp_path / "project").mkdir()
+    dirs = calculate_directories(str(tmp_path), "project")
+    for key in ("job_logs", "job_results", "job_inputs", "job_work"):
+        os.makedirs(dirs[key])
+    db = pd.DataFrame({"order_id": [1, 2, 3, 4], "subject": ["s1", "s2", "s3", "s4"]})
+    config = {
+        "output_path": str(tmp_path / "outputs"),
+        "output_path_subject": ["sub-{subject}"],
+        "output_path_subject_expr": "sub-{subject}_*.nii",
+        "expected_n_files": 2,
+    }
+
+    for job, subject, n_outputs in ((1, "s1", 2), (3, "s3", 1), (4, "s4", 2)):
+        out = tmp_path / "outputs" / f"sub-{subject}"
+        out.mkdir(parents=True)
+        for i in range(n_outputs):
+            (out / f"sub-{subject}_{i}.nii").write_text("")
+        (out / f".sub-{subject}_tmp.nii").write_text("")  # hidden, not counted
+    for key in ("job_inputs", "job_work"):
+        os.makedirs(os.path.join(dirs[key], "00003"))
+
+    for job in (1, 2, 3, 4):
+        with open(os.path.join(dirs["job_logs"], f"{job:05d}.txt"), "w") as f:
+            f.write("runtime: 5\nSUCCESS\n0\n")
+    with open(os.path.join(dirs["job_results"], "00004.tsv"), "w") as f:
+        values = ["4", "100", "160", "3", "n1", "", "", ""]
+        f.write("\t".join(RECORD_FIELDS) + "\n" + "\t".join(values) + "\n")
+
+    status = scan_job_logs(
+        dirs["job_logs"], [1, 2, 3, 4], results_dir=dirs["job_results"]
+    )
+    return db, config, dirs, status
+
+
+def test_validate_jobs(project):
+    db, config, dirs, status = project
+    df, timings = validate_jobs(db, config, dirs, status, n_workers=2)
+
+    assert timings is None
+    assert df["valid"].to_dict() == {1: True, 2: False, 3: False, 4: False}
+    assert df["result_check_outputs"].tolist() == [True, False, False, True]
+    assert df.loc[2, "log_check_outputs"] == "Output directory does not exist."
+    assert df.loc[3, "log_check_outputs"].endswith("expected = 2, found = 1")
+    assert df["result_check_inputs"].tolist() == [True, True, False, True]
+    assert df["result_check_work"].tolist() == [True, True, False, True]
+    assert df.loc[3, "log_check_work"].endswith(os.path.join("work", "00003"))
+    assert df["result_check_log"].tolist() == [True, True, True, False]
+    assert df.loc[4, "log_check_log"].startswith("Job exited with status 3 (see ")
+    assert df.loc[1, "glob_output_expr"] == "sub-s1_*.nii"
+
+
+def test_build_status_table(project):
+    db, config, dirs, status = project
+    df = build_status_table(status, db, config, dirs, n_workers=2)
+
+    assert tuple(df.columns) == STATUS_EXPORT_COLUMNS
+    assert df["output_dir_exists"].tolist() == [True, False, True, True]
+    assert df["n_outputs"].tolist() == [2, pd.NA, 1, 2]
+    assert df["outputs_ok"].tolist() == [True, pd.NA, False, True]
+    assert df["has_inputs_dir"].tolist() == [False, False, True, False]
+    assert df["success"].tolist() == [True, True, True, False]
+    assert df.loc[4, "exit_code"] == 3